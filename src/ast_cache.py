@@ -0,0 +1,130 @@
+import hashlib
+import io
+import os
+import pickle
+import sys
+from typing import Optional
+
+import expr
+import stmt
+from environment import GlobalSlots
+from stmt import Stmt
+from token import Token
+from tokentype import TokenType
+
+# bump whenever the node classes, the Resolver's annotations or the Optimizer
+# change, so stale caches are rebuilt rather than loaded
+CACHE_VERSION = 5
+MAGIC = b"LOXC"
+CACHE_DIR = "__loxcache__"
+
+# everything a cached tree is built from, the only classes a cache file may name
+TREE_CLASSES = {
+    (cls.__module__, cls.__name__): cls
+    for cls in [*vars(expr).values(), *vars(stmt).values(), Token, TokenType]
+    if isinstance(cls, type) and (issubclass(cls, (expr.Expr, Stmt)) or cls in (Token, TokenType))
+}
+
+
+class TreeUnpickler(pickle.Unpickler):
+    """
+    Loads a pickled tree without trusting the file. A pickle can name any
+    importable callable to run it, and anyone who can write next to the
+    script could write a matching header, so only the node classes, Token and
+    TokenType can be looked up
+    """
+
+    def find_class(self, module: str, name: str):
+        cls = TREE_CLASSES.get((module, name))
+        if cls is None:
+            raise pickle.UnpicklingError(f"{module}.{name} is not part of a tree")
+        return cls
+
+
+def _rebind_globals(statements: list[Stmt], indexes: list[int]) -> None:
+    """
+    Points every global_slot in a tree at indexes[global_slot]. Iterative,
+    a tree deep enough to pickle can be too deep to walk recursively
+    """
+    stack = list(statements)
+    seen = set()
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        for name in node.__slots__:
+            value = getattr(node, name)
+            if name == "global_slot":
+                if value is not None:
+                    setattr(node, name, indexes[value])
+            elif isinstance(value, (expr.Expr, Stmt)):
+                stack.append(value)
+            elif type(value) is list:
+                stack.extend(item for item in value if isinstance(item, (expr.Expr, Stmt)))
+
+
+class AstCache:
+    """
+    The resolved (and with -O, optimized) statements of one script, pickled
+    to __loxcache__/<script>.loxc next to it. The header holds the cache
+    version, the Python version and a sha256 of the source, and a cache whose
+    header doesn't match is treated as missing. The global names are stored
+    too, since the tree refers to globals by the index they were given,
+    and a tree loaded into a table that gave them other indexes is rebound
+    to those. source is the script's bytes, or a memory map of them with --mmap
+    """
+
+    def __init__(self, path: str, source, optimize: bool, lazy: bool = False):
+        directory, name = os.path.split(os.path.abspath(path))
+        suffix = (".opt" if optimize else "") + (".lazy" if lazy else "") + ".loxc"
+        self.path = os.path.join(directory, CACHE_DIR, name + suffix)
+        self.header = b"".join([
+            MAGIC,
+            CACHE_VERSION.to_bytes(2, "little"),
+            bytes([sys.version_info.major, sys.version_info.minor]),
+            hashlib.sha256(source).digest(),
+        ])
+        # why the last load missed, for --cache-stats
+        self.miss_reason = ""
+
+    def load(self, global_slots: GlobalSlots) -> Optional[list[Stmt]]:
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.miss_reason = "no cache file"
+            return None
+        if not data.startswith(self.header):
+            self.miss_reason = "source or interpreter changed"
+            return None
+        try:
+            names, statements = TreeUnpickler(io.BytesIO(memoryview(data)[len(self.header):])).load()
+        except Exception:
+            self.miss_reason = "unreadable cache file"
+            return None
+        indexes = global_slots.indexes_of(names)
+        if indexes != list(range(len(indexes))):
+            _rebind_globals(statements, indexes)
+        return statements
+
+    def store(self, statements: list[Stmt], global_slots: GlobalSlots) -> int:
+        """
+        Writes the cache, returning its size in bytes or 0 if it couldn't.
+        global_slots is the table the statements were resolved against
+        """
+        try:
+            payload = pickle.dumps((global_slots.names, statements), protocol=pickle.HIGHEST_PROTOCOL)
+        except (RecursionError, pickle.PicklingError):
+            # a very deeply nested tree, just run without a cache
+            return 0
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(self.header)
+                f.write(payload)
+            os.replace(temp_path, self.path)
+        except OSError:
+            return 0
+        return len(self.header) + len(payload)
@@ -0,0 +1,148 @@
+from typing import Any, Optional
+
+from token import Token
+
+# opcodes are plain ints so the dispatch loop in vm.py compares small ints
+OP_CONSTANT = 0
+OP_NIL = 1
+OP_TRUE = 2
+OP_FALSE = 3
+OP_POP = 4
+OP_GET_LOCAL = 5
+OP_SET_LOCAL = 6
+OP_GET_GLOBAL = 7
+OP_DEFINE_GLOBAL = 8
+OP_SET_GLOBAL = 9
+OP_GET_UPVALUE = 10
+OP_SET_UPVALUE = 11
+OP_GET_PROPERTY = 12
+OP_SET_PROPERTY = 13
+OP_EQUAL = 14
+OP_NOT_EQUAL = 15
+OP_GREATER = 16
+OP_GREATER_EQUAL = 17
+OP_LESS = 18
+OP_LESS_EQUAL = 19
+OP_ADD = 20
+OP_SUBTRACT = 21
+OP_MULTIPLY = 22
+OP_DIVIDE = 23
+OP_NOT = 24
+OP_NEGATE = 25
+OP_PRINT = 26
+OP_JUMP = 27
+OP_POP_JUMP_IF_FALSE = 28
+OP_JUMP_IF_FALSE_OR_POP = 29
+OP_JUMP_IF_TRUE_OR_POP = 30
+OP_CALL = 31
+OP_INVOKE = 32
+OP_CLOSURE = 33
+OP_CLOSE_UPVALUE = 34
+OP_RETURN = 35
+OP_CLASS = 36
+OP_METHOD = 37
+OP_TAIL_CALL = 38
+OP_TAIL_INVOKE = 39
+
+OP_NAMES = {value: name for name, value in globals().items() if name.startswith("OP_")}
+
+# number of operands that follow each opcode in the code list, OP_CLOSURE
+# is followed by an extra (is_local, index) pair per captured upvalue
+OPERAND_COUNTS = {
+    OP_CONSTANT: 1,
+    OP_GET_LOCAL: 1,
+    OP_SET_LOCAL: 1,
+    OP_GET_GLOBAL: 1,
+    OP_DEFINE_GLOBAL: 1,
+    OP_SET_GLOBAL: 1,
+    OP_GET_UPVALUE: 1,
+    OP_SET_UPVALUE: 1,
+    OP_GET_PROPERTY: 1,
+    OP_SET_PROPERTY: 1,
+    OP_JUMP: 1,
+    OP_POP_JUMP_IF_FALSE: 1,
+    OP_JUMP_IF_FALSE_OR_POP: 1,
+    OP_JUMP_IF_TRUE_OR_POP: 1,
+    OP_CALL: 1,
+    OP_INVOKE: 2,
+    OP_TAIL_CALL: 1,
+    OP_TAIL_INVOKE: 2,
+    OP_CLOSURE: 1,
+    OP_CLASS: 1,
+    OP_METHOD: 1,
+}
+
+
+class Chunk:
+    """
+    A flat list of opcodes and operands, with a parallel list holding the
+    token each instruction reports runtime errors against
+    """
+
+    def __init__(self):
+        self.code: list[int] = []
+        self.tokens: list[Optional[Token]] = []
+        self.constants: list[Any] = []
+        self._constant_index: dict = {}
+
+    def write(self, byte: int, token: Optional[Token] = None) -> int:
+        self.code.append(byte)
+        self.tokens.append(token)
+        return len(self.code) - 1
+
+    def add_constant(self, value: Any) -> int:
+        if isinstance(value, (str, float)):
+            # keyed on type as well, 1.0 and "1" must not share a slot
+            key = (type(value), value)
+            index = self._constant_index.get(key)
+            if index is None:
+                index = len(self.constants)
+                self.constants.append(value)
+                self._constant_index[key] = index
+            return index
+        self.constants.append(value)
+        return len(self.constants) - 1
+
+    def disassemble(self, name: str) -> str:
+        lines = [f"== {name} =="]
+        offset = 0
+        while offset < len(self.code):
+            op = self.code[offset]
+            count = OPERAND_COUNTS.get(op, 0)
+            operands = self.code[offset + 1:offset + 1 + count]
+            text = f"{offset:04d} {OP_NAMES[op]:<24}"
+            if op in (OP_CONSTANT, OP_GET_GLOBAL, OP_DEFINE_GLOBAL, OP_SET_GLOBAL,
+                      OP_GET_PROPERTY, OP_SET_PROPERTY, OP_CLASS, OP_METHOD, OP_CLOSURE):
+                text += f"{operands[0]:4d} '{self.constants[operands[0]]}'"
+            elif op in (OP_INVOKE, OP_TAIL_INVOKE):
+                text += f"({operands[1]} args) {operands[0]:4d} '{self.constants[operands[0]]}'"
+            elif operands:
+                text += " ".join(f"{operand:4d}" for operand in operands)
+            lines.append(text)
+            if op == OP_CLOSURE:
+                function = self.constants[operands[0]]
+                upvalues = self.code[offset + 2:offset + 2 + 2 * function.upvalue_count]
+                for i in range(0, len(upvalues), 2):
+                    kind = "local" if upvalues[i] else "upvalue"
+                    lines.append(f"{offset + 2 + i:04d}    | {kind} {upvalues[i + 1]}")
+                offset += 2 * function.upvalue_count
+            offset += 1 + count
+        return "\n".join(lines)
+
+
+class FunctionProto:
+    """
+    The compiled form of a Lox function: its code plus how many upvalues the
+    closures created from it capture
+    """
+
+    def __init__(self, name: str, arity: int):
+        self.name = name
+        self.arity = arity
+        self.upvalue_count = 0
+        self.chunk = Chunk()
+
+    def __str__(self):
+        if self.name == "":
+            return "<script>"
+        return f"<fn {self.name}>"
@@ -0,0 +1,560 @@
+import operator
+from typing import Any, Callable
+
+from environment import UNDEFINED, Cell, GlobalEnvironment
+from error_handler import ErrorHandler
+from expr import (
+    Assign,
+    Binary,
+    Call,
+    Get,
+    Grouping,
+    Literal,
+    Logical,
+    Set,
+    This,
+    Unary,
+    Variable
+)
+from inline_cache import fill_get_cache, get_property, set_property
+from interpreter import Interpreter
+from lox_callable import LoxCallable
+from lox_class import LoxClass
+from frame_pool import FramePool
+from lox_function import capture
+from lox_instance import LoxInstance
+from native import Clock
+from runtime_error import LoxRuntimeError
+from stmt import (
+    Block,
+    Class,
+    Expression,
+    For,
+    Function,
+    If,
+    Print,
+    Return,
+    Stmt,
+    Var,
+    While
+)
+from token import Token
+from tokentype import TokenType
+from visitor import Visitor
+
+# compiled expressions take the running frame, a list of locals by the
+# Resolver's slots, and return a value, compiled statements return None or a
+# 1-tuple holding a returned value
+Code = Callable[[list], Any]
+
+_stringify = Interpreter._stringify
+_is_equal = Interpreter._is_equal
+
+
+def _check_numeric_opers(operator: Token, left, right):
+    if isinstance(left, (float, int)) and isinstance(right, (float, int)):
+        return
+    raise LoxRuntimeError(operator, "Operands must be a number.")
+
+
+class CompiledFunction(LoxCallable):
+    def __init__(self, declaration: Function, body: Code, cells: tuple, is_initializer: bool, this=None):
+        self.declaration = declaration
+        self.body = body
+        self.cells = cells
+        self.is_initializer = is_initializer
+        self.this = this
+
+    def bind(self, instance):
+        return CompiledFunction(self.declaration, self.body, self.cells, self.is_initializer, instance)
+
+    def call(self, interpreter, arguments):
+        if self.this is not None:
+            return self.invoke(interpreter, self.this, arguments)
+
+        frame = interpreter.frame_pool.acquire(self.declaration)
+        frame[:len(arguments)] = arguments
+        return self.run(interpreter, frame)
+
+    def invoke(self, interpreter, this, arguments):
+        frame = interpreter.frame_pool.acquire(self.declaration)
+        frame[0] = this
+        frame[1:len(arguments) + 1] = arguments
+        return self.run(interpreter, frame, this)
+
+    def run(self, interpreter, frame: list, this=None):
+        """LoxFunction.run for compiled bodies"""
+        declaration = self.declaration
+        for slot in declaration.cell_params:
+            frame[slot] = Cell(frame[slot])
+        for slot, cell in self.cells:
+            frame[slot] = cell
+        completion = self.body(frame)
+        interpreter.frame_pool.release(declaration, frame)
+        if self.is_initializer:
+            return this
+        if completion is not None:
+            return completion[0]
+        return None
+
+    def arity(self) -> int:
+        return len(self.declaration.params)
+
+    def __str__(self):
+        return f"<fn {self.declaration.name.lexeme}>"
+
+
+class ClosureCompiler(Visitor):
+    """
+    Turns resolved statements into a tree of nested Python closures, one per
+    node, with operators and resolved slots bound at compile time
+    """
+
+    def __init__(self):
+        self.error_handler = ErrorHandler()
+        self.globals = GlobalEnvironment()
+        self.frame_pool = FramePool()
+        # --mem-stats is only supported by the tree walker, see Interpreter
+        self.memory_stats = None
+
+        self.globals.define("clock", Clock())
+
+    def interpret(self, statements: list[Stmt]):
+        code = self._compile_statements(statements)
+        try:
+            # nothing at top level runs in a frame until a block or loop
+            code([])
+        except LoxRuntimeError as e:
+            self.error_handler.runtime_error(e)
+
+    def _compile(self, node) -> Code:
+        return node.accept(self)
+
+    def _compile_statements(self, statements: list[Stmt]) -> Code:
+        compiled = tuple(self._compile(statement) for statement in statements)
+
+        def run(env):
+            for statement in compiled:
+                completion = statement(env)
+                if completion is not None:
+                    return completion
+            return None
+        return run
+
+    def _lookup(self, name: Token, expr: Variable | This) -> Code:
+        slot = expr.slot
+        if slot is None:
+            index = expr.global_slot
+            self.globals.reserve(index)
+            values = self.globals.values
+
+            def lookup_global(env):
+                value = values[index]
+                if value is UNDEFINED:
+                    raise LoxRuntimeError(name, f"Undefined variable '{name.lexeme}'.")
+                return value
+            return lookup_global
+        if expr.captured:
+            return lambda env: env[slot].value
+        return lambda env: env[slot]
+
+    def _define(self, declaration: Var | Function | Class, value_code: Code) -> Code:
+        slot = declaration.slot
+        if slot is None:
+            index = declaration.global_slot
+            self.globals.reserve(index)
+            values = self.globals.values
+
+            def define_global(env):
+                values[index] = value_code(env)
+            return define_global
+
+        if declaration.captured:
+            # the Cell goes in first, so a function or class can capture its
+            # own name, and is new every time, so each loop iteration has one
+            def define_cell(env):
+                cell = env[slot] = Cell()
+                cell.value = value_code(env)
+            return define_cell
+
+        def define(env):
+            env[slot] = value_code(env)
+        return define
+
+    # statements
+
+    def visit_block_stmt(self, stmt: Block) -> Code:
+        body = self._compile_statements(stmt.statements)
+        size = stmt.slot_count
+        if size == 0:
+            return body
+        # a block at top level, with a frame of its own
+        return lambda env: body([None] * size)
+
+    def visit_class_stmt(self, stmt: Class) -> Code:
+        name = stmt.name.lexeme
+        methods = [
+            (method, self._compile_statements(method.body))
+            for method in stmt.methods
+        ]
+
+        def make_class(env):
+            functions = dict()
+            for method, body in methods:
+                is_initializer = method.name.lexeme == "init"
+                functions[method.name.lexeme] = CompiledFunction(method, body, capture(method, env), is_initializer)
+            return LoxClass(name, functions)
+        return self._define(stmt, make_class)
+
+    def visit_expression_stmt(self, stmt: Expression) -> Code:
+        expression = self._compile(stmt.expression)
+
+        def run(env):
+            expression(env)
+        return run
+
+    def visit_for_stmt(self, stmt: For) -> Code:
+        initializer = self._compile(stmt.initializer) if stmt.initializer is not None else None
+        condition = self._compile(stmt.condition) if stmt.condition is not None else None
+        increment = self._compile(stmt.increment) if stmt.increment is not None else None
+        body = self._compile(stmt.body)
+        size = stmt.slot_count
+
+        def loop(env):
+            while True:
+                if condition is not None:
+                    value = condition(env)
+                    if value is None or value is False:
+                        return None
+                completion = body(env)
+                if completion is not None:
+                    return completion
+                if increment is not None:
+                    increment(env)
+
+        run_loop = loop
+        if stmt.counted:
+            slot = stmt.initializer.slot
+            step = int(stmt.increment.value.right.value)
+            below = operator.le if stmt.condition.operator.token_type == TokenType.LESS_EQUAL else operator.lt
+            bound_code = self._compile(stmt.condition.right)
+
+            def counted_loop(env):
+                values = env
+                start = values[slot]
+                if type(start) is not float or not start.is_integer():
+                    return loop(env)
+                i = int(start)
+                while True:
+                    bound = bound_code(env)
+                    if type(bound) is not float:
+                        return loop(env)
+                    if not below(i, bound):
+                        return None
+                    completion = body(env)
+                    if completion is not None:
+                        return completion
+                    i += step
+                    values[slot] = float(i)
+            run_loop = counted_loop
+
+        def run(env):
+            if initializer is not None:
+                initializer(env)
+            return run_loop(env)
+        if size == 0:
+            return run
+        # a loop at top level, with a frame of its own
+        return lambda env: run([None] * size)
+
+    def visit_function_stmt(self, stmt: Function) -> Code:
+        body = self._compile_statements(stmt.body)
+        return self._define(stmt, lambda env: CompiledFunction(stmt, body, capture(stmt, env), False))
+
+    def visit_if_stmt(self, stmt: If) -> Code:
+        condition = self._compile(stmt.condition)
+        then_branch = self._compile(stmt.then_branch)
+        if stmt.else_branch is None:
+            def run(env):
+                value = condition(env)
+                if value is not None and value is not False:
+                    return then_branch(env)
+                return None
+            return run
+
+        else_branch = self._compile(stmt.else_branch)
+
+        def run_else(env):
+            value = condition(env)
+            if value is not None and value is not False:
+                return then_branch(env)
+            return else_branch(env)
+        return run_else
+
+    def visit_print_stmt(self, stmt: Print) -> Code:
+        expression = self._compile(stmt.expression)
+
+        def run(env):
+            print(_stringify(expression(env)))
+        return run
+
+    def visit_return_stmt(self, stmt: Return) -> Code:
+        if stmt.value is None:
+            return lambda env: (None,)
+        value = self._compile(stmt.value)
+        return lambda env: (value(env),)
+
+    def visit_var_stmt(self, stmt: Var) -> Code:
+        if stmt.initializer is None:
+            return self._define(stmt, lambda env: None)
+        return self._define(stmt, self._compile(stmt.initializer))
+
+    def visit_while_stmt(self, stmt: While) -> Code:
+        condition = self._compile(stmt.condition)
+        body = self._compile(stmt.body)
+
+        def run(env):
+            while True:
+                value = condition(env)
+                if value is None or value is False:
+                    return None
+                completion = body(env)
+                if completion is not None:
+                    return completion
+        return run
+
+    # expressions
+
+    def visit_assign_expr(self, expr: Assign) -> Code:
+        value_code = self._compile(expr.value)
+        name = expr.name
+        slot = expr.slot
+        if slot is None:
+            index = expr.global_slot
+            self.globals.reserve(index)
+            values = self.globals.values
+
+            def assign_global(env):
+                value = value_code(env)
+                if values[index] is UNDEFINED:
+                    raise LoxRuntimeError(name, f"Undefined variable '{name.lexeme}'.")
+                values[index] = value
+                return value
+            return assign_global
+
+        if expr.captured:
+            def assign_cell(env):
+                value = value_code(env)
+                env[slot].value = value
+                return value
+            return assign_cell
+
+        def assign(env):
+            value = value_code(env)
+            env[slot] = value
+            return value
+        return assign
+
+    def visit_binary_expr(self, expr: Binary) -> Code:
+        left = self._compile(expr.left)
+        right = self._compile(expr.right)
+        operator = expr.operator
+        token_type = operator.token_type
+
+        if token_type == TokenType.PLUS:
+            def add(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is float and type(b) is float:
+                    return a + b
+                if isinstance(a, str) and isinstance(b, str):
+                    return a + b
+                raise LoxRuntimeError(operator, "Operands must be two numbers or two strings.")
+            return add
+        if token_type == TokenType.EQUAL_EQUAL:
+            return lambda env: _is_equal(left(env), right(env))
+        if token_type == TokenType.BANG_EQUAL:
+            return lambda env: not _is_equal(left(env), right(env))
+
+        op = _NUMERIC_OPS[token_type]
+
+        def numeric(env):
+            a = left(env)
+            b = right(env)
+            if type(a) is not float or type(b) is not float:
+                _check_numeric_opers(operator, a, b)
+                a = float(a)
+                b = float(b)
+            return op(a, b)
+        return numeric
+
+    def visit_call_expr(self, expr: Call) -> Code:
+        arguments = tuple(self._compile(argument) for argument in expr.arguments)
+        paren = expr.paren
+        interpreter = self
+        if type(expr.callee) is Get:
+            return self._invoke(expr.callee, arguments, paren)
+
+        callee = self._compile(expr.callee)
+        pool = self.frame_pool
+        count = len(arguments)
+
+        def call(env):
+            function = callee(env)
+            # the arguments go straight into a pooled frame, as in
+            # Interpreter._call
+            if type(function) is CompiledFunction and function.this is None:
+                target = function
+                slot = 0
+            elif type(function) is LoxClass:
+                target = function.methods.get("init")
+                slot = 1
+            else:
+                target = None
+            if target is not None and len(target.declaration.params) == count:
+                frame = pool.acquire(target.declaration)
+                for argument in arguments:
+                    frame[slot] = argument(env)
+                    slot += 1
+                if target is function:
+                    return target.run(interpreter, frame)
+                instance = frame[0] = LoxInstance(function)
+                return target.run(interpreter, frame, instance)
+            if not isinstance(function, LoxCallable):
+                raise LoxRuntimeError(paren, "Can only call functions and classes.")
+            values = [argument(env) for argument in arguments]
+            if len(values) != function.arity():
+                raise LoxRuntimeError(paren, f"Expected {function.arity()} arguments but got {len(values)}.")
+            return function.call(interpreter, values)
+        return call
+
+    def _invoke(self, site: Get, arguments: tuple[Code, ...], paren: Token) -> Code:
+        obj_code = self._compile(site.obj)
+        name = site.name
+        interpreter = self
+        pool = self.frame_pool
+        count = len(arguments)
+
+        def invoke(env):
+            obj = obj_code(env)
+            if not isinstance(obj, LoxInstance):
+                raise LoxRuntimeError(name, "Only instances have properties.")
+            if obj.shape is not site.ic_shape:
+                fill_get_cache(site, obj)
+            method = site.ic_method
+            if method is not None and len(method.declaration.params) == count:
+                # the arguments go straight into a pooled frame after this
+                frame = pool.acquire(method.declaration)
+                frame[0] = obj
+                slot = 1
+                for argument in arguments:
+                    frame[slot] = argument(env)
+                    slot += 1
+                return method.run(interpreter, frame, obj)
+            if method is None:
+                function = obj.values[site.ic_index]
+                if not isinstance(function, LoxCallable):
+                    raise LoxRuntimeError(paren, "Can only call functions and classes.")
+            else:
+                function = method
+            values = [argument(env) for argument in arguments]
+            if len(values) != function.arity():
+                raise LoxRuntimeError(paren, f"Expected {function.arity()} arguments but got {len(values)}.")
+            if method is None:
+                return function.call(interpreter, values)
+            return method.invoke(interpreter, obj, values)
+        return invoke
+
+    def visit_get_expr(self, expr: Get) -> Code:
+        obj_code = self._compile(expr.obj)
+        name = expr.name
+
+        def get(env):
+            obj = obj_code(env)
+            if isinstance(obj, LoxInstance):
+                if obj.shape is expr.ic_shape:
+                    if expr.ic_method is None:
+                        return obj.values[expr.ic_index]
+                    return expr.ic_method.bind(obj)
+                return get_property(expr, obj)
+            raise LoxRuntimeError(name, "Only instances have properties.")
+        return get
+
+    def visit_grouping_expr(self, expr: Grouping) -> Code:
+        return self._compile(expr.expression)
+
+    def visit_literal_expr(self, expr: Literal) -> Code:
+        value = expr.value
+        return lambda env: value
+
+    def visit_logical_expr(self, expr: Logical) -> Code:
+        left = self._compile(expr.left)
+        right = self._compile(expr.right)
+        if expr.operator.token_type == TokenType.OR:
+            def logical_or(env):
+                value = left(env)
+                if value is not None and value is not False:
+                    return value
+                return right(env)
+            return logical_or
+
+        def logical_and(env):
+            value = left(env)
+            if value is None or value is False:
+                return value
+            return right(env)
+        return logical_and
+
+    def visit_set_expr(self, expr: Set) -> Code:
+        obj_code = self._compile(expr.obj)
+        value_code = self._compile(expr.value)
+        name = expr.name
+
+        def set_field(env):
+            obj = obj_code(env)
+            if not isinstance(obj, LoxInstance):
+                raise LoxRuntimeError(name, "Only instances have fields.")
+            value = value_code(env)
+            if obj.shape is expr.ic_shape:
+                if expr.ic_next is None:
+                    obj.values[expr.ic_index] = value
+                else:
+                    obj.shape = expr.ic_next
+                    obj.values.append(value)
+            else:
+                set_property(expr, obj, value)
+            return value
+        return set_field
+
+    def visit_this_expr(self, expr: This) -> Code:
+        return self._lookup(expr.keyword, expr)
+
+    def visit_unary_expr(self, expr: Unary) -> Code:
+        right = self._compile(expr.right)
+        operator = expr.operator
+        if operator.token_type == TokenType.MINUS:
+            def negate(env):
+                value = right(env)
+                if not isinstance(value, (float, int)):
+                    raise LoxRuntimeError(operator, "Operand must be a number.")
+                return -float(value)
+            return negate
+
+        def logical_not(env):
+            value = right(env)
+            return value is None or value is False
+        return logical_not
+
+    def visit_variable_expr(self, expr: Variable) -> Code:
+        return self._lookup(expr.name, expr)
+
+
+_NUMERIC_OPS = {
+    TokenType.MINUS: float.__sub__,
+    TokenType.STAR: float.__mul__,
+    TokenType.SLASH: float.__truediv__,
+    TokenType.GREATER: float.__gt__,
+    TokenType.GREATER_EQUAL: float.__ge__,
+    TokenType.LESS: float.__lt__,
+    TokenType.LESS_EQUAL: float.__le__,
+}
@@ -0,0 +1,431 @@
+from enum import Enum, auto
+from typing import Optional
+
+from chunk import (
+    FunctionProto,
+    OP_ADD,
+    OP_CALL,
+    OP_CLASS,
+    OP_CLOSE_UPVALUE,
+    OP_CLOSURE,
+    OP_CONSTANT,
+    OP_DEFINE_GLOBAL,
+    OP_DIVIDE,
+    OP_EQUAL,
+    OP_FALSE,
+    OP_GET_GLOBAL,
+    OP_GET_LOCAL,
+    OP_GET_PROPERTY,
+    OP_GET_UPVALUE,
+    OP_GREATER,
+    OP_GREATER_EQUAL,
+    OP_INVOKE,
+    OP_JUMP,
+    OP_JUMP_IF_FALSE_OR_POP,
+    OP_JUMP_IF_TRUE_OR_POP,
+    OP_LESS,
+    OP_LESS_EQUAL,
+    OP_METHOD,
+    OP_MULTIPLY,
+    OP_NEGATE,
+    OP_NIL,
+    OP_NOT,
+    OP_NOT_EQUAL,
+    OP_POP,
+    OP_POP_JUMP_IF_FALSE,
+    OP_PRINT,
+    OP_RETURN,
+    OP_SET_GLOBAL,
+    OP_SET_LOCAL,
+    OP_SET_PROPERTY,
+    OP_SET_UPVALUE,
+    OP_SUBTRACT,
+    OP_TAIL_CALL,
+    OP_TAIL_INVOKE,
+    OP_TRUE,
+)
+from expr import (
+    Assign,
+    Binary,
+    Call,
+    Expr,
+    Get,
+    Grouping,
+    Literal,
+    Logical,
+    Set,
+    This,
+    Unary,
+    Variable
+)
+from stmt import (
+    Block,
+    Class,
+    Expression,
+    For,
+    Function,
+    If,
+    Print,
+    Return,
+    Stmt,
+    Var,
+    While
+)
+from token import Token
+from tokentype import TokenType
+from visitor import Visitor
+
+
+class FunctionType(Enum):
+    FUNCTION = auto()
+    INITIALIZER = auto()
+    METHOD = auto()
+    SCRIPT = auto()
+
+
+_BINARY_OPS = {
+    TokenType.PLUS: OP_ADD,
+    TokenType.MINUS: OP_SUBTRACT,
+    TokenType.STAR: OP_MULTIPLY,
+    TokenType.SLASH: OP_DIVIDE,
+    TokenType.EQUAL_EQUAL: OP_EQUAL,
+    TokenType.BANG_EQUAL: OP_NOT_EQUAL,
+    TokenType.GREATER: OP_GREATER,
+    TokenType.GREATER_EQUAL: OP_GREATER_EQUAL,
+    TokenType.LESS: OP_LESS,
+    TokenType.LESS_EQUAL: OP_LESS_EQUAL,
+}
+
+
+class Local:
+    def __init__(self, name: str, depth: int):
+        self.name = name
+        self.depth = depth
+        self.is_captured = False
+
+
+class FunctionState:
+    """
+    Per-function compiler bookkeeping, chained through enclosing the same way
+    Environment chains scopes at runtime
+    """
+
+    def __init__(self, enclosing: Optional["FunctionState"], function: FunctionProto, func_type: FunctionType):
+        self.enclosing = enclosing
+        self.function = function
+        self.func_type = func_type
+        # slot 0 holds the callee, or the receiver inside methods
+        receiver = "this" if func_type in (FunctionType.METHOD, FunctionType.INITIALIZER) else ""
+        self.locals: list[Local] = [Local(receiver, 0)]
+        self.upvalues: list[tuple[int, int]] = []
+        self.scope_depth = 0
+
+
+class Compiler(Visitor):
+    """
+    Compiles resolved statements into bytecode for the VM, one FunctionProto
+    per Lox function and one for the top level script
+    """
+
+    def __init__(self):
+        self.state: Optional[FunctionState] = None
+
+    def compile(self, statements: list[Stmt]) -> FunctionProto:
+        self.state = FunctionState(None, FunctionProto("", 0), FunctionType.SCRIPT)
+        for statement in statements:
+            self._compile_statement(statement)
+        self._emit_return(None)
+        function = self.state.function
+        self.state = None
+        return function
+
+    def _compile_statement(self, stmt: Stmt):
+        stmt.accept(self)
+
+    def _compile_expression(self, expr: Expr):
+        expr.accept(self)
+
+    # emitting
+
+    def _emit(self, byte: int, token: Optional[Token] = None) -> int:
+        return self.state.function.chunk.write(byte, token)
+
+    def _emit_constant(self, value):
+        self._emit(OP_CONSTANT)
+        self._emit(self.state.function.chunk.add_constant(value))
+
+    def _name_constant(self, name: Token) -> int:
+        return self.state.function.chunk.add_constant(name.lexeme)
+
+    def _emit_jump(self, op: int) -> int:
+        self._emit(op)
+        return self._emit(-1)
+
+    def _patch_jump(self, operand: int):
+        chunk = self.state.function.chunk
+        chunk.code[operand] = len(chunk.code)
+
+    def _emit_return(self, token: Optional[Token]):
+        if self.state.func_type == FunctionType.INITIALIZER:
+            self._emit(OP_GET_LOCAL)
+            self._emit(0)
+        else:
+            self._emit(OP_NIL)
+        self._emit(OP_RETURN, token)
+
+    # scopes and variables
+
+    def _begin_scope(self):
+        self.state.scope_depth += 1
+
+    def _end_scope(self):
+        state = self.state
+        state.scope_depth -= 1
+        while state.locals and state.locals[-1].depth > state.scope_depth:
+            local = state.locals.pop()
+            self._emit(OP_CLOSE_UPVALUE if local.is_captured else OP_POP)
+
+    def _declare_local(self, name: str):
+        self.state.locals.append(Local(name, self.state.scope_depth))
+
+    def _define_variable(self, name: Token):
+        if self.state.scope_depth > 0:
+            self._declare_local(name.lexeme)
+        else:
+            self._emit(OP_DEFINE_GLOBAL)
+            self._emit(self._name_constant(name), name)
+
+    def _resolve_local(self, state: FunctionState, name: str) -> int:
+        for i in range(len(state.locals) - 1, -1, -1):
+            if state.locals[i].name == name:
+                return i
+        return -1
+
+    def _add_upvalue(self, state: FunctionState, index: int, is_local: bool) -> int:
+        upvalue = (1 if is_local else 0, index)
+        if upvalue in state.upvalues:
+            return state.upvalues.index(upvalue)
+        state.upvalues.append(upvalue)
+        state.function.upvalue_count = len(state.upvalues)
+        return len(state.upvalues) - 1
+
+    def _resolve_upvalue(self, state: FunctionState, name: str) -> int:
+        if state.enclosing is None:
+            return -1
+        local = self._resolve_local(state.enclosing, name)
+        if local != -1:
+            state.enclosing.locals[local].is_captured = True
+            return self._add_upvalue(state, local, True)
+        upvalue = self._resolve_upvalue(state.enclosing, name)
+        if upvalue != -1:
+            return self._add_upvalue(state, upvalue, False)
+        return -1
+
+    def _named_variable(self, name: Token, assign: bool):
+        slot = self._resolve_local(self.state, name.lexeme)
+        if slot != -1:
+            self._emit(OP_SET_LOCAL if assign else OP_GET_LOCAL)
+            self._emit(slot)
+            return
+        upvalue = self._resolve_upvalue(self.state, name.lexeme)
+        if upvalue != -1:
+            self._emit(OP_SET_UPVALUE if assign else OP_GET_UPVALUE)
+            self._emit(upvalue)
+            return
+        self._emit(OP_SET_GLOBAL if assign else OP_GET_GLOBAL)
+        self._emit(self._name_constant(name), name)
+
+    def _function(self, stmt: Function, func_type: FunctionType):
+        function = FunctionProto(stmt.name.lexeme, len(stmt.params))
+        self.state = FunctionState(self.state, function, func_type)
+        self._begin_scope()
+        for param in stmt.params:
+            self._declare_local(param.lexeme)
+        for statement in stmt.body:
+            self._compile_statement(statement)
+        self._emit_return(None)
+
+        state = self.state
+        self.state = state.enclosing
+        self._emit(OP_CLOSURE)
+        self._emit(self.state.function.chunk.add_constant(function))
+        for is_local, index in state.upvalues:
+            self._emit(is_local)
+            self._emit(index)
+
+    # statements
+
+    def visit_block_stmt(self, stmt: Block):
+        self._begin_scope()
+        for statement in stmt.statements:
+            self._compile_statement(statement)
+        self._end_scope()
+
+    def visit_class_stmt(self, stmt: Class):
+        name_constant = self._name_constant(stmt.name)
+        self._emit(OP_CLASS)
+        self._emit(name_constant)
+        self._define_variable(stmt.name)
+
+        # reload the class so OP_METHOD can attach methods to it
+        self._named_variable(stmt.name, False)
+        for method in stmt.methods:
+            func_type = FunctionType.METHOD
+            if method.name.lexeme == "init":
+                func_type = FunctionType.INITIALIZER
+            self._function(method, func_type)
+            self._emit(OP_METHOD)
+            self._emit(self._name_constant(method.name))
+        self._emit(OP_POP)
+
+    def visit_expression_stmt(self, stmt: Expression):
+        self._compile_expression(stmt.expression)
+        self._emit(OP_POP)
+
+    def visit_for_stmt(self, stmt: For):
+        self._begin_scope()
+        if stmt.initializer is not None:
+            self._compile_statement(stmt.initializer)
+        loop_start = len(self.state.function.chunk.code)
+        exit_jump = None
+        if stmt.condition is not None:
+            self._compile_expression(stmt.condition)
+            exit_jump = self._emit_jump(OP_POP_JUMP_IF_FALSE)
+        self._compile_statement(stmt.body)
+        if stmt.increment is not None:
+            self._compile_expression(stmt.increment)
+            self._emit(OP_POP)
+        self._emit(OP_JUMP)
+        self._emit(loop_start)
+        if exit_jump is not None:
+            self._patch_jump(exit_jump)
+        self._end_scope()
+
+    def visit_function_stmt(self, stmt: Function):
+        if self.state.scope_depth > 0:
+            # declared before the body so the function can call itself
+            self._declare_local(stmt.name.lexeme)
+            self._function(stmt, FunctionType.FUNCTION)
+        else:
+            self._function(stmt, FunctionType.FUNCTION)
+            self._define_variable(stmt.name)
+
+    def visit_if_stmt(self, stmt: If):
+        self._compile_expression(stmt.condition)
+        else_jump = self._emit_jump(OP_POP_JUMP_IF_FALSE)
+        self._compile_statement(stmt.then_branch)
+        if stmt.else_branch is not None:
+            end_jump = self._emit_jump(OP_JUMP)
+            self._patch_jump(else_jump)
+            self._compile_statement(stmt.else_branch)
+            self._patch_jump(end_jump)
+        else:
+            self._patch_jump(else_jump)
+
+    def visit_print_stmt(self, stmt: Print):
+        self._compile_expression(stmt.expression)
+        self._emit(OP_PRINT)
+
+    def visit_return_stmt(self, stmt: Return):
+        if stmt.value is None:
+            self._emit_return(stmt.keyword)
+            return
+        if type(stmt.value) is Call and self.state.func_type in (FunctionType.FUNCTION, FunctionType.METHOD):
+            # the callee reuses this frame, the OP_RETURN after it is only
+            # reached when the callee was native or a class
+            self._call(stmt.value, tail=True)
+        else:
+            self._compile_expression(stmt.value)
+        self._emit(OP_RETURN, stmt.keyword)
+
+    def visit_var_stmt(self, stmt: Var):
+        if stmt.initializer is not None:
+            self._compile_expression(stmt.initializer)
+        else:
+            self._emit(OP_NIL)
+        self._define_variable(stmt.name)
+
+    def visit_while_stmt(self, stmt: While):
+        loop_start = len(self.state.function.chunk.code)
+        self._compile_expression(stmt.condition)
+        exit_jump = self._emit_jump(OP_POP_JUMP_IF_FALSE)
+        self._compile_statement(stmt.body)
+        self._emit(OP_JUMP)
+        self._emit(loop_start)
+        self._patch_jump(exit_jump)
+
+    # expressions
+
+    def visit_assign_expr(self, expr: Assign):
+        self._compile_expression(expr.value)
+        self._named_variable(expr.name, True)
+
+    def visit_binary_expr(self, expr: Binary):
+        self._compile_expression(expr.left)
+        self._compile_expression(expr.right)
+        self._emit(_BINARY_OPS[expr.operator.token_type], expr.operator)
+
+    def visit_call_expr(self, expr: Call):
+        self._call(expr, tail=False)
+
+    def _call(self, expr: Call, tail: bool):
+        if isinstance(expr.callee, Get):
+            # obj.method(args) skips materialising the bound method
+            self._compile_expression(expr.callee.obj)
+            for argument in expr.arguments:
+                self._compile_expression(argument)
+            self._emit(OP_TAIL_INVOKE if tail else OP_INVOKE)
+            self._emit(self._name_constant(expr.callee.name), expr.callee.name)
+            self._emit(len(expr.arguments), expr.paren)
+            return
+        self._compile_expression(expr.callee)
+        for argument in expr.arguments:
+            self._compile_expression(argument)
+        self._emit(OP_TAIL_CALL if tail else OP_CALL)
+        self._emit(len(expr.arguments), expr.paren)
+
+    def visit_get_expr(self, expr: Get):
+        self._compile_expression(expr.obj)
+        self._emit(OP_GET_PROPERTY)
+        self._emit(self._name_constant(expr.name), expr.name)
+
+    def visit_grouping_expr(self, expr: Grouping):
+        self._compile_expression(expr.expression)
+
+    def visit_literal_expr(self, expr: Literal):
+        if expr.value is None:
+            self._emit(OP_NIL)
+        elif expr.value is True:
+            self._emit(OP_TRUE)
+        elif expr.value is False:
+            self._emit(OP_FALSE)
+        else:
+            self._emit_constant(expr.value)
+
+    def visit_logical_expr(self, expr: Logical):
+        self._compile_expression(expr.left)
+        if expr.operator.token_type == TokenType.OR:
+            jump = self._emit_jump(OP_JUMP_IF_TRUE_OR_POP)
+        else:
+            jump = self._emit_jump(OP_JUMP_IF_FALSE_OR_POP)
+        self._compile_expression(expr.right)
+        self._patch_jump(jump)
+
+    def visit_set_expr(self, expr: Set):
+        self._compile_expression(expr.obj)
+        self._compile_expression(expr.value)
+        self._emit(OP_SET_PROPERTY)
+        self._emit(self._name_constant(expr.name), expr.name)
+
+    def visit_this_expr(self, expr: This):
+        self._named_variable(expr.keyword, False)
+
+    def visit_unary_expr(self, expr: Unary):
+        self._compile_expression(expr.right)
+        if expr.operator.token_type == TokenType.MINUS:
+            self._emit(OP_NEGATE, expr.operator)
+        else:
+            self._emit(OP_NOT)
+
+    def visit_variable_expr(self, expr: Variable):
+        self._named_variable(expr.name, False)
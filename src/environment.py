@@ -1,46 +1,99 @@
 from __future__ import annotations
-from os import walk
 
-from typing import Any, Dict, Optional
+from typing import Any, Dict
 
 from runtime_error import LoxRuntimeError
-from token import Token 
+from token import Token
 
 
-class Environment:
-    def __init__(self, enclosing: Optional[Environment] = None):
-        self.values: Dict[str, Any] = dict()
-        self.enclosing = enclosing
+class Cell:
+    """
+    A box for a local that a closure captures. The Resolver marks such locals
+    so their frame slot holds a Cell shared with every closure that uses it,
+    while all other locals sit in the frame as plain values
+    """
+    __slots__ = ("value",)
 
-    def define(self, name: str, value: Any):
-        self.values[name] = value
+    def __init__(self, value: Any = None):
+        self.value = value
+
+
+class _Undefined:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "<undefined>"
+
+
+# what a global slot holds until its variable is defined
+UNDEFINED = _Undefined()
+
+
+class GlobalSlots:
+    """
+    Hands out a stable index for every global name. The Resolver stores it on
+    Variable, Assign and top level declarations, and the GlobalEnvironment
+    owning the table keeps its values in a list by the same indexes. Each
+    environment has a table of its own, so one script's globals never take
+    the indexes of another's
+    """
 
-    def ancestor(self, distance:int) -> Environment:
-        environment = self
-        for _ in range(distance):
-            environment = environment.enclosing
-        return environment
+    def __init__(self):
+        self.indexes: Dict[str, int] = dict()
+        self.names: list[str] = []
 
-    def get_at(self, distance: int, name: str):
-        return self.ancestor(distance).values.get(name)
+    def index(self, name: str) -> int:
+        index = self.indexes.get(name)
+        if index is None:
+            index = self.indexes[name] = len(self.names)
+            self.names.append(name)
+        return index
 
-    def assign_at(self, distance: int, name: Token, value: Any):
-        self.ancestor(distance).values[name.lexeme] = value
+    def indexes_of(self, names: list[str]) -> list[int]:
+        """The index of each name, for rebinding a tree resolved against another table"""
+        return [self.index(name) for name in names]
+
+
+class GlobalEnvironment:
+    """
+    Top level variables in a list indexed by slots. Globals can be
+    referenced before they are defined, so a slot holds UNDEFINED until then
+    """
+
+    def __init__(self):
+        self.slots = GlobalSlots()
+        self.values: list[Any] = []
+
+    def reserve(self, index: int):
+        """Makes sure the list reaches index, without defining anything"""
+        values = self.values
+        if index >= len(values):
+            values.extend([UNDEFINED] * (index + 1 - len(values)))
+
+    def define(self, name: str, value: Any):
+        self.define_slot(self.slots.index(name), value)
+
+    def define_slot(self, index: int, value: Any):
+        self.reserve(index)
+        self.values[index] = value
 
     def get(self, name: Token):
-        if name.lexeme in self.values.keys():
-            return self.values[name.lexeme]
-        if self.enclosing is not None:
-            return self.enclosing.get(name)
+        return self.get_slot(self.slots.index(name.lexeme), name)
 
-        raise LoxRuntimeError(name, f"Undefined variable '{name.lexeme}'.")
+    def get_slot(self, index: int, name: Token):
+        try:
+            value = self.values[index]
+        except IndexError:
+            value = UNDEFINED
+        if value is UNDEFINED:
+            raise LoxRuntimeError(name, f"Undefined variable '{name.lexeme}'.")
+        return value
 
     def assign(self, name: Token, value: Any):
-        if name.lexeme in self.values.keys():
-            self.values[name.lexeme] = value
-            return
-        if self.enclosing is not None:
-            self.enclosing.assign(name, value)
-            return
-
-        raise LoxRuntimeError(name, f"Undefined variable '{name.lexeme}'.")
+        self.assign_slot(self.slots.index(name.lexeme), name, value)
+
+    def assign_slot(self, index: int, name: Token, value: Any):
+        values = self.values
+        if index >= len(values) or values[index] is UNDEFINED:
+            raise LoxRuntimeError(name, f"Undefined variable '{name.lexeme}'.")
+        values[index] = value
@@ -1,27 +1,40 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Optional
 from token import Token
 from visitor import Visitor
+from shape import Shape
 
 class Expr(ABC):
+	__slots__ = ()
 
 	def __repr__(self):
-		return (type(self).__name__) + str(self.__dict__)
+		return (type(self).__name__) + str({name: getattr(self, name) for name in self.__slots__})
+
+	def __reduce__(self):
+		# pickled as the constructor call, every field is an __init__ argument
+		return (type(self), tuple(getattr(self, name) for name in self.__slots__))
 
 	@abstractmethod
 	def accept(self, visitor: Visitor):
 		pass
 
 class Assign(Expr):
-	def __init__(self, name: Token, value: Expr):
+	__slots__ = ('name', 'value', 'slot', 'captured', 'global_slot')
+
+	def __init__(self, name: Token, value: Expr, slot: Optional[int] = None, captured: bool = False, global_slot: Optional[int] = None):
 		self.name = name
 		self.value = value
+		self.slot = slot
+		self.captured = captured
+		self.global_slot = global_slot
 
 	def accept(self, visitor: Visitor):
 		return visitor.visit_assign_expr(self)
 
 class Binary(Expr):
+	__slots__ = ('left', 'operator', 'right')
+
 	def __init__(self, left: Expr, operator: Token, right: Expr):
 		self.left = left
 		self.operator = operator
@@ -31,6 +44,8 @@ class Binary(Expr):
 		return visitor.visit_binary_expr(self)
 
 class Call(Expr):
+	__slots__ = ('callee', 'paren', 'arguments')
+
 	def __init__(self, callee: Expr, paren: Token, arguments: list[Expr]):
 		self.callee = callee
 		self.paren = paren
@@ -40,14 +55,21 @@ class Call(Expr):
 		return visitor.visit_call_expr(self)
 
 class Get(Expr):
-	def __init__(self, obj: Expr, name: Token):
+	__slots__ = ('obj', 'name', 'ic_shape', 'ic_index', 'ic_method')
+
+	def __init__(self, obj: Expr, name: Token, ic_shape: Optional[Shape] = None, ic_index: int = -1, ic_method: Any = None):
 		self.obj = obj
 		self.name = name
+		self.ic_shape = ic_shape
+		self.ic_index = ic_index
+		self.ic_method = ic_method
 
 	def accept(self, visitor: Visitor):
 		return visitor.visit_get_expr(self)
 
 class Grouping(Expr):
+	__slots__ = ('expression',)
+
 	def __init__(self, expression: Expr):
 		self.expression = expression
 
@@ -55,6 +77,8 @@ class Grouping(Expr):
 		return visitor.visit_grouping_expr(self)
 
 class Literal(Expr):
+	__slots__ = ('value',)
+
 	def __init__(self, value: Any):
 		self.value = value
 
@@ -62,6 +86,8 @@ class Literal(Expr):
 		return visitor.visit_literal_expr(self)
 
 class Logical(Expr):
+	__slots__ = ('left', 'operator', 'right')
+
 	def __init__(self, left: Expr, operator: Token, right: Expr):
 		self.left = left
 		self.operator = operator
@@ -71,22 +97,33 @@ class Logical(Expr):
 		return visitor.visit_logical_expr(self)
 
 class Set(Expr):
-	def __init__(self, obj: Expr, name: Token, value: Expr):
+	__slots__ = ('obj', 'name', 'value', 'ic_shape', 'ic_index', 'ic_next')
+
+	def __init__(self, obj: Expr, name: Token, value: Expr, ic_shape: Optional[Shape] = None, ic_index: int = -1, ic_next: Optional[Shape] = None):
 		self.obj = obj
 		self.name = name
 		self.value = value
+		self.ic_shape = ic_shape
+		self.ic_index = ic_index
+		self.ic_next = ic_next
 
 	def accept(self, visitor: Visitor):
 		return visitor.visit_set_expr(self)
 
 class This(Expr):
-	def __init__(self, keyword: Token):
+	__slots__ = ('keyword', 'slot', 'captured')
+
+	def __init__(self, keyword: Token, slot: Optional[int] = None, captured: bool = False):
 		self.keyword = keyword
+		self.slot = slot
+		self.captured = captured
 
 	def accept(self, visitor: Visitor):
 		return visitor.visit_this_expr(self)
 
 class Unary(Expr):
+	__slots__ = ('operator', 'right')
+
 	def __init__(self, operator: Token, right: Expr):
 		self.operator = operator
 		self.right = right
@@ -95,8 +132,13 @@ class Unary(Expr):
 		return visitor.visit_unary_expr(self)
 
 class Variable(Expr):
-	def __init__(self, name: Token):
+	__slots__ = ('name', 'slot', 'captured', 'global_slot')
+
+	def __init__(self, name: Token, slot: Optional[int] = None, captured: bool = False, global_slot: Optional[int] = None):
 		self.name = name
+		self.slot = slot
+		self.captured = captured
+		self.global_slot = global_slot
 
 	def accept(self, visitor: Visitor):
 		return visitor.visit_variable_expr(self)
@@ -0,0 +1,83 @@
+from typing import TextIO
+
+from stmt import Function
+
+# frames kept per function, enough for the activations that recursion has
+# open at once in most scripts without holding onto all of a deep one's
+DEFAULT_LIMIT = 32
+
+
+class FramePool:
+    """
+    Recycles call frames. A frame only holds a call's locals, closures take
+    the Cells out of it rather than the frame itself, so once the call returns
+    nothing else can reach it and it can be handed to the next call of the
+    same function. Each Function node keeps its own free list of frames of
+    the right size in free_frames, set up by the Resolver.
+
+    Every call site takes its frame from acquire and LoxFunction.run (and
+    CompiledFunction.run) hands it back to release, so the limit, the counts
+    and how frames are cleared live only here. Frames are cleared as they are
+    released, so the pool never keeps a Lox value alive, and a frame left
+    behind by a runtime error is simply dropped
+    """
+    __slots__ = ("limit", "hits", "misses", "discarded", "functions", "memory_stats")
+
+    def __init__(self, limit: int = DEFAULT_LIMIT):
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        # released while the function's free list was full
+        self.discarded = 0
+        # every function a frame was allocated for, to count what is pooled
+        self.functions: dict[int, Function] = {}
+        # the MemoryStats counting the frames allocated, while there is one
+        self.memory_stats = None
+
+    def allocate(self, function: Function) -> list:
+        """A new frame for function, when its free list is empty"""
+        self.misses += 1
+        self.functions[id(function)] = function
+        frame = [None] * function.slot_count
+        if self.memory_stats is not None:
+            self.memory_stats.allocated(frame)
+        return frame
+
+    def acquire(self, function: Function) -> list:
+        """A cleared frame for a call of function, reused when there is one"""
+        free = function.free_frames
+        if free:
+            self.hits += 1
+            return free.pop()
+        return self.allocate(function)
+
+    def release(self, function: Function, frame: list) -> None:
+        """Takes back the frame of a call that returned, unless function already has limit of them"""
+        free = function.free_frames
+        if len(free) < self.limit:
+            frame[:] = function.blank_frame
+            free.append(frame)
+        else:
+            self.discarded += 1
+
+    @property
+    def pooled(self) -> int:
+        """Frames sitting in free lists right now"""
+        return sum(len(function.free_frames) for function in self.functions.values())
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "discarded": self.discarded,
+            "pooled": self.pooled,
+        }
+
+    def report(self, out: TextIO) -> None:
+        acquired = self.hits + self.misses
+        rate = self.hits * 100 / acquired if acquired else 0.0
+        print(
+            f"frame pool: {acquired} frames acquired, {self.hits} hits ({rate:.1f}%), {self.misses} misses, "
+            f"{self.discarded} discarded, {self.pooled} pooled",
+            file=out
+        )
@@ -0,0 +1,105 @@
+import time
+from typing import Callable, TextIO
+
+from interpreter import Interpreter
+from sampler import node_line
+from stmt import For
+
+
+def _counted(visit: Callable) -> Callable:
+    def counted(self, node):
+        counts = self.counts
+        counts[node] = counts.get(node, 0) + 1
+        return visit(self, node)
+    return counted
+
+
+def _timed(visit: Callable) -> Callable:
+    def timed(self, node):
+        counts = self.counts
+        counts[node] = counts.get(node, 0) + 1
+        children = self._children
+        children.append(0.0)
+        start = time.perf_counter()
+        try:
+            return visit(self, node)
+        finally:
+            elapsed = time.perf_counter() - start
+            # time spent in this node itself, not in the nodes under it
+            times = self.times
+            times[node] = times.get(node, 0.0) + elapsed - children.pop()
+            children[-1] += elapsed
+    return timed
+
+
+def _instrument(cls: type, wrap: Callable) -> type:
+    """Wraps every visit_ method cls inherits from Interpreter"""
+    for name in dir(Interpreter):
+        if name.startswith("visit_"):
+            setattr(cls, name, wrap(getattr(Interpreter, name)))
+    return cls
+
+
+class CountingInterpreter(Interpreter):
+    """
+    The tree walker with every visit_ method wrapped to count how often each
+    Stmt and Expr node runs, for --heatmap. The counts are kept per node and
+    only turned into per line figures by heatmap(), the plain Interpreter is
+    untouched
+    """
+
+    def __init__(self):
+        super().__init__()
+        # node -> times it was visited
+        self.counts: dict = {}
+        # node -> seconds spent in it, excluding its children (timed only)
+        self.times: dict = {}
+
+    def _counted_for(self, stmt: For, i: int):
+        # the fast path never visits the condition or the increment, which
+        # would leave a loop's header counted once however often it ran
+        return self._for_loop(stmt)
+
+    def line_stats(self) -> dict[int, tuple[int, float]]:
+        """line -> (visits of its most visited node, seconds spent on it)"""
+        stats: dict[int, tuple[int, float]] = {}
+        for node, count in self.counts.items():
+            line = node_line(node)
+            if line is None:
+                continue
+            hits, seconds = stats.get(line, (0, 0.0))
+            stats[line] = (max(hits, count), seconds + self.times.get(node, 0.0))
+        return stats
+
+    def heatmap(self, source: str, out: TextIO) -> None:
+        """Writes source with each line's hit count (and time share) in front"""
+        stats = self.line_stats()
+        total = sum(seconds for _, seconds in stats.values())
+        timed = bool(self.times)
+        for number, text in enumerate(source.splitlines(), start=1):
+            hits, seconds = stats.get(number, (0, 0.0))
+            if hits == 0:
+                prefix = " " * (18 if timed else 10)
+            elif timed:
+                share = seconds * 100 / total if total else 0.0
+                prefix = f"{hits:>9} {share:>6.1f}% "
+            else:
+                prefix = f"{hits:>9} "
+            out.write(f"{prefix}| {text}\n")
+
+
+_instrument(CountingInterpreter, _counted)
+
+
+class TimingInterpreter(CountingInterpreter):
+    """CountingInterpreter that also times every node, for --heatmap-time"""
+
+    def __init__(self):
+        super().__init__()
+        # time spent in the children of each node being visited, the first
+        # entry collects time outside of any node
+        self._children: list[float] = [0.0]
+
+
+_instrument(TimingInterpreter, _timed)
+
@@ -0,0 +1,52 @@
+from expr import Get, Set
+from lox_instance import LoxInstance
+from runtime_error import LoxRuntimeError
+
+# Slow paths for the monomorphic inline caches kept on Get and Set nodes.
+# Callers check `instance.shape is site.ic_shape` themselves and only come
+# here on a miss, which looks the property up and re-points the cache at the
+# instance's shape. A shape belongs to exactly one class, so it also pins
+# down which method a name resolves to.
+
+
+def fill_get_cache(site: Get, instance: LoxInstance):
+    name = site.name.lexeme
+    shape = instance.shape
+    index = shape.fields.get(name)
+    if index is not None:
+        site.ic_shape = shape
+        site.ic_index = index
+        site.ic_method = None
+        return
+
+    method = instance.klass.find_method(name)
+    if method is None:
+        raise LoxRuntimeError(site.name, f"Undefined property {name}.")
+    site.ic_shape = shape
+    site.ic_index = -1
+    site.ic_method = method
+
+
+def get_property(site: Get, instance: LoxInstance):
+    fill_get_cache(site, instance)
+    if site.ic_method is None:
+        return instance.values[site.ic_index]
+    return site.ic_method.bind(instance)
+
+
+def set_property(site: Set, instance: LoxInstance, value):
+    name = site.name.lexeme
+    shape = instance.shape
+    index = shape.fields.get(name)
+    if index is None:
+        # new field, cache the transition so the next instance follows it
+        next_shape = shape.add(name)
+        index = len(instance.values)
+        instance.shape = next_shape
+        instance.values.append(value)
+    else:
+        next_shape = None
+        instance.values[index] = value
+    site.ic_shape = shape
+    site.ic_index = index
+    site.ic_next = next_shape
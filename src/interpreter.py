@@ -1,3 +1,5 @@
+import operator
+
 from expr import (
     Assign,
     Binary,
@@ -12,9 +14,11 @@ from expr import (
     Set,
     This
 )
+from inline_cache import fill_get_cache, set_property
 from lox_instance import LoxInstance
 from stmt import (
     Block,
+    For,
     Function,
     If,
     Return,
@@ -26,16 +30,33 @@ from stmt import (
     Class
 )
 
-from environment import Environment
+from environment import UNDEFINED, Cell, GlobalEnvironment
+from frame_pool import FramePool
 from lox_class import LoxClass
-from lox_function import LoxFunction
+from lox_function import LoxFunction, capture
+from memstats import MemoryStats
 from native import Clock
 from token import Token
 from lox_callable import LoxCallable
+from quicken import (
+    GenericBinary,
+    GenericUnary,
+    NumberAdd,
+    NumberDivide,
+    NumberGreater,
+    NumberGreaterEqual,
+    NumberLess,
+    NumberLessEqual,
+    NumberMultiply,
+    NumberNegate,
+    NumberSubtract,
+    StringAdd,
+    quicken_binary,
+    quicken_unary
+)
 from error_handler import ErrorHandler
 from tokentype import TokenType
 from runtime_error import LoxRuntimeError
-from return_exception import LoxReturnException
 from visitor import Visitor
 
 
@@ -43,11 +64,19 @@ class Interpreter(Visitor):
 
     def __init__(self):
         self.error_handler = ErrorHandler()
-        self.globals = Environment()
-        self.environment = self.globals
-        self.locals = dict()
+        self.globals = GlobalEnvironment()
+        # the running function's locals, by the slots the Resolver gave them,
+        # or the frame of a block or loop at top level
+        self.frame: list = []
+        # call frames are recycled through it, see frame_pool.py
+        self.frame_pool = FramePool()
+        # extended in place as globals are added, so it can be held onto
+        self._global_values = self.globals.values
 
         self.globals.define("clock", Clock())
+        # set while a MemoryStats is counting, everything that creates a
+        # Cell, function or instance hands it over, see memstats.py
+        self.memory_stats: MemoryStats | None = None
 
     def interpret(self, statements: list[Stmt]):
         try:
@@ -61,35 +90,90 @@ class Interpreter(Visitor):
         return expr.accept(self)
 
     def _execute(self, stmt):
-        stmt.accept(self)
-
-    def resolve(self, expr: Expr, depth: int):
-        self.locals[expr] = depth
+        """
+        Statements complete with None, or with a 1-tuple holding the value of
+        a return statement, which every enclosing statement hands straight
+        back up until LoxFunction.run unwraps it
+        """
+        return stmt.accept(self)
+
+    def _define(self, declaration: Var | Function | Class, name: Token, value):
+        if declaration.slot is None:
+            self.globals.define_slot(declaration.global_slot, value)
+        elif declaration.captured:
+            # a fresh Cell each time the declaration runs, so closures made in
+            # different iterations of a loop don't share the variable
+            cell = self.frame[declaration.slot] = Cell(value)
+            if self.memory_stats is not None:
+                self.memory_stats.allocated(cell)
+        else:
+            self.frame[declaration.slot] = value
+
+    def _initialize(self, declaration: Function | Class, value):
+        """
+        Gives a function or class the value _define declared it with, after
+        its closures were created, so they see it through the same Cell
+        """
+        if declaration.slot is None:
+            self.globals.define_slot(declaration.global_slot, value)
+        elif declaration.captured:
+            self.frame[declaration.slot].value = value
+        else:
+            self.frame[declaration.slot] = value
 
-    def _execute_block(self, statements: list[Stmt], environment: Environment):
-        previous = self.environment
+    def _execute_block(self, statements: list[Stmt], frame: list):
+        previous = self.frame
         try:
-            self.environment = environment
+            self.frame = frame
             
             for statement in statements:
                 # print(f"statement: {statement}")
-                self._execute(statement)
+                completion = self._execute(statement)
+                if completion is not None:
+                    return completion
         finally:
-            self.environment = previous
+            self.frame = previous
+        return None
 
-    def visit_block_stmt(self, stmt: Block):
-        self._execute_block(stmt.statements, Environment(self.environment))
+    def _execute_function(self, function: LoxFunction, frame: list):
+        """
+        What LoxFunction.run executes a body with, _execute_block over
+        function's body written out again so a call costs no extra Python
+        call. A subclass that needs to see every call overrides this
+        """
+        previous = self.frame
+        try:
+            self.frame = frame
+            for statement in function.declaration.body:
+                completion = statement.accept(self)
+                if completion is not None:
+                    return completion
+        finally:
+            self.frame = previous
         return None
 
+    def visit_block_stmt(self, stmt: Block):
+        if stmt.slot_count == 0:
+            # its locals, if any, live in the enclosing function's frame
+            for statement in stmt.statements:
+                completion = statement.accept(self)
+                if completion is not None:
+                    return completion
+            return None
+        # a block at top level, nothing is running that has a frame
+        return self._execute_block(stmt.statements, [None] * stmt.slot_count)
+
     def visit_class_stmt(self, stmt: Class):
-        self.environment.define(stmt.name.lexeme, None)
+        self._define(stmt, stmt.name, None)
         methods = dict()
         for method in stmt.methods:
             is_initializer = method.name.lexeme == "init"
-            function = LoxFunction(method, self.environment, is_initializer)
+            function = LoxFunction(method, capture(method, self.frame), is_initializer)
+            if self.memory_stats is not None:
+                self.memory_stats.allocated(function)
             methods[method.name.lexeme] = function
         klass = LoxClass(stmt.name.lexeme, methods)
-        self.environment.assign(stmt.name, klass)
+        self._initialize(stmt, klass)
         return None
 
     def visit_expression_stmt(self, stmt: Expression):
@@ -97,15 +181,19 @@ class Interpreter(Visitor):
         return None
 
     def visit_function_stmt(self, stmt: Function):
-        function = LoxFunction(stmt, self.environment, False)
-        self.environment.define(stmt.name.lexeme, function)
+        # declared first, a local function that calls itself captures its own Cell
+        self._define(stmt, stmt.name, None)
+        function = LoxFunction(stmt, capture(stmt, self.frame), False)
+        if self.memory_stats is not None:
+            self.memory_stats.allocated(function)
+        self._initialize(stmt, function)
         return None
 
     def visit_if_stmt(self, stmt: If):
         if self._is_truthy(self._evaluate(stmt.condition)):
-            self._execute(stmt.then_branch)
+            return self._execute(stmt.then_branch)
         elif stmt.else_branch is not None:
-            self._execute(stmt.else_branch)
+            return self._execute(stmt.else_branch)
         return None
 
     def visit_print_stmt(self, stmt: Print):
@@ -119,34 +207,105 @@ class Interpreter(Visitor):
         if stmt.value != None:
             value = self._evaluate(stmt.value)
         
-        raise LoxReturnException(value)
+        return (value,)
 
     def visit_var_stmt(self, stmt: Var):
         value = None
         if stmt.initializer != None:
             value = self._evaluate(stmt.initializer)
-        self.environment.define(stmt.name.lexeme, value)
+        self._define(stmt, stmt.name, value)
         return None
 
+    def visit_for_stmt(self, stmt: For):
+        if stmt.slot_count == 0:
+            return self._for(stmt)
+        # a loop at top level, its frame holds the loop variable and the
+        # locals of its body
+        previous = self.frame
+        self.frame = [None] * stmt.slot_count
+        try:
+            return self._for(stmt)
+        finally:
+            self.frame = previous
+
+    def _for(self, stmt: For):
+        if stmt.initializer is not None:
+            self._execute(stmt.initializer)
+        if stmt.counted:
+            start = self.frame[stmt.initializer.slot]
+            if type(start) is float and start.is_integer():
+                return self._counted_for(stmt, int(start))
+        return self._for_loop(stmt)
+
+    def _for_loop(self, stmt: For):
+        condition = stmt.condition
+        increment = stmt.increment
+        body = stmt.body
+        while condition is None or self._is_truthy(condition.accept(self)):
+            completion = body.accept(self)
+            if completion is not None:
+                return completion
+            if increment is not None:
+                increment.accept(self)
+        return None
+
+    def _counted_for(self, stmt: For, i: int):
+        """
+        Runs a loop the Resolver marked as counted with i as a Python int,
+        only writing it back into the loop variable's slot once per iteration
+        """
+        values = self.frame
+        slot = stmt.initializer.slot
+        step = int(stmt.increment.value.right.value)
+        below = operator.le if stmt.condition.operator.token_type == TokenType.LESS_EQUAL else operator.lt
+        bound_expr = stmt.condition.right
+        body = stmt.body
+        while True:
+            bound = bound_expr.accept(self)
+            if type(bound) is not float:
+                # the generic loop evaluates the condition and reports it
+                return self._for_loop(stmt)
+            if not below(i, bound):
+                return None
+            completion = body.accept(self)
+            if completion is not None:
+                return completion
+            i += step
+            values[slot] = float(i)
+
     def visit_while_stmt(self, stmt: While):
         while self._is_truthy(self._evaluate(stmt.condition)):
-            self._execute(stmt.body)
+            completion = self._execute(stmt.body)
+            if completion is not None:
+                return completion
         return None
 
     def visit_assign_expr(self, expr: Assign):
         value = self._evaluate(expr.value)
-        distance = self.locals.get(expr)
-        if distance is not None:
-            self.environment.assign_at(distance, expr.name, value)
+        slot = expr.slot
+        if slot is not None:
+            if expr.captured:
+                self.frame[slot].value = value
+            else:
+                self.frame[slot] = value
+            return value
+        values = self._global_values
+        index = expr.global_slot
+        if index < len(values) and values[index] is not UNDEFINED:
+            values[index] = value
         else:
-            self.globals.assign(expr.name, value)
+            self.globals.assign_slot(index, expr.name, value)
         return value
 
     def visit_binary_expr(self, expr: Binary):
         left = self._evaluate(expr.left)
         right = self._evaluate(expr.right)
+        if type(expr) is Binary:
+            quicken_binary(expr, left, right)
+        return self._binary(expr.operator, left, right)
 
-        token_type = expr.operator.token_type
+    def _binary(self, operator: Token, left, right):
+        token_type = operator.token_type
         if token_type in (
             TokenType.STAR,
             TokenType.SLASH,
@@ -156,7 +315,7 @@ class Interpreter(Visitor):
             TokenType.LESS,
             TokenType.LESS_EQUAL,
         ):
-            self._check_numeric_opers(expr.operator, left, right)
+            self._check_numeric_opers(operator, left, right)
         if token_type == TokenType.GREATER:
             return float(left) > float(right)
         if token_type == TokenType.GREATER_EQUAL:
@@ -176,7 +335,7 @@ class Interpreter(Visitor):
                 return float(left) + float(right)
             if isinstance(left, str) and isinstance(right, str):
                 return str(left) + str(right)
-            raise LoxRuntimeError(expr.operator, "Operands must be two numbers or two strings.")
+            raise LoxRuntimeError(operator, "Operands must be two numbers or two strings.")
         if token_type == TokenType.SLASH:
             return float(left) / float(right)
         if token_type == TokenType.STAR:
@@ -185,11 +344,76 @@ class Interpreter(Visitor):
         # return None
 
     def visit_call_expr(self, expr: Call):
+        if type(expr.callee) is Get:
+            return self._invoke(expr, expr.callee)
+
         function = self._evaluate(expr.callee)
+        return self._call(expr, function)
+
+    def _invoke(self, expr: Call, site: Get):
+        """
+        obj.method(args): calls the method straight off the class with this in
+        its frame, skipping the bound LoxFunction visit_get_expr would make
+        """
+        obj = self._evaluate(site.obj)
+        if not isinstance(obj, LoxInstance):
+            raise LoxRuntimeError(site.name, "Only instances have properties.")
+        if obj.shape is not site.ic_shape:
+            fill_get_cache(site, obj)
+        method = site.ic_method
+        if method is None:
+            # a field that holds a callable
+            return self._call(expr, obj.values[site.ic_index])
+
+        declaration = method.declaration
+        if declaration.body_tokens is None and len(expr.arguments) == len(declaration.params):
+            # as in _call, straight into a pooled frame after this
+            frame = self.frame_pool.acquire(declaration)
+            frame[0] = obj
+            slot = 1
+            for argument in expr.arguments:
+                frame[slot] = argument.accept(self)
+                slot += 1
+            return method.run(self, frame, obj)
+
+        arguments = []
+        for argument in expr.arguments:
+            arguments.append(self._evaluate(argument))
 
+        if len(arguments) != method.arity():
+            raise LoxRuntimeError(expr.paren, f"Expected {method.arity()} arguments but got {len(arguments)}.")
+
+        return method.invoke(self, obj, arguments)
+
+    def _call(self, expr: Call, function):
         if not isinstance(function, LoxCallable):
             raise LoxRuntimeError(expr.paren, "Can only call functions and classes.")
 
+        # a function, or a class's init, whose body has been parsed gets its
+        # arguments evaluated straight into a frame from its pool, rather
+        # than into a list that call would then copy over
+        if type(function) is LoxFunction and function.this is None:
+            callee = function
+            slot = 0
+        elif type(function) is LoxClass:
+            callee = function.methods.get("init")
+            slot = 1
+        else:
+            callee = None
+        if callee is not None:
+            declaration = callee.declaration
+            if declaration.body_tokens is None and len(expr.arguments) == len(declaration.params):
+                frame = self.frame_pool.acquire(declaration)
+                for argument in expr.arguments:
+                    frame[slot] = argument.accept(self)
+                    slot += 1
+                if callee is function:
+                    return callee.run(self, frame)
+                instance = frame[0] = LoxInstance(function)
+                if self.memory_stats is not None:
+                    self.memory_stats.allocated(instance)
+                return callee.run(self, frame, instance)
+
         arguments = []
         for argument in expr.arguments:
             arguments.append(self._evaluate(argument))
@@ -202,7 +426,14 @@ class Interpreter(Visitor):
     def visit_get_expr(self, expr: Get):
         obj = self._evaluate(expr.obj)
         if isinstance(obj, LoxInstance):
-            return obj.get(expr.name)
+            if obj.shape is not expr.ic_shape:
+                fill_get_cache(expr, obj)
+            if expr.ic_method is None:
+                return obj.values[expr.ic_index]
+            method = expr.ic_method.bind(obj)
+            if self.memory_stats is not None:
+                self.memory_stats.allocated(method)
+            return method
 
         raise LoxRuntimeError(expr.name, "Only instances have properties.")
 
@@ -215,13 +446,12 @@ class Interpreter(Visitor):
     def visit_logical_expr(self, expr: Logical):
         left = self._evaluate(expr.left)
 
-        if expr.operator.type == TokenType.OR:
+        if expr.operator.token_type == TokenType.OR:
             if self._is_truthy(left):
                 return left
-            else:
-                if not self._is_truthy(left):
-                    return left
-        
+        elif not self._is_truthy(left):
+            return left
+
         return self._evaluate(expr.right)
 
     def visit_set_expr(self, expr: Set):
@@ -231,7 +461,14 @@ class Interpreter(Visitor):
             raise LoxRuntimeError(expr.name, "Only instances have fields.")
 
         value = self._evaluate(expr.value)
-        obj.set(expr.name, value)
+        if obj.shape is expr.ic_shape:
+            if expr.ic_next is None:
+                obj.values[expr.ic_index] = value
+            else:
+                obj.shape = expr.ic_next
+                obj.values.append(value)
+        else:
+            set_property(expr, obj, value)
         return value
 
     def visit_this_expr(self, expr: This):
@@ -239,24 +476,119 @@ class Interpreter(Visitor):
 
     def visit_unary_expr(self, expr: Unary):
         right = self._evaluate(expr.right)
-        
-        if expr.operator.token_type == TokenType.MINUS:
-            self._check_numeric_oper(expr.operator, right)
+        if type(expr) is Unary:
+            quicken_unary(expr, right)
+        return self._unary(expr.operator, right)
+
+    def _unary(self, operator: Token, right):
+        if operator.token_type == TokenType.MINUS:
+            self._check_numeric_oper(operator, right)
             return -float(right)
-        elif expr.operator.token_type == TokenType.BANG:
+        elif operator.token_type == TokenType.BANG:
             return not self._is_truthy(right)
 
         # return None
 
+    # quickened nodes, see quicken.py. operands are evaluated with accept()
+    # directly since these are the hottest paths in arithmetic loops
+
+    def visit_number_add_expr(self, expr: NumberAdd):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left + right
+        return self._deoptimize_binary(expr, left, right)
+
+    def visit_string_add_expr(self, expr: StringAdd):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if type(left) is str and type(right) is str:
+            return left + right
+        return self._deoptimize_binary(expr, left, right)
+
+    def visit_number_subtract_expr(self, expr: NumberSubtract):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left - right
+        return self._deoptimize_binary(expr, left, right)
+
+    def visit_number_multiply_expr(self, expr: NumberMultiply):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left * right
+        return self._deoptimize_binary(expr, left, right)
+
+    def visit_number_divide_expr(self, expr: NumberDivide):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left / right
+        return self._deoptimize_binary(expr, left, right)
+
+    def visit_number_less_expr(self, expr: NumberLess):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left < right
+        return self._deoptimize_binary(expr, left, right)
+
+    def visit_number_less_equal_expr(self, expr: NumberLessEqual):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left <= right
+        return self._deoptimize_binary(expr, left, right)
+
+    def visit_number_greater_expr(self, expr: NumberGreater):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left > right
+        return self._deoptimize_binary(expr, left, right)
+
+    def visit_number_greater_equal_expr(self, expr: NumberGreaterEqual):
+        left = expr.left.accept(self)
+        right = expr.right.accept(self)
+        if type(left) is float and type(right) is float:
+            return left >= right
+        return self._deoptimize_binary(expr, left, right)
+
+    def visit_number_negate_expr(self, expr: NumberNegate):
+        right = expr.right.accept(self)
+        if type(right) is float:
+            return -right
+        expr.__class__ = GenericUnary
+        return self._unary(expr.operator, right)
+
+    def _deoptimize_binary(self, expr: Binary, left, right):
+        expr.__class__ = GenericBinary
+        return self._binary(expr.operator, left, right)
+
     def visit_variable_expr(self, expr: Variable):
-        return self._lookup_variable(expr.name, expr)
+        slot = expr.slot
+        if slot is not None:
+            if expr.captured:
+                return self.frame[slot].value
+            return self.frame[slot]
+        # globals are read straight out of their slot, get_slot only raises
+        # the error for one that isn't defined (yet)
+        try:
+            value = self._global_values[expr.global_slot]
+        except IndexError:
+            value = UNDEFINED
+        if value is UNDEFINED:
+            return self.globals.get_slot(expr.global_slot, expr.name)
+        return value
 
-    def _lookup_variable(self, name: Token, expr: Expr):
-        distance = self.locals.get(expr)
-        if distance is not None:
-            return self.environment.get_at(distance, name.lexeme)
+    def _lookup_variable(self, name: Token, expr: Variable | This):
+        if expr.slot is not None:
+            if expr.captured:
+                return self.frame[expr.slot].value
+            return self.frame[expr.slot]
         else:
-            return self.globals.get(name)
+            return self.globals.get_slot(expr.global_slot, name)
 
     def _check_numeric_oper(self, operator: Token, right: Expr):
         if isinstance(right, (float, int)):
@@ -268,21 +600,24 @@ class Interpreter(Visitor):
             return
         raise LoxRuntimeError(operator, "Operands must be a number.")
 
-    def _is_truthy(self, obj):
+    @staticmethod
+    def _is_truthy(obj):
         if obj is None:
             return False
         if isinstance(obj, bool):
             return obj
         return True
 
-    def _is_equal(self, a, b):
+    @staticmethod
+    def _is_equal(a, b):
         if a == None and b == None:
             return True
         if a == None:
             return False
         return a == b
 
-    def _stringify(self, object):
+    @staticmethod
+    def _stringify(object):
         if object is None:
             return "nil"
         if isinstance(object, float):
@@ -1,26 +1,188 @@
+import argparse
+import contextlib
+import mmap
+import os
 import sys
+import time
+from typing import Iterable, Optional, TextIO
 
+from ast_cache import AstCache
 from ast_printer import AstPrinter
+from closure_compiler import ClosureCompiler
+from environment import GlobalEnvironment, GlobalSlots
 from error_handler import ErrorHandler
+from heatmap import CountingInterpreter, TimingInterpreter
 from interpreter import Interpreter
+from memstats import MemoryStats
+from optimizer import Optimizer
 from parser import Parser
-from scanner import Scanner
+from profiler import ProfilingInterpreter
+from token import Token
+from regex_scanner import MappedScanner, RegexScanner
 from resolver import Resolver
+from sampler import SamplingProfiler
+from stmt import Stmt
+from vm import VM
+
+ENGINES = {
+    "tree": Interpreter,
+    "closure": ClosureCompiler,
+    "vm": VM,
+}
 
 
 class Lox:
-    def __init__(self):
-        self.interpreter = Interpreter()
+    def __init__(self, engine: str = "tree", max_depth: int | None = None, optimize: bool = False,
+                 stream: bool = False, mapped: bool = False, cache: bool = False,
+                 rebuild_cache: bool = False, cache_stats: bool = False, lazy: bool = False,
+                 profile: bool = False, profile_json: str | None = None,
+                 sample: str | None = None, sample_interval: float = 0.005,
+                 heatmap: str | None = None, heatmap_time: bool = False,
+                 mem_stats: bool = False, mem_snapshots: str | None = None, mem_interval: float = 0.1,
+                 pool_stats: bool = False):
+        if profile:
+            self.interpreter = ProfilingInterpreter()
+        elif heatmap is not None:
+            self.interpreter = TimingInterpreter() if heatmap_time else CountingInterpreter()
+        else:
+            self.interpreter = ENGINES[engine]()
+        if max_depth is not None:
+            self.interpreter.max_frames = max_depth
+        # globals are resolved to indexes in the table of the environment
+        # they will live in, the VM keeps its globals by name instead
+        globals_ = self.interpreter.globals
+        self.global_slots = globals_.slots if isinstance(globals_, GlobalEnvironment) else GlobalSlots()
+        self.optimize = optimize
+        self.stream = stream
+        self.mapped = mapped
+        self.cache = cache
+        self.rebuild_cache = rebuild_cache
+        self.cache_stats = cache_stats
+        self.lazy = lazy
+        self.profile = profile
+        self.profile_json = profile_json
+        # collapsed stacks are written here, sampled every sample_interval seconds
+        self.sample = sample
+        self.sample_interval = sample_interval
+        # the script annotated with how often each line ran is written here
+        self.heatmap = heatmap
+        self.mem_stats = mem_stats
+        self.mem_snapshots = mem_snapshots
+        self.mem_interval = mem_interval
+        # counts only while a script runs, see run_file
+        self.memory_stats = MemoryStats(self.interpreter) if mem_stats or mem_snapshots is not None else None
+        self.pool_stats = pool_stats
         self.error_handler = ErrorHandler()
 
     def run_file(self, path: str) -> None:
-        with open(path, 'r') as f:
-            content = f.read()
-            self.run(content)
-            if self.error_handler.had_error:
-                sys.exit(65)
-            if self.error_handler.had_runtime_error:
-                sys.exit(70)
+        memory = self.memory_stats
+        with memory if memory is not None else contextlib.nullcontext():
+            if memory is not None and self.mem_snapshots is not None:
+                memory.start_snapshots(self.mem_snapshots, self.mem_interval)
+            if self.sample is not None:
+                sampler = SamplingProfiler(self.interpreter, self.sample_interval)
+                with sampler:
+                    self._run_path(path)
+                sampler.write_collapsed(self.sample)
+                print(f"sampler took {sum(sampler.samples.values())} samples, wrote {self.sample}", file=sys.stderr)
+            else:
+                self._run_path(path)
+        if self.profile:
+            self._report_profile()
+        if memory is not None and self.mem_stats:
+            memory.report(sys.stderr)
+        if self.pool_stats:
+            self.interpreter.frame_pool.report(sys.stderr)
+        if self.heatmap is not None:
+            with open(path, 'r') as f:
+                source = f.read()
+            with open(self.heatmap, 'w') as out:
+                self.interpreter.heatmap(source, out)
+        if self.error_handler.had_error:
+            sys.exit(65)
+        if self.error_handler.had_runtime_error:
+            sys.exit(70)
+
+    def _run_path(self, path: str) -> None:
+        if self.cache and not self.stream:
+            self.run_cached(path)
+        elif self.mapped:
+            self.run_mapped(path)
+        else:
+            with open(path, 'r') as f:
+                if self.stream:
+                    self.run_stream(f)
+                else:
+                    content = f.read()
+                    self.run(content)
+
+    def run_cached(self, path: str) -> None:
+        """
+        Runs the statements cached for this exact source if there are any,
+        otherwise compiles them as usual and caches them for next time
+        """
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            if self.mapped:
+                # hashed and, on a miss, scanned in place
+                with self._map(f) as source:
+                    statements = self._load_or_compile(path, source, start)
+            else:
+                statements = self._load_or_compile(path, f.read(), start)
+        if statements is not None:
+            self.interpreter.interpret(statements)
+
+    def _load_or_compile(self, path: str, source, start: float) -> Optional[list[Stmt]]:
+        cache = AstCache(path, source, self.optimize, self.lazy)
+        statements = None if self.rebuild_cache else cache.load(self.global_slots)
+        if statements is not None:
+            self._report_cache(f"hit {cache.path}, loaded in {self._elapsed_ms(start)}")
+            return statements
+        reason = "rebuild requested" if self.rebuild_cache else cache.miss_reason
+        if self.mapped:
+            scanner = MappedScanner(source, self.error_handler)
+        else:
+            scanner = RegexScanner(source.decode("utf-8"), self.error_handler)
+        statements = self._compile(scanner.scan_tokens())
+        if statements is None:
+            return None
+        size = cache.store(statements, self.global_slots)
+        written = f"wrote {cache.path} ({size} bytes)" if size else "not written"
+        self._report_cache(f"miss ({reason}), compiled in {self._elapsed_ms(start)}, {written}")
+        return statements
+
+    def _report_profile(self) -> None:
+        profiler = self.interpreter.profiler
+        profiler.report(sys.stderr)
+        if self.profile_json is not None:
+            profiler.write_json(self.profile_json)
+
+    def _report_cache(self, message: str) -> None:
+        if self.cache_stats:
+            print(f"cache {message}", file=sys.stderr)
+
+    @staticmethod
+    def _elapsed_ms(start: float) -> str:
+        return f"{(time.perf_counter() - start) * 1000:.1f}ms"
+
+    def run_mapped(self, path: str) -> None:
+        """
+        Scans the file's bytes in place through mmap instead of reading it
+        into a string first, honouring --stream
+        """
+        with open(path, 'rb') as f, self._map(f) as source:
+            scanner = MappedScanner(source, self.error_handler)
+            if self.stream:
+                self._run_declarations(scanner.tokens())
+            else:
+                self._run_tokens(scanner.scan_tokens())
+
+    @staticmethod
+    def _map(f):
+        """A read only memory map of the open file, or b"" as an empty file can't be mapped"""
+        if os.fstat(f.fileno()).st_size == 0:
+            return contextlib.nullcontext(b"")
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
     def run_prompt(self) -> None:
         try:
@@ -32,32 +194,145 @@ class Lox:
             print("\nKeyboardInterrupt")
 
     def run(self, source: str) -> None:
-        scanner = Scanner(source, self.error_handler)
-        tokens = scanner.scan_tokens()
+        scanner = RegexScanner(source, self.error_handler)
+        self._run_tokens(scanner.scan_tokens())
+
+    def _run_tokens(self, tokens: list[Token]) -> None:
+        statements = self._compile(tokens)
+        if statements is not None:
+            self.interpreter.interpret(statements)
+
+    def _compile(self, tokens: list[Token]) -> Optional[list[Stmt]]:
+        """Parses, resolves and optionally optimizes, None on any error"""
         # print(f"Tokens from Scanner: {tokens}")
 
-        parser = Parser(tokens, self.error_handler)
+        parser = Parser(tokens, self.error_handler, self.lazy)
         statements = parser.parse()
         
         if self.error_handler.had_error:
-            return
+            return None
 
-        resolver = Resolver(self.interpreter, self.error_handler)
+        resolver = Resolver(self.error_handler, self.global_slots)
         resolver.resolve(statements)
 
         if self.error_handler.had_error:
-            return
-        
-        self.interpreter.interpret(statements)
+            return None
+
+        if self.optimize:
+            optimizer = Optimizer()
+            statements = optimizer.optimize(statements)
+            print(f"optimizer removed {optimizer.removed} nodes", file=sys.stderr)
+
+        return statements
+
+    def run_stream(self, source: TextIO) -> None:
+        """
+        Scans, parses, resolves and runs one top level declaration at a time,
+        so only the declaration being worked on is held in memory. Unlike run,
+        declarations before a syntax error have already run by the time it is
+        reported, after it the rest of the file is only parsed for errors
+        """
+        scanner = RegexScanner(source, self.error_handler)
+        self._run_declarations(scanner.tokens())
+
+    def _run_declarations(self, tokens: Iterable[Token]) -> None:
+        parser = Parser(tokens, self.error_handler, self.lazy)
+        resolver = Resolver(self.error_handler, self.global_slots)
+        optimizer = Optimizer() if self.optimize else None
+
+        for declaration in parser.declarations():
+            if self.error_handler.had_error:
+                continue
+            statements = [declaration]
+            resolver.resolve(statements)
+            if self.error_handler.had_error:
+                continue
+            if optimizer is not None:
+                statements = optimizer.optimize(statements)
+            self.interpreter.interpret(statements)
+            if self.interpreter.error_handler.had_runtime_error:
+                break
+
+        if optimizer is not None:
+            print(f"optimizer removed {optimizer.removed} nodes", file=sys.stderr)
 
 
 if __name__ == "__main__":
-    lox = Lox()
-    if len(sys.argv[1:]) > 1:
-        print(f"Usage: pylox [script]")
-        sys.exit(64)
-    elif len(sys.argv[1:]) == 1:
-        lox.run_file(sys.argv[1])
+    arg_parser = argparse.ArgumentParser(prog="pylox")
+    arg_parser.add_argument("script", nargs="?")
+    arg_parser.add_argument("--engine", choices=ENGINES.keys(), default="tree",
+                            help="tree walking interpreter, compiled closures or bytecode vm")
+    arg_parser.add_argument("--max-depth", type=int,
+                            help="maximum Lox call depth before a stack overflow error (vm only)")
+    arg_parser.add_argument("-O", dest="optimize", action="store_true",
+                            help="fold constants and drop dead code before running")
+    arg_parser.add_argument("--stream", action="store_true",
+                            help="run each top level declaration as soon as it is parsed")
+    arg_parser.add_argument("--mmap", dest="mapped", action="store_true",
+                            help="scan the script through a memory map instead of reading it into a string")
+    arg_parser.add_argument("--cache", action=argparse.BooleanOptionalAction, default=False,
+                            help="read and write the compiled tree cache in __loxcache__/ next to the script")
+    arg_parser.add_argument("--rebuild-cache", action="store_true",
+                            help="ignore any cached tree for the script and write a fresh one")
+    arg_parser.add_argument("--cache-stats", action="store_true",
+                            help="report cache hits and misses on stderr")
+    arg_parser.add_argument("--lazy", action="store_true",
+                            help="parse top level function bodies on their first call (tree only)")
+    arg_parser.add_argument("--profile", action="store_true",
+                            help="report calls and time per Lox function on stderr (tree only)")
+    arg_parser.add_argument("--profile-json", metavar="PATH",
+                            help="with --profile, also write the profile to PATH as JSON")
+    arg_parser.add_argument("--sample", metavar="PATH",
+                            help="sample the Lox call stack and write collapsed stacks for flamegraphs to PATH")
+    arg_parser.add_argument("--sample-interval", type=float, default=5.0, metavar="MS",
+                            help="milliseconds between samples (default 5)")
+    arg_parser.add_argument("--heatmap", metavar="PATH",
+                            help="write the script to PATH with how often each line ran (tree only)")
+    arg_parser.add_argument("--heatmap-time", action="store_true",
+                            help="with --heatmap, also time every node and show each line's share")
+    arg_parser.add_argument("--mem-stats", action="store_true",
+                            help="report allocated and live runtime objects on stderr (tree only)")
+    arg_parser.add_argument("--mem-snapshots", metavar="PATH",
+                            help="write live object counts and bytes to PATH as CSV while running (tree only)")
+    arg_parser.add_argument("--mem-interval", type=float, default=100.0, metavar="MS",
+                            help="milliseconds between --mem-snapshots rows (default 100)")
+    arg_parser.add_argument("--pool-stats", action="store_true",
+                            help="report how often calls reused a pooled frame on stderr (tree and closure)")
+    args = arg_parser.parse_args()
+    if args.max_depth is not None and args.engine != "vm":
+        arg_parser.error("--max-depth is only supported by --engine=vm")
+    if (args.rebuild_cache or args.cache_stats) and not args.cache:
+        arg_parser.error("--rebuild-cache and --cache-stats need --cache")
+    if args.lazy and args.engine != "tree":
+        arg_parser.error("--lazy is only supported by --engine=tree")
+    if args.profile and args.engine != "tree":
+        arg_parser.error("--profile is only supported by --engine=tree")
+    if args.profile_json is not None and not args.profile:
+        arg_parser.error("--profile-json needs --profile")
+    if args.sample is not None and args.engine == "closure":
+        arg_parser.error("--sample is only supported by --engine=tree and --engine=vm")
+    if args.heatmap is not None and args.engine != "tree":
+        arg_parser.error("--heatmap is only supported by --engine=tree")
+    if args.heatmap is not None and args.profile:
+        arg_parser.error("--heatmap and --profile can't be used together")
+    if args.heatmap_time and args.heatmap is None:
+        arg_parser.error("--heatmap-time needs --heatmap")
+    if (args.mem_stats or args.mem_snapshots is not None) and args.engine != "tree":
+        arg_parser.error("--mem-stats and --mem-snapshots are only supported by --engine=tree")
+    if args.pool_stats and args.engine == "vm":
+        arg_parser.error("--pool-stats is only supported by --engine=tree and --engine=closure")
+    if args.mem_interval <= 0:
+        arg_parser.error("--mem-interval must be positive")
+    if args.sample_interval <= 0:
+        arg_parser.error("--sample-interval must be positive")
+
+    lox = Lox(args.engine, args.max_depth, args.optimize, args.stream, args.mapped,
+              args.cache, args.rebuild_cache, args.cache_stats, args.lazy,
+              args.profile, args.profile_json, args.sample, args.sample_interval / 1000,
+              args.heatmap, args.heatmap_time, args.mem_stats, args.mem_snapshots, args.mem_interval / 1000,
+              args.pool_stats)
+    if args.script is not None:
+        lox.run_file(args.script)
     else:
         lox.run_prompt()
 
@@ -3,21 +3,26 @@ from typing import Any
 from lox_callable import LoxCallable
 from lox_instance import LoxInstance
 from lox_function import LoxFunction
+from shape import Shape
 
 
 class LoxClass(LoxCallable):
     def __init__(self, name: str, methods: dict):
         self.name = name
         self.methods = methods
+        # every instance starts out with no fields
+        self.shape = Shape(dict())
 
     def __str__(self):
         return self.name
 
     def call(self, interpreter, arguments: list[Any]):
         instance = LoxInstance(self)
+        if interpreter.memory_stats is not None:
+            interpreter.memory_stats.allocated(instance)
         initializer: LoxFunction = self.find_method("init")
         if initializer is not None:
-            initializer.bind(instance).call(interpreter, arguments)
+            initializer.invoke(interpreter, instance, arguments)
 
         return instance
 
@@ -1,38 +1,103 @@
-from environment import Environment
+from environment import Cell
+from error_handler import ErrorHandler
 from lox_callable import LoxCallable
-from return_exception import LoxReturnException
+from parser import Parser
+from resolver import FunctionType, Resolver
+from runtime_error import LoxRuntimeError
 from stmt import Function
+from token import Token
+from tokentype import TokenType
+
+
+def capture(declaration: Function, frame: list) -> tuple:
+    """(slot, Cell) for each upvalue of declaration, taken from the frame it is created in"""
+    return tuple((slot, frame[source]) for source, slot in declaration.upvalues)
 
 
 class LoxFunction(LoxCallable):
-    def __init__(self, declaration: Function, closure: Environment, is_initializer: bool):
+    def __init__(self, declaration: Function, cells: tuple, is_initializer: bool, this=None):
         self.declaration = declaration
-        self.closure = closure
+        # only the Cells of the variables the body captures, see capture
+        self.cells = cells
         self.is_initializer = is_initializer
+        # set on bound methods, which are only created when a method is
+        # used as a value rather than called straight away
+        self.this = this
 
     def bind(self, instance):
-        environment = Environment(self.closure)
-        environment.define("this", instance)
-        return LoxFunction(self.declaration, environment, self.is_initializer)
+        return LoxFunction(self.declaration, self.cells, self.is_initializer, instance)
 
     def call(self, interpreter, arguments):
-        environment = Environment(self.closure)
-        for param, arg in list(zip(self.declaration.params, arguments)):
-            environment.define(param.lexeme, arg)
-
-        try:
-            interpreter._execute_block(self.declaration.body, environment)
-        except LoxReturnException as return_value:
-            if self.is_initializer:
-                return self.closure.get_at(0, "this")
-            return return_value.value
+        if self.this is not None:
+            return self.invoke(interpreter, self.this, arguments)
+
+        if self.declaration.body_tokens is not None:
+            self._parse_body(interpreter, FunctionType.FUNCTION)
+        frame = interpreter.frame_pool.acquire(self.declaration)
+        frame[:len(arguments)] = arguments
+        return self.run(interpreter, frame)
+
+    def invoke(self, interpreter, this, arguments):
+        """
+        Calls a method on an instance without binding it first, this goes in
+        slot 0 of the frame followed by the parameters
+        """
+        if self.declaration.body_tokens is not None:
+            self._parse_body(interpreter, FunctionType.INITIALIZER if self.is_initializer else FunctionType.METHOD)
+        frame = interpreter.frame_pool.acquire(self.declaration)
+        frame[0] = this
+        frame[1:len(arguments) + 1] = arguments
+        return self.run(interpreter, frame, this)
+
+    def run(self, interpreter, frame: list, this=None):
+        """
+        Runs the body in a frame from interpreter.frame_pool that already
+        holds the arguments, and gives the frame back once it returns. The
+        Interpreter calls this directly, with the arguments evaluated
+        straight into the frame, when the body has been parsed and the
+        argument count is right
+        """
+        declaration = self.declaration
+        # captured parameters are boxed, and the closure's Cells copied into
+        # the slots the body reads them from
+        for slot in declaration.cell_params:
+            cell = frame[slot] = Cell(frame[slot])
+            if interpreter.memory_stats is not None:
+                interpreter.memory_stats.allocated(cell)
+        for slot, cell in self.cells:
+            frame[slot] = cell
+        completion = interpreter._execute_function(self, frame)
+        interpreter.frame_pool.release(declaration, frame)
         if self.is_initializer:
-            return self.closure.get_at(0, "this")
+            return this
+        if completion is not None:
+            return completion[0]
         return None
 
+    def _parse_body(self, interpreter, func_type: FunctionType):
+        """
+        Parses and resolves again a body whose tree the Resolver dropped with
+        --lazy. It was checked before the program ran, so an error here would
+        be a bug, it is still reported and stops the program as a runtime
+        error at the call that needed the body
+        """
+        declaration = self.declaration
+        tokens = declaration.body_tokens
+        # the Resolver keeps the body it resolves once it has no tokens
+        declaration.body_tokens = None
+        error_handler = ErrorHandler()
+        parser = Parser(tokens + [Token(TokenType.EOF, "", None, tokens[-1].line)], error_handler)
+        body = parser.body()
+        if not error_handler.had_error:
+            declaration.body = body
+            Resolver(error_handler, interpreter.globals.slots).resolve_body(declaration, func_type)
+        if error_handler.had_error:
+            declaration.body = []
+            declaration.body_tokens = tokens
+            raise LoxRuntimeError(declaration.name, f"Invalid body for '{declaration.name.lexeme}'.")
+
     def arity(self) -> int:
         return len(self.declaration.params)
 
     def __str__(self):
         return f"<fn {self.declaration.name.lexeme}>"
-
@@ -2,15 +2,20 @@ from token import Token
 from typing import Any
 
 from runtime_error import LoxRuntimeError
+from shape import Shape
 
 class LoxInstance:
+    __slots__ = ("klass", "shape", "values")
+
     def __init__(self, klass):
         self.klass = klass
-        self.fields = dict()
+        self.shape: Shape = klass.shape
+        self.values: list[Any] = []
 
     def get(self, name: Token):
-        if name.lexeme in self.fields.keys():
-            return self.fields[name.lexeme]
+        index = self.shape.fields.get(name.lexeme)
+        if index is not None:
+            return self.values[index]
 
         method = self.klass.find_method(name.lexeme)
         if method is not None:
@@ -19,7 +24,12 @@ class LoxInstance:
         raise LoxRuntimeError(name, f"Undefined property {name.lexeme}.")
 
     def set(self, name: Token, value: Any):
-        self.fields[name.lexeme] = value
+        index = self.shape.fields.get(name.lexeme)
+        if index is None:
+            self.shape = self.shape.add(name.lexeme)
+            self.values.append(value)
+        else:
+            self.values[index] = value
 
     def __str__(self):
         return f"{self.klass.name} instance"
@@ -0,0 +1,287 @@
+import gc
+import sys
+import threading
+import time
+from typing import Optional, TextIO
+
+from environment import Cell
+from lox_function import LoxFunction
+from lox_instance import LoxInstance
+
+FRAME = "frame"
+CELL = "Cell"
+FUNCTION = "LoxFunction"
+BOUND_METHOD = "bound method"
+INSTANCE = "LoxInstance"
+RETURN_VALUE = "return value"
+KINDS = (FRAME, CELL, FUNCTION, BOUND_METHOD, INSTANCE, RETURN_VALUE)
+
+# the 1-tuple a return statement completes with
+_RETURN_SIZE = sys.getsizeof((None,))
+
+
+def _kind(obj) -> Optional[str]:
+    """Which kind obj is counted as, None for anything the stats don't cover"""
+    cls = type(obj)
+    if cls is Cell:
+        return CELL
+    if cls is LoxFunction:
+        return FUNCTION if obj.this is None else BOUND_METHOD
+    if cls is LoxInstance:
+        return INSTANCE
+    return None
+
+
+def _size(kind: str, obj) -> int:
+    if kind == FUNCTION or kind == BOUND_METHOD:
+        return sys.getsizeof(obj) + sys.getsizeof(obj.__dict__)
+    if kind == INSTANCE:
+        return sys.getsizeof(obj) + sys.getsizeof(obj.values)
+    return sys.getsizeof(obj)
+
+
+class KindStats:
+    __slots__ = ("allocated", "allocated_bytes", "live", "live_bytes")
+
+    def __init__(self):
+        self.allocated = 0
+        # sizes as measured when each object was created, the lists inside
+        # instances may grow afterwards
+        self.allocated_bytes = 0
+        # brought up to date by MemoryStats.update
+        self.live = 0
+        self.live_bytes = 0
+
+
+class MemoryStats:
+    """
+    Counts the runtime objects the tree walker creates: how many of each kind
+    were allocated in total, how many are still live and roughly how many
+    bytes they take, plus how many frames were entered and in use at once.
+
+    The Interpreter, LoxFunction, LoxClass and FramePool hand each object
+    they create to allocated while their memory_stats is set, which only
+    happens between enable and disable, so use it as a context manager.
+    Objects are never hooked to see them freed, instead update finds the
+    live ones with a walk over everything the garbage collector tracks.
+    Frames and return values are plain lists and tuples, so they are
+    counted off the FramePool and the interpreter methods that make them
+    """
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.kinds = {kind: KindStats() for kind in KINDS}
+        # calls plus top level blocks and loops, most of them reuse a frame
+        self.frames_entered = 0
+        # most frames in use at once, the call depth plus any top level block
+        self.max_frame_depth = 0
+        self._frame_depth = 0
+        # top level block and loop frames dropped as they were left, frames
+        # the FramePool drops are its discards since enable
+        self._frames_released = 0
+        self._discarded_before = 0
+        self._enabled = False
+        self.started = time.perf_counter()
+        self._snapshot_thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def __enter__(self) -> "MemoryStats":
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.disable()
+
+    def enable(self) -> None:
+        interpreter = self.interpreter
+        if interpreter.memory_stats is not None:
+            raise RuntimeError("memory stats are already being collected")
+        interpreter.memory_stats = self
+        interpreter.frame_pool.memory_stats = self
+        self._discarded_before = interpreter.frame_pool.discarded
+        self._shadow_frames(interpreter)
+        self._shadow_returns(interpreter)
+        self._enabled = True
+
+    def disable(self) -> None:
+        if not self._enabled:
+            return
+        self.stop_snapshots()
+        self.update()
+        interpreter = self.interpreter
+        interpreter.memory_stats = None
+        interpreter.frame_pool.memory_stats = None
+        del interpreter._execute_block
+        del interpreter._execute_function
+        del interpreter.visit_block_stmt
+        del interpreter.visit_for_stmt
+        del interpreter.visit_return_stmt
+        self._enabled = False
+
+    def allocated(self, obj) -> None:
+        """Counts obj, a Cell, LoxFunction, LoxInstance or a frame from the FramePool"""
+        kind = FRAME if type(obj) is list else _kind(obj)
+        stats = self.kinds[kind]
+        stats.allocated += 1
+        stats.allocated_bytes += _size(kind, obj)
+
+    def update(self) -> None:
+        """
+        Brings the live counts up to date. Frames are live until left or
+        discarded by the pool, return values are dropped straight away and
+        everything else is live while it can still be found
+        """
+        if self._enabled:
+            discarded = self.interpreter.frame_pool.discarded - self._discarded_before
+            frames = self.kinds[FRAME]
+            frames.live = frames.allocated - self._frames_released - discarded
+            frames.live_bytes = frames.live * frames.allocated_bytes // frames.allocated if frames.allocated else 0
+
+            live = {kind: [0, 0] for kind in (CELL, FUNCTION, BOUND_METHOD, INSTANCE)}
+            for obj in gc.get_objects():
+                kind = _kind(obj)
+                if kind is not None:
+                    counts = live[kind]
+                    counts[0] += 1
+                    counts[1] += _size(kind, obj)
+            for kind, (count, size) in live.items():
+                self.kinds[kind].live = count
+                self.kinds[kind].live_bytes = size
+
+    def _shadow_frames(self, interpreter) -> None:
+        # shadowed on the instance, visitors dispatch through self. A call's
+        # frame only counts as allocated when the FramePool has to make one,
+        # a block or loop at top level gets a new frame every time
+        stats = self.kinds[FRAME]
+        original_execute_block = type(interpreter)._execute_block
+        original_execute_function = type(interpreter)._execute_function
+        original_visit_block_stmt = type(interpreter).visit_block_stmt
+        original_visit_for_stmt = type(interpreter).visit_for_stmt
+
+        def enter():
+            self.frames_entered += 1
+            self._frame_depth += 1
+            if self._frame_depth > self.max_frame_depth:
+                self.max_frame_depth = self._frame_depth
+
+        def _execute_block(statements, frame):
+            # a block or loop at top level
+            enter()
+            try:
+                return original_execute_block(interpreter, statements, frame)
+            finally:
+                self._frame_depth -= 1
+
+        def _execute_function(function, frame):
+            enter()
+            try:
+                return original_execute_function(interpreter, function, frame)
+            finally:
+                self._frame_depth -= 1
+
+        def visit_block_stmt(stmt):
+            if stmt.slot_count == 0:
+                return original_visit_block_stmt(interpreter, stmt)
+            stats.allocated += 1
+            stats.allocated_bytes += sys.getsizeof([None] * stmt.slot_count)
+            try:
+                return original_visit_block_stmt(interpreter, stmt)
+            finally:
+                self._frames_released += 1
+
+        def visit_for_stmt(stmt):
+            if stmt.slot_count == 0:
+                return original_visit_for_stmt(interpreter, stmt)
+            # only a loop at top level has a frame of its own
+            stats.allocated += 1
+            stats.allocated_bytes += sys.getsizeof([None] * stmt.slot_count)
+            enter()
+            try:
+                return original_visit_for_stmt(interpreter, stmt)
+            finally:
+                self._frame_depth -= 1
+                self._frames_released += 1
+
+        interpreter._execute_block = _execute_block
+        interpreter._execute_function = _execute_function
+        interpreter.visit_block_stmt = visit_block_stmt
+        interpreter.visit_for_stmt = visit_for_stmt
+
+    def _shadow_returns(self, interpreter) -> None:
+        stats = self.kinds[RETURN_VALUE]
+        original = type(interpreter).visit_return_stmt
+
+        def visit_return_stmt(stmt):
+            stats.allocated += 1
+            stats.allocated_bytes += _RETURN_SIZE
+            # unwrapped and dropped by LoxFunction.run straight away
+            return original(interpreter, stmt)
+
+        interpreter.visit_return_stmt = visit_return_stmt
+
+    def snapshot(self) -> dict:
+        self.update()
+        return {
+            "elapsed_seconds": time.perf_counter() - self.started,
+            "kinds": {
+                kind: {
+                    "allocated": stats.allocated,
+                    "live": stats.live,
+                    "allocated_bytes": stats.allocated_bytes,
+                    "live_bytes": stats.live_bytes,
+                }
+                for kind, stats in self.kinds.items()
+            },
+            "frames_entered": self.frames_entered,
+            "max_frame_depth": self.max_frame_depth,
+        }
+
+    def report(self, out: TextIO) -> None:
+        self.update()
+        print(f"{'kind':<14} {'allocated':>11} {'live':>9} {'allocated KB':>13} {'live KB':>9}", file=out)
+        for kind, stats in self.kinds.items():
+            print(
+                f"{kind:<14} {stats.allocated:>11} {stats.live:>9} "
+                f"{stats.allocated_bytes / 1024:>13.1f} {stats.live_bytes / 1024:>9.1f}",
+                file=out
+            )
+        print(f"frames entered: {self.frames_entered}, peak frame depth: {self.max_frame_depth}", file=out)
+
+    def start_snapshots(self, path: str, interval: float) -> None:
+        """
+        Appends a CSV row of live counts and bytes per kind to path every
+        interval seconds from a background thread, until stop_snapshots
+        """
+        columns = ["elapsed_seconds"]
+        for kind in KINDS:
+            columns += [f"{kind} live", f"{kind} live bytes"]
+        columns += ["frames_entered", "max_frame_depth"]
+        out = open(path, "w")
+        out.write(",".join(columns) + "\n")
+
+        def write_row():
+            self.update()
+            row = [f"{time.perf_counter() - self.started:.4f}"]
+            for stats in self.kinds.values():
+                row += [str(stats.live), str(stats.live_bytes)]
+            row += [str(self.frames_entered), str(self.max_frame_depth)]
+            out.write(",".join(row) + "\n")
+
+        def run():
+            with out:
+                write_row()
+                while not self._stopped.wait(interval):
+                    write_row()
+                # the state at exit, so the last row covers the whole run
+                write_row()
+
+        self._stopped.clear()
+        self._snapshot_thread = threading.Thread(target=run, name="lox-memstats", daemon=True)
+        self._snapshot_thread.start()
+
+    def stop_snapshots(self) -> None:
+        if self._snapshot_thread is None:
+            return
+        self._stopped.set()
+        self._snapshot_thread.join()
+        self._snapshot_thread = None
@@ -3,6 +3,8 @@ from lox_callable import LoxCallable
 
 
 class Clock(LoxCallable):
+    name = "clock"
+
     def call(self, interpreter, arguments):
         return time.time()
 
@@ -0,0 +1,268 @@
+from typing import Optional
+
+from expr import (
+    Assign,
+    Binary,
+    Call,
+    Expr,
+    Get,
+    Grouping,
+    Literal,
+    Logical,
+    Set,
+    This,
+    Unary,
+    Variable
+)
+from interpreter import Interpreter
+from resolver import Resolver
+from stmt import (
+    Block,
+    Class,
+    Expression,
+    For,
+    Function,
+    If,
+    Print,
+    Return,
+    Stmt,
+    Var,
+    While
+)
+from tokentype import TokenType
+from visitor import Visitor
+
+_is_truthy = Interpreter._is_truthy
+_is_equal = Interpreter._is_equal
+
+# only folded when both operands are number literals, anything that would be
+# a runtime error (or a ZeroDivisionError) is left for the engine to report
+_NUMERIC_FOLDS = {
+    TokenType.PLUS: float.__add__,
+    TokenType.MINUS: float.__sub__,
+    TokenType.STAR: float.__mul__,
+    TokenType.GREATER: float.__gt__,
+    TokenType.GREATER_EQUAL: float.__ge__,
+    TokenType.LESS: float.__lt__,
+    TokenType.LESS_EQUAL: float.__le__,
+}
+
+# operators whose result is always a number (or a runtime error)
+_NUMERIC_RESULTS = (TokenType.MINUS, TokenType.STAR, TokenType.SLASH)
+
+
+def count_nodes(node) -> int:
+    """Number of Expr/Stmt nodes in a tree or list of trees"""
+    if isinstance(node, list):
+        return sum(count_nodes(child) for child in node)
+    if not isinstance(node, (Expr, Stmt)):
+        return 0
+    total = 1
+    for cls in type(node).__mro__:
+        for field in getattr(cls, "__slots__", ()):
+            total += count_nodes(getattr(node, field, None))
+    return total
+
+
+class Optimizer(Visitor):
+    """
+    Simplifies resolved statements before they are run: folds literal only
+    expressions, drops branches and loops that can never run, statements after
+    a return, and Grouping nodes. Nodes that survive are reused as they are,
+    so the Resolver's slot annotations stay valid
+    """
+
+    def __init__(self):
+        self.removed = 0
+
+    def optimize(self, statements: list[Stmt]) -> list[Stmt]:
+        before = count_nodes(statements)
+        statements = self._statements(statements)
+        self.removed += before - count_nodes(statements)
+        return statements
+
+    def _expr(self, expr: Expr) -> Expr:
+        return expr.accept(self)
+
+    def _stmt(self, stmt: Stmt) -> Optional[Stmt]:
+        return stmt.accept(self)
+
+    def _body(self, stmt: Stmt) -> Stmt:
+        # a branch or loop body has to stay a statement
+        optimized = self._stmt(stmt)
+        return optimized if optimized is not None else Block([])
+
+    def _statements(self, statements: list[Stmt]) -> list[Stmt]:
+        optimized = []
+        for statement in statements:
+            statement = self._stmt(statement)
+            if statement is None:
+                continue
+            optimized.append(statement)
+            if isinstance(statement, Return):
+                break
+        return optimized
+
+    @staticmethod
+    def _is_number(expr: Expr) -> bool:
+        if isinstance(expr, Literal):
+            return type(expr.value) is float
+        if isinstance(expr, Unary):
+            return expr.operator.token_type == TokenType.MINUS
+        if isinstance(expr, Binary):
+            return expr.operator.token_type in _NUMERIC_RESULTS
+        return False
+
+    # statements
+
+    def visit_block_stmt(self, stmt: Block):
+        stmt.statements = self._statements(stmt.statements)
+        if not stmt.statements:
+            return None
+        return stmt
+
+    def visit_class_stmt(self, stmt: Class):
+        for method in stmt.methods:
+            self.visit_function_stmt(method)
+        return stmt
+
+    def visit_expression_stmt(self, stmt: Expression):
+        stmt.expression = self._expr(stmt.expression)
+        if isinstance(stmt.expression, Literal):
+            return None
+        return stmt
+
+    def visit_for_stmt(self, stmt: For):
+        if stmt.initializer is not None:
+            stmt.initializer = self._stmt(stmt.initializer)
+        if stmt.condition is not None:
+            stmt.condition = self._expr(stmt.condition)
+            if isinstance(stmt.condition, Literal) and not _is_truthy(stmt.condition.value) and \
+                    not isinstance(stmt.initializer, Var):
+                return stmt.initializer
+        if stmt.increment is not None:
+            stmt.increment = self._expr(stmt.increment)
+        stmt.body = self._body(stmt.body)
+        # folding may have turned the bound into a literal
+        stmt.counted = Resolver._is_counted_loop(stmt)
+        return stmt
+
+    def visit_function_stmt(self, stmt: Function):
+        stmt.body = self._statements(stmt.body)
+        return stmt
+
+    def visit_if_stmt(self, stmt: If):
+        stmt.condition = self._expr(stmt.condition)
+        if isinstance(stmt.condition, Literal):
+            if _is_truthy(stmt.condition.value):
+                return self._stmt(stmt.then_branch)
+            if stmt.else_branch is not None:
+                return self._stmt(stmt.else_branch)
+            return None
+        stmt.then_branch = self._body(stmt.then_branch)
+        if stmt.else_branch is not None:
+            stmt.else_branch = self._stmt(stmt.else_branch)
+        return stmt
+
+    def visit_print_stmt(self, stmt: Print):
+        stmt.expression = self._expr(stmt.expression)
+        return stmt
+
+    def visit_return_stmt(self, stmt: Return):
+        if stmt.value is not None:
+            stmt.value = self._expr(stmt.value)
+        return stmt
+
+    def visit_var_stmt(self, stmt: Var):
+        if stmt.initializer is not None:
+            stmt.initializer = self._expr(stmt.initializer)
+        return stmt
+
+    def visit_while_stmt(self, stmt: While):
+        stmt.condition = self._expr(stmt.condition)
+        if isinstance(stmt.condition, Literal) and not _is_truthy(stmt.condition.value):
+            return None
+        stmt.body = self._body(stmt.body)
+        return stmt
+
+    # expressions
+
+    def visit_assign_expr(self, expr: Assign):
+        expr.value = self._expr(expr.value)
+        return expr
+
+    def visit_binary_expr(self, expr: Binary):
+        expr.left = left = self._expr(expr.left)
+        expr.right = right = self._expr(expr.right)
+        token_type = expr.operator.token_type
+
+        if isinstance(left, Literal) and isinstance(right, Literal):
+            a = left.value
+            b = right.value
+            if token_type == TokenType.EQUAL_EQUAL:
+                return Literal(_is_equal(a, b))
+            if token_type == TokenType.BANG_EQUAL:
+                return Literal(not _is_equal(a, b))
+            if type(a) is float and type(b) is float:
+                if token_type in _NUMERIC_FOLDS:
+                    return Literal(_NUMERIC_FOLDS[token_type](a, b))
+                if token_type == TokenType.SLASH and b != 0:
+                    return Literal(a / b)
+            elif type(a) is str and type(b) is str and token_type == TokenType.PLUS:
+                return Literal(a + b)
+            return expr
+
+        # identities that hold for every float, including -0.0 and nan, and
+        # only when the other side can't be anything but a number
+        if isinstance(right, Literal) and type(right.value) is float and self._is_number(left):
+            if (token_type in (TokenType.STAR, TokenType.SLASH) and right.value == 1.0) or \
+                    (token_type == TokenType.MINUS and right.value == 0.0):
+                return left
+        if isinstance(left, Literal) and type(left.value) is float and self._is_number(right):
+            if token_type == TokenType.STAR and left.value == 1.0:
+                return right
+        return expr
+
+    def visit_call_expr(self, expr: Call):
+        expr.callee = self._expr(expr.callee)
+        expr.arguments = [self._expr(argument) for argument in expr.arguments]
+        return expr
+
+    def visit_get_expr(self, expr: Get):
+        expr.obj = self._expr(expr.obj)
+        return expr
+
+    def visit_grouping_expr(self, expr: Grouping):
+        return self._expr(expr.expression)
+
+    def visit_literal_expr(self, expr: Literal):
+        return expr
+
+    def visit_logical_expr(self, expr: Logical):
+        expr.left = left = self._expr(expr.left)
+        expr.right = self._expr(expr.right)
+        if not isinstance(left, Literal):
+            return expr
+        if expr.operator.token_type == TokenType.OR:
+            return left if _is_truthy(left.value) else expr.right
+        return expr.right if _is_truthy(left.value) else left
+
+    def visit_set_expr(self, expr: Set):
+        expr.obj = self._expr(expr.obj)
+        expr.value = self._expr(expr.value)
+        return expr
+
+    def visit_this_expr(self, expr: This):
+        return expr
+
+    def visit_unary_expr(self, expr: Unary):
+        expr.right = right = self._expr(expr.right)
+        if isinstance(right, Literal):
+            if expr.operator.token_type == TokenType.BANG:
+                return Literal(not _is_truthy(right.value))
+            if type(right.value) is float:
+                return Literal(-right.value)
+        return expr
+
+    def visit_variable_expr(self, expr: Variable):
+        return expr
@@ -1,8 +1,10 @@
 
+from typing import Iterable, Iterator
+
 from token import Token
 
 from expr import Binary, Expr, Grouping, Literal, Unary, Variable, Assign, Logical, Call, Get, Set, This
-from stmt import Block, Expression, If, Print, Stmt, Var, While, Function, Return, Class 
+from stmt import Block, Expression, For, If, Print, Stmt, Var, While, Function, Return, Class 
 from tokentype import TokenType
 from error_handler import ErrorHandler
 
@@ -12,28 +14,41 @@ class ParseError(Exception):
 
 class Parser:
 
-    def __init__(self, tokens: list[Token], error_handler: ErrorHandler):
-        self.tokens = tokens
-        self.current = 0
+    def __init__(self, tokens: Iterable[Token], error_handler: ErrorHandler, lazy: bool = False):
+        # tokens are pulled one at a time, the parser only ever looks at the
+        # current token and the one before it
+        self.tokens = iter(tokens)
+        self._current_token = next(self.tokens)
+        self._previous_token = None
         self.error_handler = error_handler
+        # also keep the tokens of top level function and method bodies, so
+        # the Resolver can drop their trees once it has checked them and
+        # LoxFunction parse them again on the first call
+        self.lazy = lazy
 
     def parse(self) -> list[Stmt]:
-        statements = []
+        return list(self.declarations())
+
+    def declarations(self) -> Iterator[Stmt | None]:
+        """Yields each top level declaration as soon as it has been parsed"""
         while not self._is_at_end():
-            decl = self._declaration()
+            decl = self._declaration(top_level=True)
             # print(f"declaration return: {decl}")
-            statements.append(decl)
-        return statements
+            yield decl
 
     def _expression(self) -> Expr:
         return self._assignment()
 
-    def _declaration(self) -> Stmt | None:
+    def body(self) -> list[Stmt]:
+        """Parses the tokens of a skipped function body, up to its closing brace"""
+        return self._block()
+
+    def _declaration(self, top_level: bool = False) -> Stmt | None:
         try:
             if self._match(TokenType.CLASS):
-                return self._class_declaration()
+                return self._class_declaration(top_level)
             if self._match(TokenType.FUN):
-                return self._function("function")
+                return self._function("function", top_level)
             if self._match(TokenType.VAR):
                 return self._var_declaration()
             return self._statement()
@@ -41,13 +56,13 @@ class Parser:
             self._synchronize()
             return None
 
-    def _class_declaration(self) -> Stmt:
+    def _class_declaration(self, top_level: bool = False) -> Stmt:
         name = self._consume(TokenType.IDENTIFIER, "Expect class name.")
         self._consume(TokenType.LEFT_BRACE, "Expect '{' before class body.")
 
         methods = []
         while not self._check(TokenType.RIGHT_BRACE) and not self._is_at_end():
-            methods.append(self._function("method"))
+            methods.append(self._function("method", top_level))
 
         self._consume(TokenType.RIGHT_BRACE, "Expect '}' after class body.")
         return Class(name, methods)
@@ -86,17 +101,9 @@ class Parser:
 
         body = self._statement()
 
-        # here we're "desugaring" the for loop into an equivalent while loop
-        if increment != None:
-            body = Block([body, Expression(increment)])
-        if condition is None:
-            condition = Literal(True)
-        body = While(condition, body)
-
-        if initializer is not None:
-            body = Block([initializer, body])
-
-        return body
+        # kept as its own node rather than desugared into Block + While, so
+        # the loop header gets one scope and counted loops can be spotted
+        return For(initializer, condition, increment, body)
 
     def _if_statement(self) -> Stmt:
         self._consume(TokenType.LEFT_PAREN, "Expect '(' after 'if'.")
@@ -147,7 +154,7 @@ class Parser:
         self._consume(TokenType.SEMICOLON, "Expect ';' after expression.")
         return  Expression(expr)
 
-    def _function(self, kind: str) -> Function:
+    def _function(self, kind: str, top_level: bool = False) -> Function:
         name = self._consume(TokenType.IDENTIFIER, f"Expect {kind} name.")
         self._consume(TokenType.LEFT_PAREN, f"Expect '(' after {kind} name.")
         parameters = []
@@ -160,9 +167,31 @@ class Parser:
         self._consume(TokenType.RIGHT_PAREN, "Expect ')' after parameters.")
 
         self._consume(TokenType.LEFT_BRACE, f"Expect '{{' before {kind} body.")
+        if self.lazy and top_level:
+            body, body_tokens = self._recorded_block()
+            return Function(name, parameters, body, body_tokens=body_tokens)
         body = self._block()
         return Function(name, parameters, body)
 
+    def _recorded_block(self) -> tuple[list[Stmt], list[Token]]:
+        """Parses a block, also returning its tokens up to and including the closing brace"""
+        tokens = [self._current_token]
+        source = self.tokens
+
+        def recording():
+            for token in source:
+                tokens.append(token)
+                yield token
+
+        self.tokens = recording()
+        try:
+            body = self._block()
+        finally:
+            self.tokens = source
+        # the last one is the current token, past the block
+        tokens.pop()
+        return body, tokens
+
     def _block(self) -> list[Stmt]:
         statements = []
         while not self._check(TokenType.RIGHT_BRACE) and not self._is_at_end():
@@ -322,17 +351,18 @@ class Parser:
 
     def _advance(self) -> Token:
         if not self._is_at_end():
-            self.current +=1
+            self._previous_token = self._current_token
+            self._current_token = next(self.tokens)
         return self._previous()
 
     def _is_at_end(self) -> bool:
-        return self._peek().token_type == TokenType.EOF
+        return self._current_token.token_type == TokenType.EOF
 
     def _peek(self) -> Token:
-        return self.tokens[self.current]
+        return self._current_token
 
     def _previous(self) -> Token:
-        return self.tokens[self.current - 1]
+        return self._previous_token
 
     def _error(self, token: Token, message: str) -> ParseError:
         self.error_handler.token_error(token, message)
@@ -345,7 +375,7 @@ class Parser:
             if self._previous().token_type == TokenType.SEMICOLON:
                 return
             
-            if self._peek().type in [
+            if self._peek().token_type in [
                 TokenType.CLASS,
                 TokenType.FUN,
                 TokenType.VAR,
@@ -357,5 +387,3 @@ class Parser:
             ]:
                 return
             self._advance()
-
-
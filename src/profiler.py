@@ -0,0 +1,180 @@
+import json
+import time
+from typing import Optional, TextIO
+
+from expr import Call
+from interpreter import Interpreter
+from lox_callable import LoxCallable
+from lox_class import LoxClass
+from lox_function import LoxFunction
+from stmt import Class, Function
+
+# what calls made outside of any function are attributed to
+SCRIPT = ("<script>", None)
+
+
+class FunctionStats:
+    __slots__ = ("name", "line", "calls", "inclusive", "exclusive", "callers")
+
+    def __init__(self, name: str, line: Optional[int]):
+        self.name = name
+        self.line = line
+        self.calls = 0
+        # seconds, inclusive counts each recursive activation only once
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+        # (name, line) of the caller -> number of calls from it
+        self.callers: dict[tuple[str, Optional[int]], int] = {}
+
+    def label(self) -> str:
+        return _label((self.name, self.line))
+
+
+def _label(key: tuple[str, Optional[int]]) -> str:
+    name, line = key
+    return name if line is None else f"{name}:{line}"
+
+
+class Profiler:
+    """
+    Call counts and times per Lox callable, keyed by its name and the line it
+    was declared on. enter/exit bracket every call, so each activation on the
+    stack knows how long its callees took and can work out its own time
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.stats: dict[tuple[str, Optional[int]], FunctionStats] = {}
+        # [key, start, time spent in callees] for each active call
+        self._stack: list[list] = []
+        # key -> number of activations of it on the stack
+        self._active: dict[tuple[str, Optional[int]], int] = {}
+
+    def enter(self, key: tuple[str, Optional[int]]) -> None:
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = FunctionStats(*key)
+        stats.calls += 1
+        caller = self._stack[-1][0] if self._stack else SCRIPT
+        stats.callers[caller] = stats.callers.get(caller, 0) + 1
+        self._active[key] = self._active.get(key, 0) + 1
+        self._stack.append([key, self.clock(), 0.0])
+
+    def exit(self) -> None:
+        key, start, children = self._stack.pop()
+        elapsed = self.clock() - start
+        stats = self.stats[key]
+        stats.exclusive += elapsed - children
+        self._active[key] -= 1
+        if self._active[key] == 0:
+            stats.inclusive += elapsed
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def sorted_stats(self) -> list[FunctionStats]:
+        return sorted(self.stats.values(), key=lambda stats: stats.exclusive, reverse=True)
+
+    def report(self, out: TextIO, limit: int = 30) -> None:
+        print(f"{'calls':>9} {'incl ms':>10} {'excl ms':>10} {'excl us/call':>12}  function (top callers)", file=out)
+        for stats in self.sorted_stats()[:limit]:
+            callers = sorted(stats.callers.items(), key=lambda item: item[1], reverse=True)
+            callers = ", ".join(f"{_label(caller)} x{count}" for caller, count in callers[:3])
+            print(
+                f"{stats.calls:>9} {stats.inclusive * 1000:>10.2f} {stats.exclusive * 1000:>10.2f} "
+                f"{stats.exclusive * 1e6 / stats.calls:>12.2f}  {stats.label()} ({callers})",
+                file=out
+            )
+
+    def to_json(self) -> dict:
+        return {
+            "functions": [
+                {
+                    "name": stats.name,
+                    "line": stats.line,
+                    "calls": stats.calls,
+                    "inclusive_seconds": stats.inclusive,
+                    "exclusive_seconds": stats.exclusive,
+                    "callers": [
+                        {"name": caller[0], "line": caller[1], "calls": count}
+                        for caller, count in stats.callers.items()
+                    ],
+                }
+                for stats in self.sorted_stats()
+            ]
+        }
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+
+class _ProfiledCallable(LoxCallable):
+    """
+    A class or native as _call is handed it, so the Profiler's clock starts
+    once the Interpreter has evaluated the arguments and checked their count
+    """
+
+    __slots__ = ("callable", "key", "profiler")
+
+    def __init__(self, callable: LoxCallable, key: tuple[str, Optional[int]], profiler: Profiler):
+        self.callable = callable
+        self.key = key
+        self.profiler = profiler
+
+    def call(self, interpreter, arguments):
+        self.profiler.enter(self.key)
+        try:
+            return self.callable.call(interpreter, arguments)
+        finally:
+            self.profiler.exit()
+
+    def arity(self) -> int:
+        return self.callable.arity()
+
+
+class ProfilingInterpreter(Interpreter):
+    """
+    The tree walker with every call of a LoxFunction, LoxClass or native
+    bracketed by the Profiler. Arguments are evaluated before the callee's
+    clock starts, so calls made while evaluating them belong to the caller.
+    Only used with --profile, the plain Interpreter has no profiling checks
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.profiler = Profiler()
+        # declaration of a method -> its key, named after its class
+        self._method_keys: dict[Function, tuple[str, int]] = {}
+        # each class -> its key, two classes of the same name are kept apart
+        self._class_keys: dict[LoxClass, tuple[str, int]] = {}
+
+    def _initialize(self, declaration: Function | Class, value):
+        if type(declaration) is Class:
+            self._class_keys[value] = declaration.name.lexeme, declaration.name.line
+            for method in declaration.methods:
+                self._method_keys[method] = f"{value.name}.{method.name.lexeme}", method.name.line
+        return super()._initialize(declaration, value)
+
+    def _execute_function(self, function: LoxFunction, frame: list):
+        # every call of a function or method ends up here, whichever path
+        # the Interpreter took to set up its frame
+        declaration = function.declaration
+        key = self._method_keys.get(declaration)
+        if key is None:
+            key = declaration.name.lexeme, declaration.name.line
+        profiler = self.profiler
+        profiler.enter(key)
+        try:
+            return super()._execute_function(function, frame)
+        finally:
+            profiler.exit()
+
+    def _call(self, expr: Call, function):
+        # the call of a LoxFunction is timed by _execute_function, a class or
+        # native is wrapped, which keeps it off the Interpreter's fast path
+        if type(function) is LoxClass:
+            function = _ProfiledCallable(function, self._class_keys[function], self.profiler)
+        elif isinstance(function, LoxCallable) and not isinstance(function, LoxFunction):
+            name = getattr(function, "name", type(function).__name__)
+            function = _ProfiledCallable(function, (f"<native {name}>", None), self.profiler)
+        return super()._call(expr, function)
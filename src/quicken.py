@@ -0,0 +1,118 @@
+from expr import Binary, Unary
+from tokentype import TokenType
+
+# The Interpreter rewrites Binary/Unary sites in place by swapping __class__
+# once it has seen their operand types. Each specialised node keeps the same
+# fields (no new slots) and dispatches to its own visit method, which guards on
+# the operand types and deoptimises the site to its Generic* class on a miss.
+# Specialised nodes only ever exist in trees the Interpreter has executed.
+
+
+class GenericBinary(Binary):
+    """A site that saw operands it can't specialise for, never quickened again"""
+    __slots__ = ()
+
+
+class GenericUnary(Unary):
+    __slots__ = ()
+
+
+class NumberAdd(Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_number_add_expr(self)
+
+
+class StringAdd(Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_string_add_expr(self)
+
+
+class NumberSubtract(Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_number_subtract_expr(self)
+
+
+class NumberMultiply(Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_number_multiply_expr(self)
+
+
+class NumberDivide(Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_number_divide_expr(self)
+
+
+class NumberLess(Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_number_less_expr(self)
+
+
+class NumberLessEqual(Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_number_less_equal_expr(self)
+
+
+class NumberGreater(Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_number_greater_expr(self)
+
+
+class NumberGreaterEqual(Binary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_number_greater_equal_expr(self)
+
+
+class NumberNegate(Unary):
+    __slots__ = ()
+
+    def accept(self, visitor):
+        return visitor.visit_number_negate_expr(self)
+
+
+NUMBER_BINARY = {
+    TokenType.PLUS: NumberAdd,
+    TokenType.MINUS: NumberSubtract,
+    TokenType.STAR: NumberMultiply,
+    TokenType.SLASH: NumberDivide,
+    TokenType.LESS: NumberLess,
+    TokenType.LESS_EQUAL: NumberLessEqual,
+    TokenType.GREATER: NumberGreater,
+    TokenType.GREATER_EQUAL: NumberGreaterEqual,
+}
+
+
+def quicken_binary(expr: Binary, left, right):
+    if type(left) is float and type(right) is float:
+        specialised = NUMBER_BINARY.get(expr.operator.token_type)
+        if specialised is not None:
+            expr.__class__ = specialised
+            return
+    elif type(left) is str and type(right) is str and expr.operator.token_type == TokenType.PLUS:
+        expr.__class__ = StringAdd
+        return
+    expr.__class__ = GenericBinary
+
+
+def quicken_unary(expr: Unary, right):
+    if type(right) is float and expr.operator.token_type == TokenType.MINUS:
+        expr.__class__ = NumberNegate
+    else:
+        expr.__class__ = GenericUnary
@@ -0,0 +1,199 @@
+import mmap
+import re
+import sys
+from typing import Iterable, Iterator, TextIO
+
+from error_handler import ErrorHandler
+from scanner import Scanner
+from token import Token
+from tokentype import TokenType
+
+# every match swallows the blanks in front of it, then one alternative per
+# kind of lexeme. The numbered groups tell scan_tokens which one matched,
+# comments have no group and are skipped
+_TOKEN_PATTERN = re.compile(r"""
+    [ \t\r]*
+    (?:
+        //[^\n]*
+      | (\n)
+      | ([0-9]+(?:\.[0-9]+)?)
+      | ([A-Za-z_][A-Za-z0-9_]*)
+      | ("[^"]*")
+      | (!=|==|<=|>=|[(){},.\-+;*/!=<>])
+      | ("[^"]*)
+      | (.)
+    )
+""", re.VERBOSE | re.DOTALL)
+
+# the same pattern over UTF-8 bytes, where an unexpected character may be a
+# multi-byte sequence that should only be reported once
+_BYTES_TOKEN_PATTERN = re.compile(
+    _TOKEN_PATTERN.pattern.replace("| (.)", r"| ([\xc0-\xff][\x80-\xbf]*|.)").encode("ascii"),
+    re.VERBOSE | re.DOTALL
+)
+
+_NEWLINE = 1
+_NUMBER = 2
+_IDENTIFIER = 3
+_STRING = 4
+_PUNCTUATION = 5
+_UNTERMINATED = 6
+_UNEXPECTED = 7
+
+_PUNCTUATION_TYPES = {
+    "(": TokenType.LEFT_PAREN,
+    ")": TokenType.RIGHT_PAREN,
+    "{": TokenType.LEFT_BRACE,
+    "}": TokenType.RIGHT_BRACE,
+    ",": TokenType.COMMA,
+    ".": TokenType.DOT,
+    "-": TokenType.MINUS,
+    "+": TokenType.PLUS,
+    ";": TokenType.SEMICOLON,
+    "*": TokenType.STAR,
+    "/": TokenType.SLASH,
+    "!": TokenType.BANG,
+    "!=": TokenType.BANG_EQUAL,
+    "=": TokenType.EQUAL,
+    "==": TokenType.EQUAL_EQUAL,
+    "<": TokenType.LESS,
+    "<=": TokenType.LESS_EQUAL,
+    ">": TokenType.GREATER,
+    ">=": TokenType.GREATER_EQUAL,
+}
+
+
+class RegexScanner:
+    """
+    Produces the same tokens and errors as Scanner, but matches a whole
+    lexeme per step with one compiled pattern instead of walking the source
+    a character at a time
+    """
+
+    def __init__(self, source: str | TextIO, error_handler: ErrorHandler):
+        # either the whole program or an open file, which is read a line at
+        # a time as tokens are pulled
+        self.source = source
+        self.error_handler = error_handler
+
+    def scan_tokens(self) -> list[Token]:
+        return list(self.tokens())
+
+    def _chunks(self) -> Iterable[str]:
+        if isinstance(self.source, str):
+            return (self.source,)
+        return self.source
+
+    def tokens(self) -> Iterator[Token]:
+        keywords = Scanner._KEYWORDS
+        punctuation = _PUNCTUATION_TYPES
+        identifier = TokenType.IDENTIFIER
+        number = TokenType.NUMBER
+        intern = sys.intern
+        line = 1
+        # offset of the current chunk in the whole source, for error columns
+        base = 0
+        pending = ""
+
+        for chunk in self._chunks():
+            if pending:
+                chunk = pending + chunk
+                pending = ""
+            for match in _TOKEN_PATTERN.finditer(chunk):
+                kind = match.lastindex
+                if kind is None:
+                    continue
+                if kind == _IDENTIFIER:
+                    text = intern(match.group(kind))
+                    yield Token(keywords.get(text, identifier), text, None, line)
+                elif kind == _PUNCTUATION:
+                    text = match.group(kind)
+                    yield Token(punctuation[text], text, None, line)
+                elif kind == _NEWLINE:
+                    line += 1
+                elif kind == _NUMBER:
+                    text = match.group(kind)
+                    yield Token(number, text, float(text), line)
+                elif kind == _STRING:
+                    text = match.group(kind)
+                    line += text.count("\n")
+                    yield Token(TokenType.STRING, text, text[1:-1], line)
+                elif kind == _UNTERMINATED:
+                    # runs to the end of the chunk, the next one may close it
+                    pending = match.group(kind)
+                else:
+                    self.error_handler.scanner_error(line, base + match.end(), "Unexpected character.")
+            base += len(chunk) - len(pending)
+
+        if pending:
+            line += pending.count("\n")
+            self.error_handler.scanner_error(line, base + len(pending), "Unterminated string.")
+        yield Token(TokenType.EOF, "", None, line)
+
+
+# operator bytes -> (token type, the one lexeme string every token shares)
+_PUNCTUATION_BYTES = {
+    text.encode("ascii"): (token_type, text)
+    for text, token_type in _PUNCTUATION_TYPES.items()
+}
+
+
+class MappedScanner:
+    """
+    RegexScanner over the UTF-8 bytes of a memory mapped file. Nothing is
+    copied out of the mapping unless a token needs its text: operators and
+    keywords share one lexeme string each, identifiers and number literals
+    are decoded once per distinct spelling, and only string literals are
+    decoded every time. Error columns are byte offsets
+    """
+
+    def __init__(self, source: bytes | mmap.mmap, error_handler: ErrorHandler):
+        self.source = source
+        self.error_handler = error_handler
+
+    def scan_tokens(self) -> list[Token]:
+        return list(self.tokens())
+
+    def tokens(self) -> Iterator[Token]:
+        keywords = Scanner._KEYWORDS
+        punctuation = _PUNCTUATION_BYTES
+        identifier = TokenType.IDENTIFIER
+        number = TokenType.NUMBER
+        # raw bytes -> (token type, lexeme) and raw bytes -> (lexeme, value)
+        names: dict[bytes, tuple[TokenType, str]] = {}
+        numbers: dict[bytes, tuple[str, float]] = {}
+        line = 1
+
+        for match in _BYTES_TOKEN_PATTERN.finditer(self.source):
+            kind = match.lastindex
+            if kind is None:
+                continue
+            if kind == _IDENTIFIER:
+                raw = match.group(kind)
+                name = names.get(raw)
+                if name is None:
+                    text = sys.intern(raw.decode("ascii"))
+                    name = names[raw] = (keywords.get(text, identifier), text)
+                yield Token(name[0], name[1], None, line)
+            elif kind == _PUNCTUATION:
+                token_type, text = punctuation[match.group(kind)]
+                yield Token(token_type, text, None, line)
+            elif kind == _NEWLINE:
+                line += 1
+            elif kind == _NUMBER:
+                raw = match.group(kind)
+                literal = numbers.get(raw)
+                if literal is None:
+                    literal = numbers[raw] = (raw.decode("ascii"), float(raw))
+                yield Token(number, literal[0], literal[1], line)
+            elif kind == _STRING:
+                text = match.group(kind).decode("utf-8")
+                line += text.count("\n")
+                yield Token(TokenType.STRING, text, text[1:-1], line)
+            elif kind == _UNTERMINATED:
+                line += match.group(kind).count(b"\n")
+                self.error_handler.scanner_error(line, match.end(), "Unterminated string.")
+            else:
+                self.error_handler.scanner_error(line, match.end(), "Unexpected character.")
+
+        yield Token(TokenType.EOF, "", None, line)
@@ -1,6 +1,6 @@
 from collections import deque
 from enum import Enum, auto
-from typing import Deque
+from typing import Deque, Optional
 from expr import (
     Assign, 
     Binary, 
@@ -18,6 +18,7 @@ from expr import (
 from stmt import (
     Block, 
     Expression, 
+    For,
     Function, 
     If, 
     Print, 
@@ -28,9 +29,10 @@ from stmt import (
     Class
 )
 
-from interpreter import Interpreter
+from environment import GlobalSlots
 from error_handler import ErrorHandler
 from token import Token 
+from tokentype import TokenType
 from visitor import Visitor
 
 class FunctionType(Enum):
@@ -44,17 +46,98 @@ class ClassType(Enum):
     CLASS = auto()
 
 
+def _assigns(node, name: str) -> bool:
+    """True if anything under node assigns to a variable called name"""
+    if isinstance(node, list):
+        return any(_assigns(child, name) for child in node)
+    if not isinstance(node, (Expr, Stmt)):
+        return False
+    if isinstance(node, Assign) and node.name.lexeme == name:
+        return True
+    return any(
+        _assigns(getattr(node, field, None), name)
+        for cls in type(node).__mro__
+        for field in getattr(cls, "__slots__", ())
+    )
+
+
+class _Local:
+    __slots__ = ("slot", "captured", "nodes")
+
+    def __init__(self, slot: int):
+        self.slot = slot
+        self.captured = False
+        # the declaration and the uses in its own function, marked captured
+        # too if a closure turns out to use the local later on
+        self.nodes: list = []
+
+    def use(self, node: Variable | Assign | This | Var | Function | Class):
+        node.slot = self.slot
+        node.captured = self.captured
+        self.nodes.append(node)
+
+    def capture(self):
+        if not self.captured:
+            self.captured = True
+            for node in self.nodes:
+                node.captured = True
+
+
+class _Frame:
+    """
+    The layout of one function's frame while its body is resolved, or of
+    the frame the script's top level blocks run in. Every local and every
+    captured variable of an enclosing function gets a slot of its own
+    """
+    __slots__ = ("enclosing", "depth", "slot_count", "upvalues")
+
+    def __init__(self, enclosing: Optional["_Frame"], depth: int):
+        self.enclosing = enclosing
+        # index in Resolver.scopes of the function's outermost scope
+        self.depth = depth
+        self.slot_count = 0
+        # enclosing function's local -> (slot of its Cell in the enclosing
+        # frame, slot the Cell is copied to in this one)
+        self.upvalues: dict[_Local, tuple[int, int]] = {}
+
+    def new_slot(self) -> int:
+        self.slot_count += 1
+        return self.slot_count - 1
+
+
 class Resolver(Visitor):
-    def __init__(self, interpreter: Interpreter, error_handler: ErrorHandler):
-        self.interpreter = interpreter
+    """
+    Works out where every variable lives. Globals get an index into
+    global_slots, the table of the environment the code will run in, locals a slot in the flat frame of the function they are
+    declared in. A local that a nested function uses is marked captured, so
+    the engines box it in a Cell, and each function lists the Cells it needs
+    from the frame it is created in as its upvalues. Nothing that isn't
+    captured outlives the call it belongs to
+    """
+
+    def __init__(self, error_handler: ErrorHandler, global_slots: GlobalSlots):
         self.scopes: Deque = deque()
+        # parallel to scopes, maps each local's name to its _Local
+        self.locals: Deque = deque()
+        # the script's own frame, only used by blocks and loops at top level
+        self.frame = _Frame(None, 0)
         self.error_handler = error_handler
+        self.global_slots = global_slots
         self.current_function = FunctionType.NONE
         self.current_class = ClassType.NONE
 
     def resolve(self, statements: list[Stmt]):
         self._resolve_statements(statements)
 
+    def resolve_body(self, function: Function, func_type: FunctionType):
+        """
+        Resolves the body of a top level function or method that was parsed
+        after the rest of the script, by a fresh Resolver
+        """
+        if func_type != FunctionType.FUNCTION:
+            self.current_class = ClassType.CLASS
+        self._resolve_function(function, func_type)
+
     def _resolve_statements(self, statements: list[Stmt]):
         for statement in statements:
             self._resolve_statement(statement)
@@ -65,29 +148,79 @@ class Resolver(Visitor):
     def _resolve_expression(self, expression: Expr):
         expression.accept(self)
 
-    def _resolve_local(self, expr: Expr, name: Token):
-        for i, scope in enumerate(list(reversed(self.scopes))):
-            if name.lexeme in scope:
-                self.interpreter.resolve(expr, i)
-                return
-        # if not found in any scopes, assume global and don't resolve
+    def _resolve_local(self, expr: Variable | Assign | This, name: Token):
+        for i in range(len(self.scopes) - 1, -1, -1):
+            local = self.locals[i].get(name.lexeme)
+            if local is None:
+                continue
+            if i >= self.frame.depth:
+                local.use(expr)
+            else:
+                expr.slot = self._capture(self.frame, local, i)
+                expr.captured = True
+            return
+        # if not found in any scopes, assume global and leave slot as None
+        if not isinstance(expr, This):
+            expr.global_slot = self.global_slots.index(name.lexeme)
+
+    def _capture(self, frame: _Frame, local: _Local, depth: int) -> int:
+        """
+        Slot of the Cell for local, declared in the scope at depth, in frame.
+        Every function between the two copies the Cell into its own frame
+        """
+        if depth >= frame.depth:
+            local.capture()
+            return local.slot
+        upvalue = frame.upvalues.get(local)
+        if upvalue is None:
+            upvalue = frame.upvalues[local] = (self._capture(frame.enclosing, local, depth), frame.new_slot())
+        return upvalue[1]
 
     def _resolve_function(self, function: Function, func_type: FunctionType):
         enclosing_function = self.current_function
         self.current_function = func_type
+        self.frame = _Frame(self.frame, len(self.scopes))
         self._begin_scope()
+        if func_type in (FunctionType.METHOD, FunctionType.INITIALIZER):
+            # methods receive this in slot 0 of their own frame
+            self.scopes[-1]["this"] = True
+            self.locals[-1]["this"] = _Local(self.frame.new_slot())
         for param in function.params:
             self._declare(param)
             self._define(param)
+        params = list(self.locals[-1].values())
         self.resolve(function.body)
         self._end_scope()
+        function.slot_count = self.frame.slot_count
+        # calls recycle their frames through here, see frame_pool.py
+        function.free_frames = []
+        function.blank_frame = (None,) * function.slot_count
+        function.upvalues = tuple(self.frame.upvalues.values())
+        # captured parameters are boxed as the call starts
+        function.cell_params = tuple(local.slot for local in params if local.captured)
+        if function.body_tokens is not None:
+            # with --lazy, resolved only for its errors, LoxFunction builds
+            # it again from the tokens on the first call
+            function.body = []
+        self.frame = self.frame.enclosing
         self.current_function = enclosing_function
 
     def _begin_scope(self):
         self.scopes.append({})
+        self.locals.append({})
 
     def _end_scope(self):
         self.scopes.pop()
+        self.locals.pop()
+
+    def _top_level_frame(self) -> int:
+        """
+        Size of the frame for a block or loop at top level that just ended.
+        Nothing at top level outlives it, so its slots are free again after
+        """
+        slot_count = self.frame.slot_count
+        self.frame.slot_count = 0
+        return slot_count
 
     def _declare(self, name: Token):
         if len(self.scopes) == 0:
@@ -96,6 +229,16 @@ class Resolver(Visitor):
         if name.lexeme in scope:
             self.error_handler.token_error(name, "Already a variable with this name in scope.")
         scope[name.lexeme] = False
+        local_slots = self.locals[-1]
+        if name.lexeme not in local_slots:
+            local_slots[name.lexeme] = _Local(self.frame.new_slot())
+
+    def _resolve_declaration(self, stmt: Var | Function | Class, name: Token):
+        # locals are defined straight into their slot, globals into theirs
+        if len(self.scopes) != 0:
+            self.locals[-1][name.lexeme].use(stmt)
+        else:
+            stmt.global_slot = self.global_slots.index(name.lexeme)
 
     def _define(self, name: Token):
         if len(self.scopes) == 0:
@@ -103,10 +246,64 @@ class Resolver(Visitor):
         scope = self.scopes[-1]
         scope[name.lexeme] = True
 
+    @staticmethod
+    def _declares_locals(statements: list[Stmt]) -> bool:
+        return any(isinstance(statement, (Var, Function, Class)) for statement in statements)
+
+    @staticmethod
+    def _is_counted_loop(stmt: For) -> bool:
+        """
+        Spots for (var i = a; i < b; i = i + step) where step is a positive
+        whole number literal, b is a number literal or another variable, and
+        nothing in the body assigns to i or captures it. The engines can then
+        drive i from a Python int instead of evaluating the condition and
+        increment
+        """
+        initializer = stmt.initializer
+        if not isinstance(initializer, Var) or initializer.initializer is None or initializer.captured:
+            return False
+        name = initializer.name.lexeme
+
+        condition = stmt.condition
+        if not isinstance(condition, Binary) or \
+                condition.operator.token_type not in (TokenType.LESS, TokenType.LESS_EQUAL):
+            return False
+        if not isinstance(condition.left, Variable) or condition.left.name.lexeme != name:
+            return False
+        bound = condition.right
+        if isinstance(bound, Literal):
+            if type(bound.value) is not float:
+                return False
+        elif not isinstance(bound, Variable) or bound.name.lexeme == name:
+            return False
+
+        increment = stmt.increment
+        if not isinstance(increment, Assign) or increment.name.lexeme != name:
+            return False
+        step = increment.value
+        if not isinstance(step, Binary) or step.operator.token_type != TokenType.PLUS:
+            return False
+        if not isinstance(step.left, Variable) or step.left.name.lexeme != name:
+            return False
+        if not isinstance(step.right, Literal) or type(step.right.value) is not float:
+            return False
+        if not step.right.value.is_integer() or step.right.value <= 0:
+            return False
+
+        return not _assigns(stmt.body, name)
+
     def visit_block_stmt(self, stmt: Block):
+        if not self._declares_locals(stmt.statements):
+            self.resolve(stmt.statements)
+            return None
+        # inside a function the locals take slots in the function's frame,
+        # only a block at top level needs a frame of its own
+        top_level = len(self.scopes) == 0
         self._begin_scope()
         self.resolve(stmt.statements)
         self._end_scope()
+        if top_level:
+            stmt.slot_count = self._top_level_frame()
         return None
 
     def visit_class_stmt(self, stmt: Class):
@@ -114,9 +311,7 @@ class Resolver(Visitor):
         self.current_class = ClassType.CLASS
         self._declare(stmt.name)
         self._define(stmt.name)
-
-        self._begin_scope()
-        self.scopes[-1]["this"] = True
+        self._resolve_declaration(stmt, stmt.name)
 
         for method in stmt.methods:
             declaration = FunctionType.METHOD 
@@ -124,7 +319,6 @@ class Resolver(Visitor):
                 declaration = FunctionType.INITIALIZER
             self._resolve_function(method, declaration)
 
-        self._end_scope()
         self.current_class = enclosing_class
         return None
 
@@ -132,9 +326,30 @@ class Resolver(Visitor):
         self._resolve_expression(stmt.expression)
         return None
 
+    def visit_for_stmt(self, stmt: For):
+        # only a var initializer needs the loop header to have its own scope
+        scoped = isinstance(stmt.initializer, Var)
+        top_level = len(self.scopes) == 0
+        if scoped:
+            self._begin_scope()
+        if stmt.initializer is not None:
+            self._resolve_statement(stmt.initializer)
+        if stmt.condition is not None:
+            self._resolve_expression(stmt.condition)
+        if stmt.increment is not None:
+            self._resolve_expression(stmt.increment)
+        self._resolve_statement(stmt.body)
+        if scoped:
+            self._end_scope()
+            if top_level:
+                stmt.slot_count = self._top_level_frame()
+        stmt.counted = self._is_counted_loop(stmt)
+        return None
+
     def visit_function_stmt(self, stmt: Function):
         self._declare(stmt.name)
         self._define(stmt.name)
+        self._resolve_declaration(stmt, stmt.name)
 
         self._resolve_function(stmt, FunctionType.FUNCTION)
         return None
@@ -164,6 +379,7 @@ class Resolver(Visitor):
         if stmt.initializer != None:
             self._resolve_expression(stmt.initializer)
         self._define(stmt.name)
+        self._resolve_declaration(stmt, stmt.name)
         return None
 
     def visit_while_stmt(self, stmt: While):
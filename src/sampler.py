@@ -0,0 +1,180 @@
+import sys
+import threading
+from typing import Optional
+
+from interpreter import Interpreter
+from lox_function import LoxFunction
+from vm import VM
+
+# node fields holding a token, the first one found gives a node's line
+_TOKEN_FIELDS = ("name", "operator", "paren", "keyword")
+# where to look for a line in nodes without a token, like Print or Grouping
+_CHILD_FIELDS = ("expression", "condition", "left", "callee", "obj")
+
+_FUNCTION_RUN_CODE = LoxFunction.run.__code__
+_RUN_CODE = VM._run.__code__
+
+
+def node_line(node) -> Optional[int]:
+    """Line of a node's own token, or of the first child that has one"""
+    for field in _TOKEN_FIELDS:
+        token = getattr(node, field, None)
+        if token is not None:
+            return token.line
+    for field in _CHILD_FIELDS:
+        child = getattr(node, field, None)
+        if child is not None:
+            return node_line(child)
+    return None
+
+
+def _chunk_line(function, ip: int) -> Optional[int]:
+    """Line of the last instruction before ip that has a token"""
+    tokens = function.chunk.tokens
+    for index in range(min(ip, len(tokens)) - 1, -1, -1):
+        if tokens[index] is not None:
+            return tokens[index].line
+    return None
+
+
+def _frame_label(name: str, line: Optional[int]) -> str:
+    return name if line is None else f"{name}:{line}"
+
+
+class SamplingProfiler:
+    """
+    Samples the Lox call stack of the thread running an Interpreter or VM
+    every interval seconds from a background thread, and counts how often
+    each stack was seen. Nothing is added to the engines themselves: the
+    tree walker's stack is read off the Python frames of LoxFunction.run,
+    the VM's off its frames list. Each Lox frame is labelled with the
+    function's name and the line it was executing.
+
+        sampler = SamplingProfiler(interpreter, interval=0.005)
+        with sampler:
+            interpreter.interpret(statements)
+        sampler.write_collapsed("out.folded")
+
+    The collapsed stacks can be fed to flamegraph.pl, speedscope or inferno.
+    """
+
+    def __init__(self, interpreter: Interpreter | VM, interval: float = 0.005):
+        if isinstance(interpreter, VM):
+            self._walk = self._vm_stack
+        elif isinstance(interpreter, Interpreter):
+            self._walk = self._tree_stack
+            # code object of each interpreter method -> its expr or stmt argument
+            self._node_codes = {}
+            for cls in type(interpreter).__mro__:
+                for attribute in vars(cls).values():
+                    code = getattr(attribute, "__code__", None)
+                    if code is None:
+                        continue
+                    for argument in code.co_varnames[:code.co_argcount]:
+                        if argument in ("expr", "stmt"):
+                            self._node_codes[code] = argument
+        else:
+            raise ValueError(f"can't sample a {type(interpreter).__name__}, only the tree walker and the vm")
+        self.interpreter = interpreter
+        self.interval = interval
+        # "outer;inner" -> number of samples
+        self.samples: dict[str, int] = {}
+        # samples taken while no Lox code was running, e.g. during parsing
+        self.idle = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._target = 0
+        self._switch_interval = 0.0
+
+    def start(self) -> None:
+        """Starts sampling the calling thread"""
+        if self._thread is not None:
+            raise RuntimeError("sampler already running")
+        self._target = threading.get_ident()
+        # a waiting thread only gets the GIL after the switch interval, so
+        # sampling faster than it needs a shorter one for the duration
+        self._switch_interval = sys.getswitchinterval()
+        if self.interval < self._switch_interval:
+            sys.setswitchinterval(self.interval)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name="lox-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        sys.setswitchinterval(self._switch_interval)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _sample_loop(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = self._walk(frame)
+            del frame
+            if not stack:
+                self.idle += 1
+                continue
+            key = ";".join(stack)
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+    def _tree_stack(self, frame) -> list[str]:
+        node_codes = self._node_codes
+        stack = []
+        line = None
+        in_lox = False
+        while frame is not None:
+            code = frame.f_code
+            if code is _FUNCTION_RUN_CODE:
+                f_locals = frame.f_locals
+                name = f_locals["self"].declaration.name.lexeme
+                this = f_locals["this"]
+                if this is not None:
+                    name = f"{this.klass.name}.{name}"
+                stack.append(_frame_label(name, line))
+                line = None
+            elif line is None and code in node_codes:
+                in_lox = True
+                line = node_line(frame.f_locals.get(node_codes[code]))
+            frame = frame.f_back
+        if not stack and not in_lox:
+            return []
+        stack.append(_frame_label("<script>", line))
+        stack.reverse()
+        return stack
+
+    def _vm_stack(self, frame) -> list[str]:
+        while frame is not None and frame.f_code is not _RUN_CODE:
+            frame = frame.f_back
+        if frame is None:
+            return []
+        f_locals = frame.f_locals
+        # the running function lives in _run's locals, its callers in frames
+        stack = []
+        for closure, ip, _ in list(self.interpreter.frames):
+            stack.append(_frame_label(closure.function.name or "<script>", _chunk_line(closure.function, ip)))
+        function = f_locals["closure"].function
+        stack.append(_frame_label(function.name or "<script>", _chunk_line(function, f_locals["ip"])))
+        return stack
+
+    def collapsed(self) -> list[str]:
+        """The samples as "frame;frame;frame count" lines, most frequent first"""
+        return [
+            f"{stack} {count}"
+            for stack, count in sorted(self.samples.items(), key=lambda item: item[1], reverse=True)
+        ]
+
+    def write_collapsed(self, path: str) -> None:
+        with open(path, "w") as f:
+            for line in self.collapsed():
+                f.write(line + "\n")
@@ -1,3 +1,5 @@
+import sys
+
 from error_handler import ErrorHandler
 from token import Token
 from tokentype import TokenType
@@ -133,12 +135,12 @@ class Scanner:
 
     def _string(self):
         while self._peek() != '"' and not self._is_at_end():
-            if self._peek() == '/n':
+            if self._peek() == '\n':
                 self._line += 1
             self._advance()
 
         if self._is_at_end():
-            self.error_handler.error(self._line, "Unterminated String.")
+            self.error_handler.scanner_error(self._line, self._current, "Unterminated string.")
             return 
         # consume closing "
         self._advance()
@@ -159,7 +161,7 @@ class Scanner:
     def _identifier(self):
         while self._is_alphanumeric(self._peek()):
             self._advance()
-        text = self.source[self._start:self._current]
+        text = sys.intern(self.source[self._start:self._current])
         token_type = Scanner._KEYWORDS.get(text, None)
         if token_type is None:
             token_type = TokenType.IDENTIFIER
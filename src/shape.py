@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+
+class Shape:
+    """
+    The layout shared by every instance of a class that had the same fields
+    assigned in the same order: field name -> index into LoxInstance.values.
+    Adding a field moves an instance along a cached transition to a new shape
+    """
+    __slots__ = ("fields", "transitions")
+
+    def __init__(self, fields: dict[str, int]):
+        self.fields = fields
+        self.transitions: dict[str, Shape] = dict()
+
+    def add(self, name: str) -> Shape:
+        shape = self.transitions.get(name)
+        if shape is None:
+            fields = dict(self.fields)
+            fields[name] = len(fields)
+            shape = Shape(fields)
+            self.transitions[name] = shape
+        return shape
@@ -1,51 +1,93 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, Optional
 from token import Token
 from visitor import Visitor
 from expr import Expr
 
 class Stmt(ABC):
+	__slots__ = ()
 
 	def __repr__(self):
-		return (type(self).__name__) + str(self.__dict__)
+		return (type(self).__name__) + str({name: getattr(self, name) for name in self.__slots__})
+
+	def __reduce__(self):
+		# pickled as the constructor call, every field is an __init__ argument
+		return (type(self), tuple(getattr(self, name) for name in self.__slots__))
 
 	@abstractmethod
 	def accept(self, visitor: Visitor):
 		pass
 
 class Block(Stmt):
-	def __init__(self, statements: list[Stmt]):
+	__slots__ = ('statements', 'slot_count')
+
+	def __init__(self, statements: list[Stmt], slot_count: int = 0):
 		self.statements = statements
+		self.slot_count = slot_count
 
 	def accept(self, visitor: Visitor):
 		return visitor.visit_block_stmt(self)
 
 class Class(Stmt):
-	def __init__(self, name: Token, methods: list[Function]):
+	__slots__ = ('name', 'methods', 'slot', 'global_slot', 'captured')
+
+	def __init__(self, name: Token, methods: list[Function], slot: Optional[int] = None, global_slot: Optional[int] = None, captured: bool = False):
 		self.name = name
 		self.methods = methods
+		self.slot = slot
+		self.global_slot = global_slot
+		self.captured = captured
 
 	def accept(self, visitor: Visitor):
 		return visitor.visit_class_stmt(self)
 
 class Expression(Stmt):
+	__slots__ = ('expression',)
+
 	def __init__(self, expression: Expr):
 		self.expression = expression
 
 	def accept(self, visitor: Visitor):
 		return visitor.visit_expression_stmt(self)
 
+class For(Stmt):
+	__slots__ = ('initializer', 'condition', 'increment', 'body', 'slot_count', 'counted')
+
+	def __init__(self, initializer: Stmt, condition: Expr, increment: Expr, body: Stmt, slot_count: int = 0, counted: bool = False):
+		self.initializer = initializer
+		self.condition = condition
+		self.increment = increment
+		self.body = body
+		self.slot_count = slot_count
+		self.counted = counted
+
+	def accept(self, visitor: Visitor):
+		return visitor.visit_for_stmt(self)
+
 class Function(Stmt):
-	def __init__(self, name: Token, params: list[Token], body: list[Stmt]):
+	__slots__ = ('name', 'params', 'body', 'slot', 'slot_count', 'body_tokens', 'global_slot', 'captured', 'upvalues', 'cell_params', 'free_frames', 'blank_frame')
+
+	def __init__(self, name: Token, params: list[Token], body: list[Stmt], slot: Optional[int] = None, slot_count: int = 0, body_tokens: Optional[list[Token]] = None, global_slot: Optional[int] = None, captured: bool = False, upvalues: tuple[tuple[int, int], ...] = (), cell_params: tuple[int, ...] = (), free_frames: Optional[list[list]] = None, blank_frame: tuple = ()):
 		self.name = name
 		self.params = params
 		self.body = body
+		self.slot = slot
+		self.slot_count = slot_count
+		self.body_tokens = body_tokens
+		self.global_slot = global_slot
+		self.captured = captured
+		self.upvalues = upvalues
+		self.cell_params = cell_params
+		self.free_frames = free_frames
+		self.blank_frame = blank_frame
 
 	def accept(self, visitor: Visitor):
 		return visitor.visit_function_stmt(self)
 
 class If(Stmt):
+	__slots__ = ('condition', 'then_branch', 'else_branch')
+
 	def __init__(self, condition: Expr, then_branch: Stmt, else_branch: Stmt):
 		self.condition = condition
 		self.then_branch = then_branch
@@ -55,6 +97,8 @@ class If(Stmt):
 		return visitor.visit_if_stmt(self)
 
 class Print(Stmt):
+	__slots__ = ('expression',)
+
 	def __init__(self, expression: Expr):
 		self.expression = expression
 
@@ -62,6 +106,8 @@ class Print(Stmt):
 		return visitor.visit_print_stmt(self)
 
 class Return(Stmt):
+	__slots__ = ('keyword', 'value')
+
 	def __init__(self, keyword: Token, value: Expr):
 		self.keyword = keyword
 		self.value = value
@@ -70,14 +116,21 @@ class Return(Stmt):
 		return visitor.visit_return_stmt(self)
 
 class Var(Stmt):
-	def __init__(self, name: Token, initializer: Expr):
+	__slots__ = ('name', 'initializer', 'slot', 'global_slot', 'captured')
+
+	def __init__(self, name: Token, initializer: Expr, slot: Optional[int] = None, global_slot: Optional[int] = None, captured: bool = False):
 		self.name = name
 		self.initializer = initializer
+		self.slot = slot
+		self.global_slot = global_slot
+		self.captured = captured
 
 	def accept(self, visitor: Visitor):
 		return visitor.visit_var_stmt(self)
 
 class While(Stmt):
+	__slots__ = ('condition', 'body')
+
 	def __init__(self, condition: Expr, body: Stmt):
 		self.condition = condition
 		self.body = body
@@ -2,12 +2,20 @@ from tokentype import TokenType
 
 
 class Token:
+    # millions of these get created for big scripts, so no per instance dict.
+    # The scanners intern identifier and keyword lexemes, and every token on
+    # a line shares the same line int
+    __slots__ = ("token_type", "lexeme", "literal", "line")
+
     def __init__(self, token_type: TokenType, lexeme: str, literal: object, line: int):
         self.token_type = token_type
         self.lexeme = lexeme
         self.literal = literal
         self.line = line
 
+    def __reduce__(self):
+        return (Token, (self.token_type, self.lexeme, self.literal, self.line))
+
     def __repr__(self):
         return f"Token(type: {self.token_type}, lexeme: {self.lexeme}, literal: {self.literal}, line: {self.line})"
 
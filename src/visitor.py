@@ -58,6 +58,10 @@ class Visitor(ABC):
 	def visit_expression_stmt(self, expr):
 		pass
 
+	@abstractmethod
+	def visit_for_stmt(self, expr):
+		pass
+
 	@abstractmethod
 	def visit_function_stmt(self, expr):
 		pass
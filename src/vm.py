@@ -0,0 +1,497 @@
+from typing import Any
+
+from chunk import (
+    FunctionProto,
+    OP_ADD,
+    OP_CALL,
+    OP_CLASS,
+    OP_CLOSE_UPVALUE,
+    OP_CLOSURE,
+    OP_CONSTANT,
+    OP_DEFINE_GLOBAL,
+    OP_DIVIDE,
+    OP_EQUAL,
+    OP_FALSE,
+    OP_GET_GLOBAL,
+    OP_GET_LOCAL,
+    OP_GET_PROPERTY,
+    OP_GET_UPVALUE,
+    OP_GREATER,
+    OP_GREATER_EQUAL,
+    OP_INVOKE,
+    OP_JUMP,
+    OP_JUMP_IF_FALSE_OR_POP,
+    OP_JUMP_IF_TRUE_OR_POP,
+    OP_LESS,
+    OP_LESS_EQUAL,
+    OP_METHOD,
+    OP_MULTIPLY,
+    OP_NEGATE,
+    OP_NIL,
+    OP_NOT,
+    OP_NOT_EQUAL,
+    OP_POP,
+    OP_POP_JUMP_IF_FALSE,
+    OP_PRINT,
+    OP_RETURN,
+    OP_SET_GLOBAL,
+    OP_SET_LOCAL,
+    OP_SET_PROPERTY,
+    OP_SET_UPVALUE,
+    OP_SUBTRACT,
+    OP_TAIL_CALL,
+    OP_TAIL_INVOKE,
+    OP_TRUE,
+)
+from compiler import Compiler
+from error_handler import ErrorHandler
+from interpreter import Interpreter
+from lox_callable import LoxCallable
+from lox_class import LoxClass
+from lox_instance import LoxInstance
+from native import Clock
+from runtime_error import LoxRuntimeError
+from stmt import Stmt
+from token import Token
+
+_stringify = Interpreter._stringify
+_is_equal = Interpreter._is_equal
+
+
+class Upvalue:
+    """
+    A captured variable. While open it points at a stack slot, once the slot
+    goes out of scope the value is copied in and index becomes -1
+    """
+    __slots__ = ("index", "value")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.value = None
+
+
+class Closure:
+    __slots__ = ("function", "upvalues")
+
+    def __init__(self, function: FunctionProto, upvalues: list[Upvalue]):
+        self.function = function
+        self.upvalues = upvalues
+
+    def arity(self) -> int:
+        return self.function.arity
+
+    def bind(self, instance):
+        return BoundMethod(instance, self)
+
+    def __str__(self):
+        return str(self.function)
+
+
+class BoundMethod:
+    __slots__ = ("receiver", "method")
+
+    def __init__(self, receiver, method: Closure):
+        self.receiver = receiver
+        self.method = method
+
+    def arity(self) -> int:
+        return self.method.arity()
+
+    def __str__(self):
+        return str(self.method)
+
+
+class VM:
+    """
+    Runs bytecode produced by Compiler on a value stack. Lox calls push a
+    frame onto self.frames instead of recursing in Python, so recursion depth
+    is bounded by max_frames rather than the Python recursion limit. Calls in
+    tail position reuse the caller's frame and don't count towards it
+    """
+
+    def __init__(self, max_frames: int = 500_000):
+        self.error_handler = ErrorHandler()
+        self.max_frames = max_frames
+        self.globals: dict[str, Any] = {"clock": Clock()}
+        self.stack: list[Any] = []
+        self.frames: list[tuple] = []
+        self.open_upvalues: list[Upvalue] = []
+
+    def interpret(self, statements: list[Stmt]):
+        function = Compiler().compile(statements)
+        self.stack.append(Closure(function, []))
+        try:
+            self._run()
+        except LoxRuntimeError as e:
+            self.error_handler.runtime_error(e)
+            self.stack.clear()
+            self.frames.clear()
+            self.open_upvalues.clear()
+
+    def _capture_upvalue(self, index: int) -> Upvalue:
+        open_upvalues = self.open_upvalues
+        i = len(open_upvalues)
+        while i > 0 and open_upvalues[i - 1].index > index:
+            i -= 1
+        if i > 0 and open_upvalues[i - 1].index == index:
+            return open_upvalues[i - 1]
+        upvalue = Upvalue(index)
+        open_upvalues.insert(i, upvalue)
+        return upvalue
+
+    def _close_upvalues(self, last: int):
+        stack = self.stack
+        open_upvalues = self.open_upvalues
+        while open_upvalues and open_upvalues[-1].index >= last:
+            upvalue = open_upvalues.pop()
+            upvalue.value = stack[upvalue.index]
+            upvalue.index = -1
+
+    def _check_arity(self, arity: int, argc: int, paren: Token):
+        if argc != arity:
+            raise LoxRuntimeError(paren, f"Expected {arity} arguments but got {argc}.")
+
+    def _call_value(self, callee, argc: int, paren: Token):
+        """
+        Handles every callable except the plain Closure fast path. Returns the
+        closure to push a frame for, or None when the call already finished
+        """
+        stack = self.stack
+        if type(callee) is Closure:
+            target = callee
+        elif type(callee) is BoundMethod:
+            stack[-1 - argc] = callee.receiver
+            target = callee.method
+        elif type(callee) is LoxClass:
+            stack[-1 - argc] = LoxInstance(callee)
+            target = callee.find_method("init")
+            if target is None:
+                self._check_arity(0, argc, paren)
+                del stack[len(stack) - argc:]
+                return None
+        elif isinstance(callee, LoxCallable):
+            self._check_arity(callee.arity(), argc, paren)
+            arguments = stack[len(stack) - argc:]
+            del stack[len(stack) - argc - 1:]
+            stack.append(callee.call(self, arguments))
+            return None
+        else:
+            raise LoxRuntimeError(paren, "Can only call functions and classes.")
+        self._check_arity(target.function.arity, argc, paren)
+        return target
+
+    def _invoke_target(self, receiver, name: str, name_token: Token, argc: int, paren: Token):
+        """
+        The method lookup OP_INVOKE does inline, for OP_TAIL_INVOKE. Returns
+        the closure to run, or None when the call already finished
+        """
+        if not isinstance(receiver, LoxInstance):
+            raise LoxRuntimeError(name_token, "Only instances have properties.")
+        index = receiver.shape.fields.get(name)
+        if index is not None:
+            callee = receiver.values[index]
+            self.stack[-1 - argc] = callee
+            return self._call_value(callee, argc, paren)
+        target = receiver.klass.find_method(name)
+        if target is None:
+            raise LoxRuntimeError(name_token, f"Undefined property {name}.")
+        self._check_arity(target.function.arity, argc, paren)
+        return target
+
+    def _binary_slow(self, op: int, left, right, operator: Token):
+        # the generic path, mirroring Interpreter.visit_binary_expr
+        if op == OP_ADD:
+            if isinstance(left, float) and isinstance(right, float):
+                return left + right
+            if isinstance(left, str) and isinstance(right, str):
+                return left + right
+            raise LoxRuntimeError(operator, "Operands must be two numbers or two strings.")
+        if not (isinstance(left, (float, int)) and isinstance(right, (float, int))):
+            raise LoxRuntimeError(operator, "Operands must be a number.")
+        left = float(left)
+        right = float(right)
+        if op == OP_SUBTRACT:
+            return left - right
+        if op == OP_MULTIPLY:
+            return left * right
+        if op == OP_DIVIDE:
+            return left / right
+        if op == OP_GREATER:
+            return left > right
+        if op == OP_GREATER_EQUAL:
+            return left >= right
+        if op == OP_LESS:
+            return left < right
+        return left <= right
+
+    def _run(self):
+        stack = self.stack
+        push = stack.append
+        pop = stack.pop
+        frames = self.frames
+        max_frames = self.max_frames
+        globals_ = self.globals
+        binary_slow = self._binary_slow
+
+        closure = stack[-1]
+        function = closure.function
+        code = function.chunk.code
+        constants = function.chunk.constants
+        tokens = function.chunk.tokens
+        upvalues = closure.upvalues
+        base = len(stack) - 1
+        ip = 0
+
+        while True:
+            op = code[ip]
+            ip += 1
+
+            if op == OP_GET_LOCAL:
+                push(stack[base + code[ip]])
+                ip += 1
+            elif op == OP_CONSTANT:
+                push(constants[code[ip]])
+                ip += 1
+            elif op == OP_GET_GLOBAL:
+                name = constants[code[ip]]
+                ip += 1
+                try:
+                    push(globals_[name])
+                except KeyError:
+                    raise LoxRuntimeError(tokens[ip - 1], f"Undefined variable '{name}'.") from None
+            elif op == OP_LESS:
+                right = pop()
+                left = stack[-1]
+                if type(left) is float and type(right) is float:
+                    stack[-1] = left < right
+                else:
+                    stack[-1] = binary_slow(op, left, right, tokens[ip - 1])
+            elif op == OP_ADD:
+                right = pop()
+                left = stack[-1]
+                if type(left) is float and type(right) is float:
+                    stack[-1] = left + right
+                else:
+                    stack[-1] = binary_slow(op, left, right, tokens[ip - 1])
+            elif op == OP_SUBTRACT:
+                right = pop()
+                left = stack[-1]
+                if type(left) is float and type(right) is float:
+                    stack[-1] = left - right
+                else:
+                    stack[-1] = binary_slow(op, left, right, tokens[ip - 1])
+            elif op == OP_POP_JUMP_IF_FALSE:
+                value = pop()
+                if value is None or value is False:
+                    ip = code[ip]
+                else:
+                    ip += 1
+            elif op == OP_CALL:
+                argc = code[ip]
+                ip += 1
+                callee = stack[-1 - argc]
+                if type(callee) is Closure:
+                    target = callee
+                    if target.function.arity != argc:
+                        self._check_arity(target.function.arity, argc, tokens[ip - 1])
+                else:
+                    target = self._call_value(callee, argc, tokens[ip - 1])
+                    if target is None:
+                        continue
+                if len(frames) == max_frames:
+                    raise LoxRuntimeError(tokens[ip - 1], "Stack overflow.")
+                frames.append((closure, ip, base))
+                closure = target
+                function = target.function
+                code = function.chunk.code
+                constants = function.chunk.constants
+                tokens = function.chunk.tokens
+                upvalues = target.upvalues
+                base = len(stack) - argc - 1
+                ip = 0
+            elif op == OP_RETURN:
+                result = pop()
+                if self.open_upvalues:
+                    self._close_upvalues(base)
+                del stack[base:]
+                if not frames:
+                    return
+                push(result)
+                closure, ip, base = frames.pop()
+                function = closure.function
+                code = function.chunk.code
+                constants = function.chunk.constants
+                tokens = function.chunk.tokens
+                upvalues = closure.upvalues
+            elif op == OP_POP:
+                pop()
+            elif op == OP_GET_PROPERTY:
+                obj = stack[-1]
+                name = constants[code[ip]]
+                ip += 1
+                if not isinstance(obj, LoxInstance):
+                    raise LoxRuntimeError(tokens[ip - 1], "Only instances have properties.")
+                index = obj.shape.fields.get(name)
+                if index is not None:
+                    stack[-1] = obj.values[index]
+                else:
+                    stack[-1] = obj.get(tokens[ip - 1])
+            elif op == OP_SET_PROPERTY:
+                name = constants[code[ip]]
+                ip += 1
+                value = pop()
+                obj = stack[-1]
+                if not isinstance(obj, LoxInstance):
+                    raise LoxRuntimeError(tokens[ip - 1], "Only instances have fields.")
+                obj.set(tokens[ip - 1], value)
+                stack[-1] = value
+            elif op == OP_SET_LOCAL:
+                stack[base + code[ip]] = stack[-1]
+                ip += 1
+            elif op == OP_GET_UPVALUE:
+                upvalue = upvalues[code[ip]]
+                ip += 1
+                if upvalue.index < 0:
+                    push(upvalue.value)
+                else:
+                    push(stack[upvalue.index])
+            elif op == OP_SET_UPVALUE:
+                upvalue = upvalues[code[ip]]
+                ip += 1
+                if upvalue.index < 0:
+                    upvalue.value = stack[-1]
+                else:
+                    stack[upvalue.index] = stack[-1]
+            elif op == OP_JUMP:
+                ip = code[ip]
+            elif op == OP_INVOKE:
+                name = constants[code[ip]]
+                name_token = tokens[ip]
+                argc = code[ip + 1]
+                ip += 2
+                receiver = stack[-1 - argc]
+                if not isinstance(receiver, LoxInstance):
+                    raise LoxRuntimeError(name_token, "Only instances have properties.")
+                index = receiver.shape.fields.get(name)
+                if index is not None:
+                    # a field holding a callable, call it like any other value
+                    callee = receiver.values[index]
+                    stack[-1 - argc] = callee
+                    target = self._call_value(callee, argc, tokens[ip - 1])
+                    if target is None:
+                        continue
+                else:
+                    target = receiver.klass.find_method(name)
+                    if target is None:
+                        raise LoxRuntimeError(name_token, f"Undefined property {name}.")
+                    if target.function.arity != argc:
+                        self._check_arity(target.function.arity, argc, tokens[ip - 1])
+                if len(frames) == max_frames:
+                    raise LoxRuntimeError(tokens[ip - 1], "Stack overflow.")
+                frames.append((closure, ip, base))
+                closure = target
+                function = target.function
+                code = function.chunk.code
+                constants = function.chunk.constants
+                tokens = function.chunk.tokens
+                upvalues = target.upvalues
+                base = len(stack) - argc - 1
+                ip = 0
+            elif op == OP_TAIL_CALL or op == OP_TAIL_INVOKE:
+                if op == OP_TAIL_CALL:
+                    argc = code[ip]
+                    ip += 1
+                    target = self._call_value(stack[-1 - argc], argc, tokens[ip - 1])
+                else:
+                    argc = code[ip + 1]
+                    ip += 2
+                    target = self._invoke_target(stack[-1 - argc], constants[code[ip - 2]],
+                                                 tokens[ip - 2], argc, tokens[ip - 1])
+                if target is None:
+                    # native or class call, its result is on the stack for
+                    # the OP_RETURN that follows
+                    continue
+                if self.open_upvalues:
+                    self._close_upvalues(base)
+                # slide callee and arguments down over the finished frame
+                stack[base:] = stack[len(stack) - argc - 1:]
+                closure = target
+                function = target.function
+                code = function.chunk.code
+                constants = function.chunk.constants
+                tokens = function.chunk.tokens
+                upvalues = target.upvalues
+                ip = 0
+            elif op == OP_NIL:
+                push(None)
+            elif op == OP_TRUE:
+                push(True)
+            elif op == OP_FALSE:
+                push(False)
+            elif op == OP_SET_GLOBAL:
+                name = constants[code[ip]]
+                ip += 1
+                if name not in globals_:
+                    raise LoxRuntimeError(tokens[ip - 1], f"Undefined variable '{name}'.")
+                globals_[name] = stack[-1]
+            elif op == OP_DEFINE_GLOBAL:
+                globals_[constants[code[ip]]] = pop()
+                ip += 1
+            elif op == OP_EQUAL:
+                right = pop()
+                stack[-1] = _is_equal(stack[-1], right)
+            elif op == OP_NOT_EQUAL:
+                right = pop()
+                stack[-1] = not _is_equal(stack[-1], right)
+            elif op == OP_JUMP_IF_FALSE_OR_POP:
+                value = stack[-1]
+                if value is None or value is False:
+                    ip = code[ip]
+                else:
+                    pop()
+                    ip += 1
+            elif op == OP_JUMP_IF_TRUE_OR_POP:
+                value = stack[-1]
+                if value is None or value is False:
+                    pop()
+                    ip += 1
+                else:
+                    ip = code[ip]
+            elif op in (OP_MULTIPLY, OP_DIVIDE, OP_GREATER, OP_GREATER_EQUAL, OP_LESS_EQUAL):
+                right = pop()
+                stack[-1] = binary_slow(op, stack[-1], right, tokens[ip - 1])
+            elif op == OP_NOT:
+                value = stack[-1]
+                stack[-1] = value is None or value is False
+            elif op == OP_NEGATE:
+                value = stack[-1]
+                if not isinstance(value, (float, int)):
+                    raise LoxRuntimeError(tokens[ip - 1], "Operand must be a number.")
+                stack[-1] = -float(value)
+            elif op == OP_PRINT:
+                print(_stringify(pop()))
+            elif op == OP_CLOSURE:
+                proto = constants[code[ip]]
+                ip += 1
+                captured = []
+                for _ in range(proto.upvalue_count):
+                    is_local = code[ip]
+                    index = code[ip + 1]
+                    ip += 2
+                    if is_local:
+                        captured.append(self._capture_upvalue(base + index))
+                    else:
+                        captured.append(upvalues[index])
+                push(Closure(proto, captured))
+            elif op == OP_CLOSE_UPVALUE:
+                self._close_upvalues(len(stack) - 1)
+                pop()
+            elif op == OP_CLASS:
+                push(LoxClass(constants[code[ip]], dict()))
+                ip += 1
+            elif op == OP_METHOD:
+                method = pop()
+                stack[-1].methods[constants[code[ip]]] = method
+                ip += 1
+            else:
+                raise RuntimeError(f"Unknown opcode {op}.")
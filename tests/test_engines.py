@@ -0,0 +1,490 @@
+import json
+import pathlib
+import pickle
+import subprocess
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).parent.parent
+LOX = ROOT / "src" / "lox.py"
+
+# scripts whose output depends on clock() are left out
+SCRIPTS = sorted(
+    path for path in (ROOT / "tests").glob("*.lox")
+    if "clock()" not in path.read_text()
+)
+
+
+def run_lox(script: pathlib.Path, *flags: str) -> str:
+    # never the tree cache, unless a test asks for it with --cache
+    result = subprocess.run(
+        [sys.executable, str(LOX), "--no-cache", *flags, str(script)],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    return result.stdout
+
+
+@pytest.mark.parametrize("engine", ["closure", "vm"])
+@pytest.mark.parametrize("script", SCRIPTS, ids=lambda path: path.name)
+def test_engine_matches_tree_walker(script, engine):
+    assert run_lox(script, f"--engine={engine}") == run_lox(script, "--engine=tree")
+
+
+
+DEEP_RECURSION = """
+fun count(n) {
+  if (n == 0) return 0;
+  return 1 + count(n - 1);
+}
+print count(100000);
+"""
+
+TAIL_RECURSION = """
+fun loop(n, acc) {
+  if (n == 0) return acc;
+  return loop(n - 1, acc + 1);
+}
+print loop(200000, 0);
+"""
+
+
+def test_vm_recursion_is_not_bounded_by_python(tmp_path):
+    script = tmp_path / "deep.lox"
+    script.write_text(DEEP_RECURSION)
+    assert run_lox(script, "--engine=vm") == "100000\n"
+
+
+def test_vm_stack_overflow_is_a_runtime_error(tmp_path):
+    script = tmp_path / "deep.lox"
+    script.write_text(DEEP_RECURSION)
+    assert run_lox(script, "--engine=vm", "--max-depth=1000") == "[Line 4] --> Stack overflow.\n"
+
+
+def test_vm_tail_calls_reuse_the_frame(tmp_path):
+    script = tmp_path / "tail.lox"
+    script.write_text(TAIL_RECURSION)
+    assert run_lox(script, "--engine=vm", "--max-depth=10") == "200000\n"
+
+
+@pytest.mark.parametrize("engine", ["tree", "closure", "vm"])
+@pytest.mark.parametrize("script", SCRIPTS, ids=lambda path: path.name)
+def test_optimizer_preserves_output(script, engine):
+    assert run_lox(script, "-O", f"--engine={engine}") == run_lox(script, "--engine=tree")
+
+
+@pytest.mark.parametrize("engine", ["tree", "closure", "vm"])
+@pytest.mark.parametrize("script", SCRIPTS, ids=lambda path: path.name)
+def test_streaming_preserves_output(script, engine):
+    assert run_lox(script, "--stream", f"--engine={engine}") == run_lox(script, "--engine=tree")
+
+
+@pytest.mark.parametrize("flags", [["--mmap"], ["--mmap", "--stream"]], ids=" ".join)
+@pytest.mark.parametrize("script", SCRIPTS, ids=lambda path: path.name)
+def test_mapped_source_preserves_output(script, flags):
+    assert run_lox(script, *flags) == run_lox(script)
+
+
+COUNT_MAPS = """
+import mmap, runpy, sys
+maps = []
+class CountingMap(mmap.mmap):
+    def __new__(cls, *args, **kwargs):
+        maps.append(args)
+        return super().__new__(cls, *args, **kwargs)
+mmap.mmap = CountingMap
+sys.argv = sys.argv[1:]
+sys.path.insert(0, sys.argv[0].rpartition("/")[0])
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+finally:
+    print(len(maps), file=sys.stderr)
+"""
+
+
+def test_mapped_source_is_scanned_and_hashed_in_place(tmp_path):
+    script = tmp_path / "mapped.lox"
+    script.write_text('print "mapped";\n')
+
+    def run(*flags):
+        result = subprocess.run(
+            [sys.executable, "-c", COUNT_MAPS, str(LOX), "--mmap", *flags, str(script)],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+        assert result.stdout == "mapped\n"
+        return result.stderr.splitlines()
+
+    # once on a miss, again to hash the source on a hit
+    stats, maps = run("--cache", "--cache-stats")
+    assert stats.startswith("cache miss") and maps == "1"
+    stats, maps = run("--cache", "--cache-stats")
+    assert stats.startswith("cache hit") and maps == "1"
+    assert run() == ["1"]
+
+
+@pytest.mark.parametrize("flags", [["--lazy"], ["--lazy", "--stream"]], ids=" ".join)
+@pytest.mark.parametrize("script", SCRIPTS, ids=lambda path: path.name)
+def test_lazy_parsing_preserves_output(script, flags):
+    assert run_lox(script, *flags) == run_lox(script, "--engine=tree")
+
+
+LAZY_SYNTAX_ERRORS = """
+fun unused() {
+  print "never" +;
+}
+class Broken {
+  method() { var a = ; }
+}
+print "before";
+"""
+
+LAZY_RESOLUTION_ERRORS = """
+class Broken {
+  init() { return 1; }
+}
+fun duplicate() {
+  var a = 1;
+  var a = 2;
+}
+fun ownInitializer() {
+  var a = 1;
+  { var a = a; }
+}
+print "before";
+"""
+
+
+@pytest.mark.parametrize("flags", [[], ["--stream"]], ids=" ".join)
+@pytest.mark.parametrize("source, errors", [
+    (LAZY_SYNTAX_ERRORS, [
+        "[line 3] Error  at ';': Expect Expression",
+        "[line 6] Error  at ';': Expect Expression",
+    ]),
+    (LAZY_RESOLUTION_ERRORS, [
+        "[line 3] Error  at 'return': Can't return a value from an initializer.",
+        "[line 7] Error  at 'a': Already a variable with this name in scope.",
+        "[line 11] Error  at 'a': Can't read local variable in its own initializer.",
+    ]),
+], ids=["syntax", "resolution"])
+def test_lazy_body_errors_are_reported_before_running(tmp_path, source, errors, flags):
+    script = tmp_path / "lazy.lox"
+    script.write_text(source)
+    result = subprocess.run(
+        [sys.executable, str(LOX), "--lazy", *flags, str(script)],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.returncode == 65
+    if not flags:
+        # streaming stops resolving after the first declaration with an error
+        assert result.stdout.splitlines() == errors
+    assert result.stdout == run_lox(script, *flags)
+
+
+PROFILED = """
+fun fib(n) {
+  if (n < 2) return n;
+  return fib(n - 2) + fib(n - 1);
+}
+class Point {
+  init(x) { this.x = x; }
+  get() { return this.x; }
+}
+print fib(10);
+print Point(fib(3)).get();
+{
+  class Point {}
+  Point();
+  Point();
+}
+clock();
+"""
+
+
+def test_profile_counts_calls_per_function(tmp_path):
+    script = tmp_path / "profiled.lox"
+    script.write_text(PROFILED)
+    profile = tmp_path / "profile.json"
+    assert run_lox(script, "--profile", f"--profile-json={profile}") == "55\n2\n"
+
+    functions = {
+        (function["name"], function["line"]): function
+        for function in json.loads(profile.read_text())["functions"]
+    }
+    fib = functions[("fib", 2)]
+    assert fib["calls"] == 177 + 5
+    assert {(caller["name"], caller["calls"]) for caller in fib["callers"]} == {("fib", 180), ("<script>", 2)}
+    assert fib["inclusive_seconds"] >= fib["exclusive_seconds"]
+    assert functions[("Point", 6)]["calls"] == 1
+    assert functions[("Point.init", 7)]["callers"] == [{"name": "Point", "line": 6, "calls": 1}]
+    assert functions[("Point.get", 8)]["calls"] == 1
+    # the class in the block is a different Point
+    assert functions[("Point", 13)]["calls"] == 2
+    assert functions[("<native clock>", None)]["callers"] == [{"name": "<script>", "line": None, "calls": 1}]
+
+
+SAMPLED = """
+fun fib(n) {
+  if (n < 2) return n;
+  return fib(n - 2) + fib(n - 1);
+}
+print fib(20);
+"""
+
+
+@pytest.mark.parametrize("engine", ["tree", "vm"])
+def test_sampler_writes_collapsed_lox_stacks(tmp_path, engine):
+    script = tmp_path / "sampled.lox"
+    script.write_text(SAMPLED)
+    folded = tmp_path / "out.folded"
+    assert run_lox(script, f"--engine={engine}", f"--sample={folded}", "--sample-interval=1") == "6765\n"
+
+    lines = folded.read_text().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        frames = stack.split(";")
+        assert frames[0] == "<script>:6"
+        assert all(frame.split(":")[0] == "fib" for frame in frames[1:])
+    assert any(";fib:" in line for line in lines)
+
+
+HEATMAP = """var total = 0;
+for (var i = 0; i < 25; i = i + 1) {
+  if (i < 5) {
+    total = total + i;
+  }
+}
+print total;
+"""
+
+
+@pytest.mark.parametrize("timed", [False, True])
+def test_heatmap_annotates_lines_with_hit_counts(tmp_path, timed):
+    script = tmp_path / "hot.lox"
+    script.write_text(HEATMAP)
+    heatmap = tmp_path / "hot.txt"
+    flags = ["--heatmap-time"] if timed else []
+    assert run_lox(script, f"--heatmap={heatmap}", *flags) == "10\n"
+
+    lines = heatmap.read_text().splitlines()
+    assert [line.split("| ", 1)[1] for line in lines] == HEATMAP.splitlines()
+    hits = [line.split()[0] if not line.startswith(" " * 9) else "" for line in lines]
+    assert hits == ["1", "26", "25", "5", "", "", "1"]
+    if timed:
+        shares = [float(line.split()[1].rstrip("%")) for line in lines if not line.startswith(" " * 9)]
+        assert 99 <= sum(shares) <= 101
+
+
+COUNTED_HEADER = """var total = 0;
+for (var i = 0; i < 10; i = i + 1) total = total + i;
+for (var j = 0;
+     j < 10;
+     j = j + 1) total = total + j;
+print total;
+"""
+
+
+def test_heatmap_counts_the_header_of_a_counted_loop(tmp_path):
+    script = tmp_path / "counted.lox"
+    script.write_text(COUNTED_HEADER)
+    heatmap = tmp_path / "counted.txt"
+    assert run_lox(script, f"--heatmap={heatmap}") == "90\n"
+
+    hits = [int(line.split()[0]) for line in heatmap.read_text().splitlines()]
+    # the condition runs once more than the body, the increment once per pass
+    assert hits == [1, 11, 1, 11, 10, 1]
+
+
+ALLOCATING = """
+class Point {
+  init(x) { this.x = x; }
+  get() { return this.x; }
+}
+var keep = Point(1);
+for (var i = 0; i < 10; i = i + 1) {
+  Point(i).get();
+}
+var m = keep.get;
+print m();
+fun counter() { var n = 0; fun inc() { n = n + 1; return n; } return inc; }
+var tick = counter();
+tick();
+"""
+
+
+def test_mem_stats_counts_allocated_and_live_objects(tmp_path):
+    script = tmp_path / "allocating.lox"
+    script.write_text(ALLOCATING)
+    snapshots = tmp_path / "memory.csv"
+    result = subprocess.run(
+        [sys.executable, str(LOX), "--mem-stats", f"--mem-snapshots={snapshots}", str(script)],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.stdout == "1\n"
+
+    rows = {}
+    for line in result.stderr.splitlines()[1:-1]:
+        kind, allocated, live = line.rsplit(maxsplit=4)[:3]
+        rows[kind] = (int(allocated), int(live))
+    assert rows == {
+        # the loop's frame, then one for each function the frame pool had
+        # to allocate for, kept there for the next call. Only n is boxed
+        # and it stays live in tick's closure
+        "frame": (5, 4),
+        "Cell": (1, 1),
+        "LoxFunction": (4, 4),
+        "bound method": (1, 1),
+        "LoxInstance": (11, 1),
+        "return value": (13, 0),
+    }
+    # the loop and one per call
+    assert result.stderr.splitlines()[-1] == "frames entered: 25, peak frame depth: 2"
+
+    header, *samples = snapshots.read_text().splitlines()
+    assert header.split(",")[:3] == ["elapsed_seconds", "frame live", "frame live bytes"]
+    assert samples and samples[-1].split(",")[1] == "4"
+    assert samples[-1].split(",")[-2:] == ["25", "2"]
+
+
+INTERRUPTED_MEM_STATS = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from interpreter import Interpreter
+from memstats import MemoryStats
+interpreter = Interpreter()
+try:
+    with MemoryStats(interpreter):
+        raise KeyboardInterrupt
+except KeyboardInterrupt:
+    pass
+shadowed = [name for name in vars(interpreter) if name.startswith(("_execute", "visit_"))]
+print(interpreter.memory_stats, interpreter.frame_pool.memory_stats, shadowed)
+"""
+
+
+def test_mem_stats_are_switched_off_when_the_run_fails():
+    result = subprocess.run(
+        [sys.executable, "-c", INTERRUPTED_MEM_STATS, str(ROOT / "src")],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.stdout == "None None []\n"
+
+
+RECURSING = """
+fun count(n) {
+  if (n == 0) return 0;
+  return 1 + count(n - 1);
+}
+print count(40);
+print count(40);
+"""
+
+
+@pytest.mark.parametrize("engine", ["tree", "closure"])
+def test_pool_stats_count_reused_frames(tmp_path, engine):
+    script = tmp_path / "recursing.lox"
+    script.write_text(RECURSING)
+    result = subprocess.run(
+        [sys.executable, str(LOX), f"--engine={engine}", "--pool-stats", str(script)],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.stdout == "40\n40\n"
+    # 41 frames deep each time, only 32 are kept once they are released
+    assert result.stderr.splitlines()[-1] == (
+        "frame pool: 82 frames acquired, 32 hits (39.0%), 50 misses, 18 discarded, 32 pooled"
+    )
+
+
+def test_cached_tree_is_reused_until_the_source_changes(tmp_path):
+    script = tmp_path / "cached.lox"
+    script.write_text('var greeting = "hello";\nprint greeting;\n')
+
+    def run():
+        result = subprocess.run(
+            [sys.executable, str(LOX), "--cache", "--cache-stats", str(script)],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+        return result.stdout, result.stderr
+
+    stdout, stderr = run()
+    assert stdout == "hello\n"
+    assert stderr.startswith("cache miss (no cache file)")
+
+    stdout, stderr = run()
+    assert stdout == "hello\n"
+    assert stderr.startswith("cache hit")
+
+    script.write_text('var greeting = "bye";\nprint greeting;\n')
+    stdout, stderr = run()
+    assert stdout == "bye\n"
+    assert stderr.startswith("cache miss (source or interpreter changed)")
+
+
+RUN_SCRIPTS = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from lox import Lox
+lox = Lox(cache=True, cache_stats=True)
+for path in sys.argv[2:]:
+    lox.run_file(path)
+"""
+
+
+def test_cached_tree_is_rebound_to_the_globals_it_runs_with(tmp_path):
+    first = tmp_path / "first.lox"
+    first.write_text("var x = 1;\nvar y = 2;\nprint x + y;\n")
+    second = tmp_path / "second.lox"
+    second.write_text("var p = 10;\nfun q() { return p; }\nprint q();\n")
+    # cached on its own, where p and q came right after clock
+    assert run_lox(second, "--cache") == "10\n"
+
+    result = subprocess.run(
+        [sys.executable, "-c", RUN_SCRIPTS, str(ROOT / "src"), str(first), str(second), str(second)],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.stdout == "3\n10\n10\n"
+    stats = [line.split(" ", 2)[1] for line in result.stderr.splitlines()]
+    assert stats == ["miss", "hit", "hit"]
+
+
+def test_cache_file_can_only_name_tree_classes(tmp_path):
+    script = tmp_path / "cached.lox"
+    script.write_text('print "safe";\n')
+    subprocess.run([sys.executable, str(LOX), "--cache", str(script)], capture_output=True, timeout=60)
+    cache_file = tmp_path / "__loxcache__" / "cached.lox.loxc"
+    marker = tmp_path / "pwned"
+
+    class Payload:
+        def __reduce__(self):
+            return (open, (str(marker), "w"))
+
+    data = cache_file.read_bytes()
+    header = data[:4 + 2 + 2 + 32]
+    cache_file.write_bytes(header + pickle.dumps(Payload()))
+
+    result = subprocess.run(
+        [sys.executable, str(LOX), "--cache", "--cache-stats", str(script)],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert result.stdout == "safe\n"
+    assert result.stderr.startswith("cache miss (unreadable cache file)")
+    assert not marker.exists()
@@ -0,0 +1,54 @@
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).parent.parent
+
+# run inside src/ where the interpreter's token module shadows the stdlib one
+COMPARE = """
+import io
+import sys
+from error_handler import ErrorHandler
+from regex_scanner import MappedScanner, RegexScanner
+from scanner import Scanner
+
+source = sys.stdin.read()
+for scanner in (Scanner, RegexScanner):
+    for token in scanner(source, ErrorHandler()).scan_tokens():
+        print(token.token_type, repr(token.lexeme), token.literal, token.line)
+    print("--")
+# pulled from a file object a line at a time, errors get reported as the
+# tokens are pulled so collect them all before printing
+for token in list(RegexScanner(io.StringIO(source), ErrorHandler()).tokens()):
+    print(token.token_type, repr(token.lexeme), token.literal, token.line)
+print("--")
+# over the raw bytes, as a memory mapped file would be
+for token in MappedScanner(source.encode(), ErrorHandler()).scan_tokens():
+    print(token.token_type, repr(token.lexeme), token.literal, token.line)
+print("--")
+"""
+
+SOURCES = [path.read_text() for path in sorted((ROOT / "tests").glob("*.lox"))] + [
+    'print "two\nlines" + "";\n// comment\nvar x_1 = 12. != 1.5;',
+    "a @ b\n\t# c",
+    'var s = "never closed\n\n',
+]
+
+
+@pytest.mark.parametrize("source", SOURCES)
+def test_regex_scanner_matches_scanner(source):
+    result = subprocess.run(
+        [sys.executable, "-c", COMPARE],
+        input=source,
+        capture_output=True,
+        text=True,
+        cwd=ROOT / "src",
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    char_scan, regex_scan, streamed_scan, mapped_scan, _ = result.stdout.split("--\n")
+    assert regex_scan == char_scan
+    assert streamed_scan == char_scan
+    assert mapped_scan == char_scan
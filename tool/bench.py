@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOX = os.path.join(ROOT, "src", "lox.py")
+BENCHMARK_DIR = os.path.join(ROOT, "benchmarks")
+ENGINES = ["tree", "closure", "vm"]
+
+
+def discover(names: list[str] | None) -> list[str]:
+    available = sorted(
+        name[:-len(".lox")] for name in os.listdir(BENCHMARK_DIR) if name.endswith(".lox")
+    )
+    if not names:
+        return available
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise SystemExit(f"unknown benchmark(s): {', '.join(unknown)}, available: {', '.join(available)}")
+    return names
+
+
+def run_once(script: str, engine: str) -> tuple[float, int, int, bytes]:
+    """
+    Runs one script in a fresh interpreter process, returning the wall time,
+    the peak RSS of the child in KB, its exit code and its stdout
+    """
+    with tempfile.TemporaryFile() as out:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, LOX, f"--engine={engine}", "--no-cache", script],
+            stdout=out,
+            stderr=subprocess.DEVNULL,
+        )
+        # wait4 rather than wait, it is the only way to get the child's rusage
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        out.seek(0)
+        output = out.read()
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak_kb = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return seconds, peak_kb, process.returncode, output
+
+
+def measure(name: str, engine: str, repeat: int, expected: bytes | None) -> dict:
+    script = os.path.join(BENCHMARK_DIR, name + ".lox")
+    times = []
+    peak_kb = 0
+    exit_code = 0
+    output = b""
+    for _ in range(repeat):
+        seconds, run_peak_kb, exit_code, output = run_once(script, engine)
+        times.append(seconds)
+        peak_kb = max(peak_kb, run_peak_kb)
+        if exit_code != 0:
+            break
+    return {
+        "benchmark": name,
+        "engine": engine,
+        "times": times,
+        "median": statistics.median(times),
+        "min": min(times),
+        "stddev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "peak_rss_kb": peak_kb,
+        "exit_code": exit_code,
+        # every engine should print what the first one did
+        "output_matches": expected is None or output == expected,
+        "_output": output,
+    }
+
+
+def compare(results: list[dict], baseline: dict, threshold: float) -> list[str]:
+    """Names the results whose median is more than threshold slower than the baseline's"""
+    previous = {(result["benchmark"], result["engine"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        key = (result["benchmark"], result["engine"])
+        if key not in previous:
+            continue
+        ratio = result["median"] / previous[key]["median"]
+        result["baseline_median"] = previous[key]["median"]
+        result["ratio"] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(f"{key[0]} [{key[1]}] {ratio:.2f}x the baseline median")
+    return regressions
+
+
+def report(results: list[dict]) -> None:
+    print(f"{'benchmark':<18} {'engine':<8} {'median':>8} {'min':>8} {'stddev':>8} {'peak rss':>10}  notes")
+    for result in results:
+        notes = []
+        if result["exit_code"] != 0:
+            notes.append(f"exit code {result['exit_code']}")
+        if not result["output_matches"]:
+            notes.append("output differs")
+        if "ratio" in result:
+            notes.append(f"{result['ratio']:.2f}x baseline")
+        print(
+            f"{result['benchmark']:<18} {result['engine']:<8} {result['median']:>7.3f}s {result['min']:>7.3f}s "
+            f"{result['stddev']:>7.3f}s {result['peak_rss_kb'] / 1024:>8.1f}MB  {', '.join(notes)}"
+        )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Runs the Lox benchmarks under each engine")
+    arg_parser.add_argument("benchmarks", nargs="*", help="benchmark names from benchmarks/, defaults to all")
+    arg_parser.add_argument("--engine", choices=ENGINES, action="append",
+                            help="engine(s) to measure, defaults to all")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark and engine")
+    arg_parser.add_argument("--json", dest="json_path", help="write the results to this file")
+    arg_parser.add_argument("--baseline", help="results file from an earlier --json run to compare against")
+    arg_parser.add_argument("--threshold", type=float, default=0.10,
+                            help="slowdown over the baseline median reported as a regression (default 0.10)")
+    args = arg_parser.parse_args()
+    if args.repeat < 1:
+        arg_parser.error("--repeat must be at least 1")
+
+    results = []
+    for name in discover(args.benchmarks):
+        expected = None
+        for engine in args.engine or ENGINES:
+            result = measure(name, engine, args.repeat, expected)
+            if expected is None and result["exit_code"] == 0:
+                expected = result["_output"]
+            del result["_output"]
+            results.append(result)
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    report(results)
+
+    if args.json_path is not None:
+        with open(args.json_path, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeat": args.repeat,
+                "results": results,
+            }, f, indent=2)
+
+    if regressions:
+        print(f"\nregressions over {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    if any(result["exit_code"] != 0 or not result["output_matches"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
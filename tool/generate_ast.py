@@ -7,29 +7,35 @@ def main():
     
     output_dir = sys.argv[1]
     
+    # fields with a default are filled in after parsing: slot/captured and
+    # the frame layout of functions by the Resolver (a slot of None marks a
+    # global), ic_* by the inline caches the Interpreter keeps on property
+    # sites, free_frames by the FramePool. A captured slot holds a Cell shared
+    # with the closures using it
     expr_types = [
-        {"Assign": ["name: Token", "value: Expr"]},
+        {"Assign": ["name: Token", "value: Expr", "slot: Optional[int] = None", "captured: bool = False", "global_slot: Optional[int] = None"]},
         {"Binary": ["left: Expr", "operator: Token", "right: Expr"]},
         {"Call": ["callee: Expr", "paren: Token", "arguments: list[Expr]"]},
-        {"Get": ["obj: Expr", "name: Token"]},
+        {"Get": ["obj: Expr", "name: Token", "ic_shape: Optional[Shape] = None", "ic_index: int = -1", "ic_method: Any = None"]},
         {"Grouping": ["expression: Expr"]},
         {"Literal": ["value: Any"]},
         {"Logical": ["left: Expr", "operator: Token", "right: Expr"]},
-        {"Set": ["obj: Expr", "name: Token", "value: Expr"]},
-        {"This": ["keyword: Token"]},
+        {"Set": ["obj: Expr", "name: Token", "value: Expr", "ic_shape: Optional[Shape] = None", "ic_index: int = -1", "ic_next: Optional[Shape] = None"]},
+        {"This": ["keyword: Token", "slot: Optional[int] = None", "captured: bool = False"]},
         {"Unary": ["operator: Token", "right: Expr"]},
-        {"Variable": ["name: Token"]}
+        {"Variable": ["name: Token", "slot: Optional[int] = None", "captured: bool = False", "global_slot: Optional[int] = None"]}
     ]
     
     stmt_types = [
-        {"Block": ["statements: list[Stmt]"]},
-        {"Class": ["name: Token", "methods: list[Function]"]},
+        {"Block": ["statements: list[Stmt]", "slot_count: int = 0"]},
+        {"Class": ["name: Token", "methods: list[Function]", "slot: Optional[int] = None", "global_slot: Optional[int] = None", "captured: bool = False"]},
         {"Expression": ["expression: Expr"]},
-        {"Function": ["name: Token", "params: list[Token]", "body: list[Stmt]"]},
+        {"For": ["initializer: Stmt", "condition: Expr", "increment: Expr", "body: Stmt", "slot_count: int = 0", "counted: bool = False"]},
+        {"Function": ["name: Token", "params: list[Token]", "body: list[Stmt]", "slot: Optional[int] = None", "slot_count: int = 0", "body_tokens: Optional[list[Token]] = None", "global_slot: Optional[int] = None", "captured: bool = False", "upvalues: tuple[tuple[int, int], ...] = ()", "cell_params: tuple[int, ...] = ()", "free_frames: Optional[list[list]] = None", "blank_frame: tuple = ()"]},
         {"If": ["condition: Expr", "then_branch: Stmt", "else_branch: Stmt"]},
         {"Print": ["expression: Expr"]},
         {"Return": ["keyword: Token", "value: Expr"]},
-        {"Var": ["name: Token", "initializer: Expr"]},
+        {"Var": ["name: Token", "initializer: Expr", "slot: Optional[int] = None", "global_slot: Optional[int] = None", "captured: bool = False"]},
         {"While": ["condition: Expr", "body: Stmt"]}
     ]
     base_types = list(zip(["Expr", "Stmt"], [expr_types, stmt_types]))
@@ -43,16 +49,23 @@ def define_ast(output_dir: str, base_name: str, types: list[dict[str, list[str]]
     with open(path, "w", encoding="UTF-8") as writer:
         lines = ["from __future__ import annotations\n",
                  "from abc import ABC, abstractmethod\n",
-                 "from typing import Any\n",
+                 "from typing import Any, Optional\n",
                  "from token import Token\n",
                  "from visitor import Visitor\n"]
+        if base_name == "Expr":
+            lines += ["from shape import Shape\n"]
         if base_name == "Stmt":
             lines += ["from expr import Expr\n"]
         lines += ["\n",
                   f"class {base_name}(ABC):\n",
+                  "\t__slots__ = ()\n",
                   "\n",
                   f"\tdef __repr__(self):\n",
-                  f"\t\treturn (type(self).__name__) + str(self.__dict__)\n",
+                  f"\t\treturn (type(self).__name__) + str({{name: getattr(self, name) for name in self.__slots__}})\n",
+                  "\n",
+                  "\tdef __reduce__(self):\n",
+                  "\t\t# pickled as the constructor call, every field is an __init__ argument\n",
+                  "\t\treturn (type(self), tuple(getattr(self, name) for name in self.__slots__))\n",
                   "\n"
                   "\t@abstractmethod\n",
                   f"\tdef accept(self, visitor: Visitor):\n",
@@ -86,7 +99,9 @@ def define_visitor(output_dir, base_types):
 
 def define_type(writer, base, classname, fields):
     str_fields = ", ".join(fields)
+    names = [field.split(': ')[0] for field in fields]
     writer.write(f"class {classname}({base}):\n")
+    writer.write(f"\t__slots__ = {tuple(names)!r}\n\n")
     writer.write(f"\tdef __init__(self, {str_fields}):\n")
     for field in fields:
         name = field.split(': ')[0]
@@ -0,0 +1,76 @@
+import argparse
+import os
+import sys
+import time
+
+# the interpreter modules import each other by bare name from src/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from error_handler import ErrorHandler  # noqa: E402
+from regex_scanner import RegexScanner  # noqa: E402
+from scanner import Scanner  # noqa: E402
+
+SCANNERS = {
+    "char": Scanner,
+    "regex": RegexScanner,
+}
+
+# a bit of everything the scanner has to recognise: keywords, identifiers,
+# numbers, strings spanning lines, comments and every operator
+SAMPLE = '''// generated benchmark input
+class Counter {
+  init(start) { this.count = start; }
+  inc(by) { this.count = this.count + by; return this; }
+}
+fun fib(n) {
+  if (n <= 1) return n;
+  return fib(n - 2) + fib(n - 1);
+}
+var counter = Counter(0.5);
+for (var i = 0; i < 100; i = i + 1) {
+  if (i != 3 and !(i >= 50) or i == 99) counter.inc(i * 2 / 3);
+}
+print "counted
+to " + "done";
+print fib(10) > -1;
+'''
+
+
+def generate(size: int) -> str:
+    return SAMPLE * (size // len(SAMPLE) + 1)
+
+
+def bench(scanner_class, source: str, repeat: int) -> tuple[int, float]:
+    best = float("inf")
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = scanner_class(source, ErrorHandler()).scan_tokens()
+        best = min(best, time.perf_counter() - start)
+        count = len(tokens)
+    return count, best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Scanner throughput in tokens per second")
+    arg_parser.add_argument("script", nargs="?", help="Lox file to scan, a generated source is used if missing")
+    arg_parser.add_argument("--size", type=float, default=4.0, help="size of the generated source in MB")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="best of this many runs")
+    arg_parser.add_argument("--scanner", choices=SCANNERS.keys(), action="append",
+                            help="scanner(s) to measure, defaults to all")
+    args = arg_parser.parse_args()
+
+    if args.script is not None:
+        with open(args.script, "r") as f:
+            source = f.read()
+    else:
+        source = generate(int(args.size * 1024 * 1024))
+
+    print(f"source: {len(source) / (1024 * 1024):.1f} MB")
+    for name in args.scanner or SCANNERS.keys():
+        count, seconds = bench(SCANNERS[name], source, args.repeat)
+        print(f"{name:<6} {count:>10} tokens {seconds:8.3f}s {count / seconds:>12,.0f} tokens/s")
+
+
+if __name__ == "__main__":
+    main()